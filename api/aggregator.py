@@ -1,70 +1,148 @@
+import os
+import json
+import time
+import uuid
+import socket
 import logging
+import argparse
+import asyncio
+import multiprocessing
 import requests
 import heapq
-import xmltodict
-from concurrent.futures import ThreadPoolExecutor, wait
+import pymongo
 from collections import defaultdict
-from typing import Optional, List, DefaultDict, Dict, Tuple, Any
-from utils import get_env_var, get_db_connection, upload_db_data, topics
+from typing import Optional, Iterable, List, DefaultDict, Dict, Tuple, Any
+from utils import get_env_var, get_db_connection, publish_db_data, get_paper_key, topics, PAPER_RETENTION_DAYS
+from fetcher import AsyncFetcher
+from http_cache import ResponseCache, CACHE_MODES
+from atom import AtomEntryParser, iter_atom_entries, CHUNK_SIZE
+from seen_store import SeenStore, LayeredSeenStore
+from harvester import ArxivHarvest, WatermarkStore
+from classifier import ClassificationStage, Predictor
+from near_duplicates import NearDuplicateIndex, deduplicate_papers, merge_published_duplicates
+from scheduler import RefreshScheduler, ScheduleStore
+from bm25 import build_search_index
+from indexes import ensure_indexes
+from work_queue import WorkQueue, JOB_LEASE_SECONDS
 from model.predict import load_model, predict_labels
 
 MAX_PAPERS_REQUEST = 25
-NUM_THREADS = 10
+MAX_PAPERS_HARVEST = 100
 LEN_YYYY_MM_DD = 10
-seen_arxiv_papers = set()
-seen_semantic_scholar_papers = set()
+ARXIV_API_URL = "http://export.arxiv.org/api/query?"
+SEMANTIC_SCHOLAR_API_URL = "https://api.semanticscholar.org/graph/v1/paper/search?query="
+SEEN_ARXIV_PAPERS_FILE = "data/seen_arxiv_papers.db"
+SEEN_SEMANTIC_SCHOLAR_PAPERS_FILE = "data/seen_semantic_scholar_papers.db"
+ARXIV_WATERMARKS_FILE = "data/arxiv_watermarks.json"
+REFRESH_SCHEDULE_FILE = "data/refresh_schedule.json"
+WORK_QUEUE_FILE = "data/work_queue.db"
+WORK_QUEUE_POLL_INTERVAL = 1.0
+NEAR_DUPLICATES_FILE = "data/near_duplicates.db"
+seen_arxiv_papers = SeenStore()
+seen_semantic_scholar_papers = SeenStore()
+arxiv_watermarks = WatermarkStore()
+# keys of published papers listed upstream again, publishing keeps them from expiring
+seen_paper_keys = []
 
-def fetch_arxiv(session: requests.Session, id: str) -> Optional[List[DefaultDict[str, list]]]:
-    base_url = "http://export.arxiv.org/api/query?"
+def get_arxiv_url(id: str) -> str:
     param = "sortBy=submittedDate&max_results"
-    url = f"{base_url}search_query=cat:cs.{id}&{param}={MAX_PAPERS_REQUEST}"
+    return f"{ARXIV_API_URL}search_query=cat:cs.{id}&{param}={MAX_PAPERS_REQUEST}"
+
+def get_semantic_scholar_url(name: str) -> str:
+    param = "&year=2023&fieldsOfStudy=Computer+Science&fields=title,url,abstract,publicationDate,authors"
+    return f"{SEMANTIC_SCHOLAR_API_URL}{name}{param}&limit={MAX_PAPERS_REQUEST+50}"
+
+def fetch_arxiv(session: requests.Session, id: str) -> Optional[List[DefaultDict[str, list]]]:
+    result = []
     try:
-        response = session.get(url)
-        json_data = xmltodict.parse(response.text)
+        response = session.get(get_arxiv_url(id), stream=True)
+        for entry in iter_atom_entries(response.iter_content(CHUNK_SIZE)):
+            paper = parse_arxiv_entry(entry, id)
+            if paper:
+                result.append(paper)
     except Exception as error:
         logging.critical(f"Failed to make a GET request to arXiv with topic ID: {id}. Error: {error}")
-        return None
+        # keep papers parsed before the failure since they are already marked as seen
+        return result or None
     else:
-        return parse_arxiv(json_data, id)
+        return result
 
-def parse_arxiv(json_data: Dict[str, Any], id: str) -> List[DefaultDict[str, list]]:
+async def fetch_arxiv_async(fetcher: AsyncFetcher, id: str) -> Optional[List[DefaultDict[str, list]]]:
+    # page back from the newest submission until reaching the last paper ingested for this category,
+    # a category without a watermark only fetches its first page
+    max_papers = MAX_PAPERS_HARVEST if arxiv_watermarks.get(id).get("watermark") else MAX_PAPERS_REQUEST
+    harvest = ArxivHarvest(id, arxiv_watermarks, MAX_PAPERS_REQUEST, max_papers)
     result = []
-    for entry in json_data["feed"]["entry"]:
-        if not entry["id"] or entry["id"] in seen_arxiv_papers:
-            continue
-        paper = defaultdict(list)
-        paper["title"] = entry["title"]
-        paper["date"] = entry["published"][:LEN_YYYY_MM_DD]
-        paper["abstract"] = entry["summary"]
-        paper["url"] = entry["id"]
-        paper["source"] = "arXiv.org"
+    try:
+        while not harvest.done:
+            parser = AtomEntryParser()
+            stream = fetcher.stream(harvest.get_url(ARXIV_API_URL))
+            try:
+                # parse entries while the rest of the page is still downloading
+                async for chunk in stream:
+                    result.extend(parse_arxiv_entries(harvest.take(parser.feed(chunk)), id))
+                    # the rest of a page past the watermark is still read, its papers are still listed
+                    if harvest.done and not harvest.reached_watermark:
+                        break
+                else:
+                    result.extend(parse_arxiv_entries(harvest.take(parser.close()), id))
+            finally:
+                await stream.aclose()
+            harvest.end_page()
+        harvest.finish()
+    except Exception as error:
+        logging.critical(f"Failed to make a GET request to arXiv with topic ID: {id}. Error: {error}")
+        return result or None
+    else:
+        seen_paper_keys.extend(get_paper_key({"url": url}) for url in harvest.listed)
+        return result
 
-        authors = []
-        for author in entry["author"]:
-            if len(author) == 1:
-                authors.append(author["name"])
-        paper["authors"] = authors
-        
-        paper_topics = []
-        for paper_id in entry["category"]:
-            if type(paper_id) == str:
-                continue
-            elif paper_id["@term"][3:] in topics:
-                paper_topics.append(paper_id["@term"][3:])
-        
-        if not paper_topics:
-            paper_topics.append(id)
-        paper["topics"] = paper_topics
-        result.append(paper)
-        seen_arxiv_papers.add(entry["id"])
+def parse_arxiv(json_data: Dict[str, Any], id: str) -> List[DefaultDict[str, list]]:
+    return parse_arxiv_entries(json_data["feed"]["entry"], id)
+
+def parse_arxiv_entries(entries: Iterable[Dict[str, Any]], id: str) -> List[DefaultDict[str, list]]:
+    result = []
+    for entry in entries:
+        paper = parse_arxiv_entry(entry, id)
+        if paper:
+            result.append(paper)
     return result
 
+def parse_arxiv_entry(entry: Dict[str, Any], id: str) -> Optional[DefaultDict[str, list]]:
+    if not entry["id"]:
+        return None
+    if entry["id"] in seen_arxiv_papers:
+        seen_paper_keys.append(get_paper_key({"url": entry["id"]}))
+        return None
+    paper = defaultdict(list)
+    paper["title"] = entry["title"]
+    paper["date"] = entry["published"][:LEN_YYYY_MM_DD]
+    paper["abstract"] = entry["summary"]
+    paper["url"] = entry["id"]
+    paper["source"] = "arXiv.org"
+
+    authors = []
+    for author in entry["author"]:
+        if len(author) == 1:
+            authors.append(author["name"])
+    paper["authors"] = authors
+    
+    paper_topics = []
+    for paper_id in entry["category"]:
+        if type(paper_id) == str:
+            continue
+        elif paper_id["@term"][3:] in topics:
+            paper_topics.append(paper_id["@term"][3:])
+    
+    if not paper_topics:
+        paper_topics.append(id)
+    paper["topics"] = paper_topics
+    seen_arxiv_papers.add(entry["id"])
+    return paper
+
 def fetch_semantic_scholar(session: requests.Session, id: str, name: str) -> Optional[Tuple[List[DefaultDict[str, list]], List[str]]]:
-    base_url = "https://api.semanticscholar.org/graph/v1/paper/search?query="
-    param = "&year=2023&fieldsOfStudy=Computer+Science&fields=title,url,abstract,publicationDate,authors"
-    url = f"{base_url}{name}{param}&limit={MAX_PAPERS_REQUEST+50}"
     try:
-        response = session.get(url)
+        response = session.get(get_semantic_scholar_url(name))
         data = response.json()["data"]
     except Exception as error:
         logging.critical(f"Failed to make a GET request to Semantic Scholar with topic ID: {id}. Error: {error}")
@@ -72,14 +150,29 @@ def fetch_semantic_scholar(session: requests.Session, id: str, name: str) -> Opt
     else:
         return parse_semantic_scholar(data, id)
 
+async def fetch_semantic_scholar_async(fetcher: AsyncFetcher, id: str, name: str) -> Optional[Tuple[List[DefaultDict[str, list]], List[str]]]:
+    try:
+        response = await fetcher.get(get_semantic_scholar_url(name))
+        data = json.loads(response)["data"]
+    except Exception as error:
+        logging.critical(f"Failed to make a GET request to Semantic Scholar with topic ID: {id}. Error: {error}")
+        return None
+    else:
+        return parse_semantic_scholar(data, id)
+
 def parse_semantic_scholar(json_data: List[Dict[str, Any]], id: str) -> Tuple[List[DefaultDict[str, list]], List[str]]:
     min_heap = []
     size = 0
 
     # maintain a min heap of the most recent research papers by date
+    candidates = set()
     for i in range(len(json_data)):
         date = json_data[i]["publicationDate"]
-        if not date or not json_data[i]["abstract"] or json_data[i]["paperId"] in seen_semantic_scholar_papers:
+        paper_id = json_data[i]["paperId"]
+        if paper_id in seen_semantic_scholar_papers:
+            seen_paper_keys.append(get_paper_key(json_data[i]))
+            continue
+        if not date or not json_data[i]["abstract"] or paper_id in candidates:
             continue
         if size < MAX_PAPERS_REQUEST:
             heapq.heappush(min_heap, (date, i))
@@ -88,7 +181,7 @@ def parse_semantic_scholar(json_data: List[Dict[str, Any]], id: str) -> Tuple[Li
                 heapq.heappop(min_heap)
                 heapq.heappush(min_heap, (date, i))
         size += 1
-        seen_semantic_scholar_papers.add(json_data[i]["paperId"])
+        candidates.add(paper_id)
 
     result = []
     abstracts = []
@@ -108,35 +201,232 @@ def parse_semantic_scholar(json_data: List[Dict[str, Any]], id: str) -> Tuple[Li
         paper["topics"] = [id]
         result.append(paper)
         abstracts.append(paper["abstract"])
+        # only papers kept in the heap are ingested, the rest can be picked up by another topic or run
+        seen_semantic_scholar_papers.add(json["paperId"])
     return (result, abstracts)
 
-if __name__ == "__main__":
-    session = requests.Session()
-    executor = ThreadPoolExecutor(NUM_THREADS)
-
-    futures = []
-    for id, name in topics.items():
-        futures.append(executor.submit(fetch_arxiv, session, id))
-        futures.append(executor.submit(fetch_semantic_scholar, session, id, name))
-    session.close()
-    wait(futures)
-    
-    papers = []
+def load_predictor() -> Predictor:
     model, lookup_layer = load_model()
-    for i, future in enumerate(futures):
-        if not future.result():
-            continue
-        if i % 2 == 0:
-            for paper in future.result():
-                papers.append(paper)
-        else:
-            # predict topic areas for Semantic Scholar abstracts
-            data, abstracts = future.result()
-            predicted_labels = predict_labels(model, lookup_layer, abstracts)
-            for i, labels in enumerate(predicted_labels):
-                data[i]["topics"] = labels
-                papers.append(data[i])
-    
+    return lambda abstracts: predict_labels(model, lookup_layer, abstracts)
+
+async def fetch_topics(topics: Dict[str, str], classifier: ClassificationStage, cache: Optional[ResponseCache] = None,
+                       fetcher: Optional[AsyncFetcher] = None, arrivals: Optional[DefaultDict[str, int]] = None) -> List[DefaultDict[str, list]]:
+    if fetcher is None:
+        # every request shares one pooled client, each response is parsed as soon as it completes
+        async with AsyncFetcher(cache=cache) as fetcher:
+            return await fetch_topics(topics, classifier, fetcher=fetcher, arrivals=arrivals)
+    papers = []
+
+    async def collect_arxiv(id: str) -> None:
+        result = await fetch_arxiv_async(fetcher, id)
+        if result is not None:
+            papers.extend(result)
+            if arrivals is not None:
+                arrivals[id] += len(result)
+
+    async def collect_semantic_scholar(id: str, name: str) -> None:
+        result = await fetch_semantic_scholar_async(fetcher, id, name)
+        if result is not None:
+            # predict topic areas for Semantic Scholar abstracts while other topics are still being fetched
+            data, abstracts = result
+            classifier.submit(data)
+            papers.extend(data)
+            if arrivals is not None:
+                arrivals[id] += len(data)
+
+    tasks = [collect_arxiv(id) for id in topics]
+    tasks += [collect_semantic_scholar(id, name) for id, name in topics.items()]
+    await asyncio.gather(*tasks)
+    await classifier.drain()
+    return papers
+
+def publish_papers(papers: List[DefaultDict[str, list]], papers_db: Optional[pymongo.collection.Collection], near_duplicate_index: NearDuplicateIndex) -> bool:
+    # merge the same paper arriving from both sources, in this run or against earlier runs
+    papers, published_duplicates = deduplicate_papers(papers, near_duplicate_index)
+    if papers_db is not None:
+        papers += merge_published_duplicates(papers_db, published_duplicates)
+    seen_keys = list(seen_paper_keys)
+    seen_paper_keys.clear()
+    if publish_db_data(papers_db, papers, seen_keys=seen_keys) is None:
+        # forget this run's progress so a later run fetches the same papers again
+        seen_arxiv_papers.rollback()
+        seen_semantic_scholar_papers.rollback()
+        near_duplicate_index.rollback()
+        arxiv_watermarks.reload()
+        return False
+    seen_arxiv_papers.commit()
+    seen_semantic_scholar_papers.commit()
+    near_duplicate_index.commit()
+    arxiv_watermarks.save()
+    # only servers using the embedded search backend read the index file, they reload it once rebuilt
+    if os.getenv("SEARCH_BACKEND", "atlas") == "bm25":
+        build_search_index(papers_db)
+    return True
+
+async def run_daemon(scheduler: RefreshScheduler, classifier: ClassificationStage, cache: ResponseCache,
+                     papers_db: Optional[pymongo.collection.Collection], near_duplicate_index: NearDuplicateIndex) -> None:
+    # the model and connection pool stay warm between refreshes
+    async with AsyncFetcher(cache=cache) as fetcher:
+        while True:
+            due_topics = scheduler.get_due_topics()
+            if due_topics:
+                fetcher.reset_retry_budget()
+                seen_arxiv_papers.expire(PAPER_RETENTION_DAYS)
+                seen_semantic_scholar_papers.expire(PAPER_RETENTION_DAYS)
+                near_duplicate_index.expire(PAPER_RETENTION_DAYS)
+                arrivals = defaultdict(int)
+                papers = await fetch_topics({id: topics[id] for id in due_topics}, classifier, fetcher=fetcher, arrivals=arrivals)
+                if not publish_papers(papers, papers_db, near_duplicate_index):
+                    arrivals.clear()
+                scheduler.record(arrivals)
+                # topics that failed to fetch or publish are retried after the shortest interval
+                scheduler.defer([id for id in due_topics if id not in arrivals])
+                scheduler.state.save()
+                logging.info(f"Refreshed {len(due_topics)} topics with {len(papers)} new papers: {', '.join(due_topics)}")
+            await asyncio.sleep(scheduler.get_sleep_time())
+
+async def renew_lease(queue: WorkQueue, job: Dict[str, Any], owner: str) -> None:
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        # a write can wait on the database lock for up to the busy timeout, keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, queue.renew, job["id"], owner)
+
+async def work_jobs(queue: WorkQueue, classifier: ClassificationStage, cache: ResponseCache, run: Optional[str] = None) -> None:
+    global seen_arxiv_papers, seen_semantic_scholar_papers, arxiv_watermarks, seen_paper_keys
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    # every queue call can wait on the database lock for up to the busy timeout, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    async with AsyncFetcher(cache=cache) as fetcher:
+        while True:
+            job = await loop.run_in_executor(None, queue.claim, owner)
+            if job is None:
+                # workers started for a run exit once it is done, standalone workers keep polling
+                if run is not None and await loop.run_in_executor(None, queue.is_finished, run):
+                    return
+                await asyncio.sleep(WORK_QUEUE_POLL_INTERVAL)
+                continue
+
+            # the coordinator owns the persistent state, a job reads it and reports back what it changed
+            id, name, watermark = job["payload"]["id"], job["payload"]["name"], job["payload"]["watermark"]
+            seen_arxiv_papers = LayeredSeenStore(SEEN_ARXIV_PAPERS_FILE)
+            seen_semantic_scholar_papers = LayeredSeenStore(SEEN_SEMANTIC_SCHOLAR_PAPERS_FILE)
+            arxiv_watermarks = WatermarkStore()
+            arxiv_watermarks.update(id, **watermark)
+            seen_paper_keys = []
+            fetcher.reset_retry_budget()
+            renewal = asyncio.ensure_future(renew_lease(queue, job, owner))
+            try:
+                papers = await fetch_topics({id: name}, classifier, fetcher=fetcher)
+                await loop.run_in_executor(None, queue.complete, job["id"], owner, {
+                    "id": id,
+                    "papers": papers,
+                    "seen_arxiv_papers": seen_arxiv_papers.added,
+                    "seen_semantic_scholar_papers": seen_semantic_scholar_papers.added,
+                    "seen_paper_keys": seen_paper_keys,
+                    "watermark": arxiv_watermarks.get(id)
+                })
+            except Exception as error:
+                logging.critical(f"Failed to aggregate topic ID: {id}. Error: {error}")
+                await loop.run_in_executor(None, queue.fail, job["id"], owner, str(error))
+            finally:
+                renewal.cancel()
+                seen_arxiv_papers.close()
+                seen_semantic_scholar_papers.close()
+
+def run_worker(queue_path: str, run: Optional[str] = None, cache_mode: str = "revalidate") -> None:
+    # each worker process loads its own model, so parsing and inference scale past one interpreter
+    queue = WorkQueue(queue_path)
+    classifier = ClassificationStage(load_predictor)
+    try:
+        asyncio.run(work_jobs(queue, classifier, ResponseCache(mode=cache_mode), run))
+    finally:
+        classifier.close()
+        queue.close()
+
+def run_coordinator(num_workers: int, cache_mode: str) -> List[DefaultDict[str, list]]:
+    queue = WorkQueue(WORK_QUEUE_FILE)
+    run = uuid.uuid4().hex
+    queue.enqueue(run, [{"id": id, "name": name, "watermark": arxiv_watermarks.get(id)} for id, name in topics.items()])
+
+    # spawn rather than fork, TensorFlow doesn't survive being forked
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(WORK_QUEUE_FILE, run, cache_mode)) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    while not queue.is_finished(run):
+        if workers and not any(worker.is_alive() for worker in workers):
+            logging.critical("Every local worker exited before the work queue was finished")
+            break
+        time.sleep(WORK_QUEUE_POLL_INTERVAL)
+    for worker in workers:
+        worker.join()
+
+    papers = []
+    for result in queue.get_results(run):
+        papers.extend(result["papers"])
+        for key in result["seen_arxiv_papers"]:
+            seen_arxiv_papers.add(key)
+        for key in result["seen_semantic_scholar_papers"]:
+            seen_semantic_scholar_papers.add(key)
+        seen_paper_keys.extend(result["seen_paper_keys"])
+        # replace the topic's harvest state with the one the worker finished with
+        fields = {key: None for key in arxiv_watermarks.get(result["id"])}
+        fields.update(result["watermark"])
+        arxiv_watermarks.update(result["id"], **fields)
+    for failure in queue.get_failures(run):
+        logging.critical(f"Failed to aggregate topic ID: {failure['payload']['id']}. Error: {failure['error']}")
+    queue.delete_run(run)
+    queue.close()
+    return papers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--http-cache", choices=CACHE_MODES, default="revalidate",
+                        help="cache upstream responses, replay serves recorded responses without network access")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and refresh each topic at a cadence matching how often it publishes")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="fetch and classify topics in this many worker processes through the work queue")
+    parser.add_argument("--worker", action="store_true",
+                        help="only process jobs from the work queue, e.g. on another host sharing the data directory")
+    args = parser.parse_args()
+    if args.daemon and args.workers:
+        parser.error("--workers can't be combined with --daemon, the daemon fetches and classifies in process")
+
+    if args.worker:
+        run_worker(WORK_QUEUE_FILE, cache_mode=args.http_cache)
+        raise SystemExit
+
+    # skip papers ingested by previous runs, ids expire alongside the published papers
+    seen_arxiv_papers = SeenStore(SEEN_ARXIV_PAPERS_FILE, PAPER_RETENTION_DAYS)
+    seen_semantic_scholar_papers = SeenStore(SEEN_SEMANTIC_SCHOLAR_PAPERS_FILE, PAPER_RETENTION_DAYS)
+    arxiv_watermarks = WatermarkStore(ARXIV_WATERMARKS_FILE)
+    near_duplicate_index = NearDuplicateIndex(NEAR_DUPLICATES_FILE, PAPER_RETENTION_DAYS)
+    # with worker processes the model is loaded by the workers instead
+    classifier = None if args.workers else ClassificationStage(load_predictor)
+    cache = ResponseCache(mode=args.http_cache)
     username, password = get_env_var()
     papers_db = get_db_connection(username, password, "papers")
-    upload_db_data(papers_db, papers)
\ No newline at end of file
+    # provisioned once per process, publishing only writes papers
+    if papers_db is not None:
+        ensure_indexes({"papers": papers_db})
+    try:
+        if args.daemon:
+            # a refresh harvests at most MAX_PAPERS_HARVEST arXiv papers a page at a time, plus one Semantic Scholar request
+            requests_per_refresh = -(-MAX_PAPERS_HARVEST // MAX_PAPERS_REQUEST) + 1
+            scheduler = RefreshScheduler(topics, ScheduleStore(REFRESH_SCHEDULE_FILE), requests_per_refresh=requests_per_refresh)
+            asyncio.run(run_daemon(scheduler, classifier, cache, papers_db, near_duplicate_index))
+        elif args.workers:
+            papers = run_coordinator(args.workers, args.http_cache)
+            publish_papers(papers, papers_db, near_duplicate_index)
+        else:
+            papers = asyncio.run(fetch_topics(topics, classifier, cache))
+            publish_papers(papers, papers_db, near_duplicate_index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if classifier is not None:
+            classifier.close()
+        seen_arxiv_papers.close()
+        seen_semantic_scholar_papers.close()
+        near_duplicate_index.close()
@@ -1,61 +1,141 @@
+import os
 import hashlib
 import datetime
 import flask_jwt_extended
 from flask import Flask, request, jsonify
 from bson.objectid import ObjectId
-from api.utils import get_env_var, get_db_connection, LRUCache, topics
+from api.utils import get_env_var, get_db_connection, check_db_connection, get_topic_feed_query, get_bookmarks_pipeline, encode_topic_cursor, topics, TOPIC_FEED_SORT
+from api.responses import encode_papers, send_encoded
+from api.search import normalize_query, get_search_backend
+from api.metrics import AppMetrics
+from api.profiling import get_request_profiler
+from api.serving import configure_jwt, create_cache, get_paper_projection, parse_bookmark_uids, TOPIC_PAGE_SIZE, TOPIC_CACHE_TTL, TOPIC_CACHE_MAX_BYTES, SEARCH_PAGE_SIZE, SEARCH_MAX_RESULTS, SEARCH_CACHE_CAPACITY, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_BYTES, JWT_REFRESH_WINDOW, PAPER_VIEWS
 
 app = Flask(__name__)
 jwt = flask_jwt_extended.JWTManager(app)
-lru_cache = LRUCache(10)
 
 username, password, jwt_key = get_env_var(get_jwt_key=True)
 papers_db = get_db_connection(username, password, "papers")
 users_db = get_db_connection(username, password, "users")
+search_backend = get_search_backend(os.getenv("SEARCH_BACKEND", "atlas"), papers_db)
 
-# JWT cookie-based authentication
-app.config["JWT_SECRET_KEY"] = jwt_key
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(days=1)
-app.config["JWT_TOKEN_LOCATION"] = "cookies"
-app.config["JWT_COOKIE_SECURE"] = True
-app.config["JWT_COOKIE_CSRF_PROTECT"] = True
+cache_backend = os.getenv("CACHE_BACKEND", "memory")
+# room for every topic in each named view, entries are dropped as soon as the aggregator publishes new papers
+lru_cache = create_cache("topic", len(topics) * len(PAPER_VIEWS), TOPIC_CACHE_TTL, TOPIC_CACHE_MAX_BYTES, cache_backend)
+# ranked ids per normalized query and the encoded pages served from them
+search_cache = create_cache("search", SEARCH_CACHE_CAPACITY, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_BYTES, cache_backend)
+
+configure_jwt(app, jwt_key)
+# request latency, stage timings and cache counters, scraped from /metrics
+metrics = AppMetrics()
+metrics.init_app(app)
+metrics.watch_cache("topic", lru_cache)
+metrics.watch_cache("search", search_cache)
+# profiles requests carrying the admin token or a random sample of requests, when configured
+profiler = get_request_profiler()
+if profiler is not None:
+    profiler.init_app(app)
+
+@app.route("/api/health", methods=["GET"])
+def health():
+    # the database is only reached here and on the first query, startup doesn't wait for it
+    if check_db_connection(papers_db) and check_db_connection(users_db):
+        return jsonify({"data": "Healthy"}), 200
+    return jsonify({"data": "Database unavailable"}), 503
 
 @app.route("/api/topic/<string:id>", methods=["GET"])
 def topic_query(id: str):
     if id not in topics:
         return jsonify({"data": f"Invalid topic ID: {id}"}), 404
 
-    cache_hit = lru_cache.get(id)
-    if cache_hit:
-        return jsonify(cache_hit), 200
-    
-    response = papers_db.find({"topics": [id]}).limit(10)
-    topic_data = {}
-    for paper in response:
-        paper["_id"] = str(paper["_id"])
-        topic_data[paper["_id"]] = paper
-    lru_cache.put(id, topic_data)
-    return jsonify(topic_data), 200
+    cursor = request.args.get("cursor")
+    query = get_topic_feed_query(id, cursor)
+    if query is None:
+        return jsonify({"data": f"Invalid topic cursor: {cursor}"}), 400
+    projection = get_paper_projection(request.args.get("view"), request.args.get("fields"))
+    if projection is None:
+        return jsonify({"data": "Invalid paper view or fields"}), 400
+    view, projection = projection
+
+    # only first pages of the named views are cached, deeper pages are a short index range scan
+    # and ad-hoc fields projections would evict the views every client shares
+    cache_hit = None
+    cache_key = f"{id}\n{view}"
+    cacheable = cursor is None and view in PAPER_VIEWS
+    if cacheable:
+        lru_cache.sync_generation(papers_db)
+        cache_hit = lru_cache.get(cache_key)
+    if cache_hit is None:
+        with metrics.time_stage("mongo"):
+            papers = list(papers_db.find(query, projection).sort(TOPIC_FEED_SORT).limit(TOPIC_PAGE_SIZE))
+        next_cursor = encode_topic_cursor(papers[-1]) if len(papers) == TOPIC_PAGE_SIZE else None
+        # the cache holds the encoded body, hits are served without serializing again
+        with metrics.time_stage("encode"):
+            cache_hit = (encode_papers(papers), next_cursor)
+        if cacheable:
+            lru_cache.put(cache_key, cache_hit, size=cache_hit[0].size)
+
+    topic_data, next_cursor = cache_hit
+    response = send_encoded(topic_data)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 @app.route("/api/search/<string:query>", methods=["GET"])
 def search_query(query: str):
-    response_pipeline = list(papers_db.aggregate([{
-        "$search": {
-            "index": "papers_index",
-            "text": {
-                "query": query,
-                "path": ["title", "abstract"]
-            }
-        }
-    }, {"$limit": 10}]))
-
-    if not response_pipeline:
+    cursor = request.args.get("cursor", "0")
+    if not cursor.isdigit():
+        return jsonify({"data": f"Invalid search cursor: {cursor}"}), 400
+    offset = int(cursor)
+    projection = get_paper_projection(request.args.get("view"), request.args.get("fields"))
+    if projection is None:
+        return jsonify({"data": "Invalid paper view or fields"}), 400
+    view, projection = projection
+    normalized_query = normalize_query(query)
+    # a query without any word characters can't match anything, don't send it to the backend
+    if not normalized_query:
         return jsonify({"data": f"Empty search result with query: {query}"}), 404
-    search_data = {}
-    for paper in response_pipeline:
-        paper["_id"] = str(paper["_id"])
-        search_data[paper["_id"]] = paper
-    return jsonify(search_data), 200
+
+    search_cache.sync_generation(papers_db)
+    # the ranking is shared by every view, pages are cached per named view
+    page_key = f"{normalized_query}\n{offset}\n{view}"
+    cacheable = view in PAPER_VIEWS
+    cache_hit = search_cache.get(page_key) if cacheable else None
+    if cache_hit is None:
+        # later pages are sliced from the cached ranking instead of running the search again
+        ranked_ids = search_cache.get(normalized_query)
+        if ranked_ids is None:
+            with metrics.time_stage("search"):
+                ranked_ids = search_backend(normalized_query, SEARCH_MAX_RESULTS)
+            search_cache.put(normalized_query, ranked_ids)
+        if not ranked_ids:
+            return jsonify({"data": f"Empty search result with query: {query}"}), 404
+
+        page_ids = ranked_ids[offset:offset+SEARCH_PAGE_SIZE]
+        ranks = {paper_id: i for i, paper_id in enumerate(page_ids)}
+        with metrics.time_stage("mongo"):
+            papers = sorted(papers_db.find({"_id": {"$in": page_ids}}, projection), key=lambda paper: ranks[paper["_id"]])
+        next_cursor = offset + SEARCH_PAGE_SIZE if offset + SEARCH_PAGE_SIZE < len(ranked_ids) else None
+        with metrics.time_stage("encode"):
+            cache_hit = (encode_papers(papers), next_cursor)
+        if cacheable:
+            search_cache.put(page_key, cache_hit, size=cache_hit[0].size)
+
+    search_data, next_cursor = cache_hit
+    response = send_encoded(search_data)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
+
+@app.route("/api/paper/<string:id>", methods=["GET"])
+def paper_query(id: str):
+    if not ObjectId.is_valid(id):
+        return jsonify({"data": f"Invalid paper ID: {id}"}), 400
+    with metrics.time_stage("mongo"):
+        paper = papers_db.find_one({"_id": ObjectId(id)}, PAPER_VIEWS["full"])
+    if paper is None:
+        return jsonify({"data": f"Paper not found: {id}"}), 404
+    return send_encoded(encode_papers([paper]))
 
 @app.route("/api/signup", methods=["POST"])
 def signup():
@@ -134,28 +214,30 @@ def user():
 @flask_jwt_extended.jwt_required()
 def bookmarks():
     credentials = flask_jwt_extended.get_jwt_identity()
-    user = users_db.find_one({"email": credentials})
-    bookmarks = user["bookmarks"]
 
     # get all bookmarked papers
     if request.method == "GET":
-        response = papers_db.find({"_id": {"$in": [ObjectId(paper_id) for paper_id in bookmarks]}})
-        bookmark_data = {}
-        for paper in response:
-            paper["_id"] = str(paper["_id"])
-            bookmark_data[paper["_id"]] = paper
-        return jsonify(bookmark_data), 200
-    
-    # add a paper to the bookmarks list
-    elif request.method == "POST":
-        paper_uid = request.get_json()["uid"]
-        users_db.update_one({"email": user["email"]}, {"$addToSet": {"bookmarks": paper_uid}})
+        projection = get_paper_projection(request.args.get("view"), request.args.get("fields"))
+        if projection is None:
+            return jsonify({"data": "Invalid paper view or fields"}), 400
+        with metrics.time_stage("mongo"):
+            response = list(users_db.aggregate(get_bookmarks_pipeline(credentials, papers_db.name, projection[1])))
+        with metrics.time_stage("encode"):
+            bookmarks_data = encode_papers(response[0]["papers"] if response else [])
+        return send_encoded(bookmarks_data)
+
+    uids = parse_bookmark_uids(request.get_json())
+    if uids is None:
+        return jsonify({"data": "Bookmark request JSON must contain a valid \'uid\' or \'uids\' list"}), 400
+
+    # add papers to the bookmarks list
+    if request.method == "POST":
+        users_db.update_one({"email": credentials}, {"$addToSet": {"bookmarks": {"$each": uids}}})
         return jsonify({"data": "Bookmark addition successful"}), 201
     
-    # delete a paper from the bookmarks list
+    # delete papers from the bookmarks list
     else:
-        paper_uid = request.get_json()["uid"]
-        users_db.update_one({"email": user["email"]}, {"$pull": {"bookmarks": paper_uid}})
+        users_db.update_one({"email": credentials}, {"$pullAll": {"bookmarks": uids}})
         return jsonify({"data": "Bookmark deletion successful"}), 200
 
 @app.after_request
@@ -163,7 +245,7 @@ def refresh_expiring_jwts(response):
     try:
         expiry = flask_jwt_extended.get_jwt()["exp"]
         now = datetime.datetime.now(datetime.timezone.utc)
-        ten_mins_from_now = datetime.datetime.timestamp(now + datetime.timedelta(minutes=10))
+        ten_mins_from_now = datetime.datetime.timestamp(now + JWT_REFRESH_WINDOW)
 
         if expiry < ten_mins_from_now:
             user = flask_jwt_extended.get_jwt_identity()
@@ -0,0 +1,367 @@
+import os
+import asyncio
+import hashlib
+import datetime
+import functools
+import jwt
+import flask_jwt_extended
+from flask import Flask
+from aiohttp import web
+from flask_jwt_extended.config import config as jwt_config
+from bson.objectid import ObjectId
+from typing import Awaitable, Callable, Union, Dict, Any
+from api.utils import get_env_var, get_async_db_connection, check_async_db_connection, get_async_generation, get_topic_feed_query, get_bookmarks_pipeline, encode_topic_cursor, LRUCache, topics, TOPIC_FEED_SORT
+from api.responses import EncodedResponse, encode_papers
+from api.search import normalize_query, get_async_search_backend
+from api.metrics import AsyncAppMetrics
+from api.serving import configure_jwt, create_cache, get_paper_projection, parse_bookmark_uids, TOPIC_PAGE_SIZE, TOPIC_CACHE_TTL, TOPIC_CACHE_MAX_BYTES, SEARCH_PAGE_SIZE, SEARCH_MAX_RESULTS, SEARCH_CACHE_CAPACITY, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_BYTES, JWT_REFRESH_WINDOW, PAPER_VIEWS
+
+ASYNC_PORT = 5000
+
+PAPERS_DB = web.AppKey("papers_db", Any)
+USERS_DB = web.AppKey("users_db", Any)
+SEARCH_BACKEND = web.AppKey("search_backend", Callable[[str, int], Awaitable[Any]])
+TOPIC_CACHE = web.AppKey("topic_cache", LRUCache)
+SEARCH_CACHE = web.AppKey("search_cache", LRUCache)
+JWT_APP = web.AppKey("jwt_app", Flask)
+IN_FLIGHT = web.AppKey("in_flight", Dict[str, asyncio.Future])
+METRICS = web.AppKey("metrics", AsyncAppMetrics)
+
+def send_json(data: Any, status: int = 200) -> web.Response:
+    return web.json_response({"data": data}, status=status)
+
+def send_encoded(request: web.Request, encoded: EncodedResponse, status: int = 200) -> web.Response:
+    use_gzip = encoded.gzip_body is not None and "gzip" in request.headers.get("Accept-Encoding", "")
+    # each content coding is a different representation, so it gets its own strong validator
+    etag = f"{encoded.etag}-gzip" if use_gzip else encoded.etag
+    if_none_match = request.if_none_match or ()
+    if any(match.value in (etag, "*") for match in if_none_match):
+        response = web.Response(status=304)
+    else:
+        response = web.Response(body=encoded.gzip_body if use_gzip else encoded.body, status=status, content_type="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.etag = etag
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+async def load_once(app: web.Application, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    # concurrent misses on one key share a single database round trip instead of stampeding it
+    in_flight = app[IN_FLIGHT]
+    if key not in in_flight:
+        in_flight[key] = asyncio.ensure_future(load())
+        in_flight[key].add_done_callback(lambda _: in_flight.pop(key, None))
+    # a client hanging up doesn't cancel the load other requests are waiting on
+    return await asyncio.shield(in_flight[key])
+
+async def sync_generation(app: web.Application, cache: LRUCache) -> None:
+    if cache.is_generation_due():
+        cache.set_generation(await get_async_generation(app[PAPERS_DB]))
+
+def create_access_token(app: web.Application, identity: str) -> str:
+    # tokens are encoded by flask_jwt_extended so sessions carry over between the Flask and async servers
+    with app[JWT_APP].app_context():
+        return flask_jwt_extended.create_access_token(identity=identity)
+
+def set_access_cookies(app: web.Application, response: web.Response, access_token: str) -> None:
+    with app[JWT_APP].app_context():
+        csrf_token = flask_jwt_extended.get_csrf_token(access_token)
+        cookie = {"secure": jwt_config.cookie_secure, "samesite": jwt_config.cookie_samesite, "domain": jwt_config.cookie_domain, "max_age": jwt_config.cookie_max_age}
+        response.set_cookie(jwt_config.access_cookie_name, access_token, httponly=True, path=jwt_config.access_cookie_path, **cookie)
+        response.set_cookie(jwt_config.access_csrf_cookie_name, csrf_token, httponly=False, path=jwt_config.access_csrf_cookie_path, **cookie)
+
+def unset_jwt_cookies(app: web.Application, response: web.Response) -> None:
+    with app[JWT_APP].app_context():
+        cookie = {"secure": jwt_config.cookie_secure, "samesite": jwt_config.cookie_samesite, "domain": jwt_config.cookie_domain, "max_age": 0, "expires": "Thu, 01 Jan 1970 00:00:00 GMT"}
+        response.set_cookie(jwt_config.access_cookie_name, "", httponly=True, path=jwt_config.access_cookie_path, **cookie)
+        response.set_cookie(jwt_config.access_csrf_cookie_name, "", httponly=False, path=jwt_config.access_csrf_cookie_path, **cookie)
+
+def verify_jwt(request: web.Request) -> Union[Dict[str, Any], web.Response]:
+    # the cookie and double submit checks of jwt_required, with the same error bodies
+    with request.app[JWT_APP].app_context():
+        access_token = request.cookies.get(jwt_config.access_cookie_name)
+        if not access_token:
+            return web.json_response({"msg": f'Missing cookie "{jwt_config.access_cookie_name}"'}, status=401)
+        try:
+            claims = flask_jwt_extended.decode_token(access_token)
+        except jwt.ExpiredSignatureError:
+            return web.json_response({"msg": "Token has expired"}, status=401)
+        except jwt.InvalidTokenError as error:
+            return web.json_response({"msg": str(error)}, status=422)
+        if claims.get("type") != "access":
+            return web.json_response({"msg": "Only non-refresh tokens are allowed"}, status=422)
+        if jwt_config.cookie_csrf_protect and request.method in jwt_config.csrf_request_methods:
+            csrf_token = request.headers.get(jwt_config.access_csrf_header_name)
+            if not csrf_token:
+                return web.json_response({"msg": "Missing CSRF token"}, status=401)
+            if csrf_token != claims.get("csrf"):
+                return web.json_response({"msg": "CSRF double submit tokens do not match"}, status=401)
+    return claims
+
+def jwt_required(handler: Callable[[web.Request, Dict[str, Any]], Awaitable[web.Response]]) -> Callable[[web.Request], Awaitable[web.Response]]:
+    @functools.wraps(handler)
+    async def wrapper(request: web.Request) -> web.Response:
+        claims = verify_jwt(request)
+        if isinstance(claims, web.Response):
+            return claims
+        response = await handler(request, claims)
+
+        # refresh expiring tokens, as the Flask server's after_request hook does for requests that passed jwt_required
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if claims["exp"] < datetime.datetime.timestamp(now + JWT_REFRESH_WINDOW):
+            response = send_json("JWT refresh successful")
+            set_access_cookies(request.app, response, create_access_token(request.app, claims["sub"]))
+        return response
+    return wrapper
+
+async def get_json(request: web.Request) -> Any:
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be valid JSON")
+
+async def health(request: web.Request) -> web.Response:
+    # the database is only reached here and on the first query, startup doesn't wait for it
+    if await check_async_db_connection(request.app[PAPERS_DB]) and await check_async_db_connection(request.app[USERS_DB]):
+        return send_json("Healthy")
+    return send_json("Database unavailable", 503)
+
+async def topic_query(request: web.Request) -> web.Response:
+    app = request.app
+    id = request.match_info["id"]
+    if id not in topics:
+        return send_json(f"Invalid topic ID: {id}", 404)
+
+    cursor = request.query.get("cursor")
+    query = get_topic_feed_query(id, cursor)
+    if query is None:
+        return send_json(f"Invalid topic cursor: {cursor}", 400)
+    projection = get_paper_projection(request.query.get("view"), request.query.get("fields"))
+    if projection is None:
+        return send_json("Invalid paper view or fields", 400)
+    view, projection = projection
+
+    async def load():
+        with app[METRICS].time_stage("mongo"):
+            papers = await app[PAPERS_DB].find(query, projection).sort(TOPIC_FEED_SORT).limit(TOPIC_PAGE_SIZE).to_list()
+        next_cursor = encode_topic_cursor(papers[-1]) if len(papers) == TOPIC_PAGE_SIZE else None
+        with app[METRICS].time_stage("encode"):
+            return (encode_papers(papers), next_cursor)
+
+    # only first pages of the named views are cached, deeper pages are a short index range scan
+    # and ad-hoc fields projections would evict the views every client shares
+    if cursor is None and view in PAPER_VIEWS:
+        cache_key = f"{id}\n{view}"
+        await sync_generation(app, app[TOPIC_CACHE])
+        cache_hit = app[TOPIC_CACHE].get(cache_key)
+        if cache_hit is None:
+            cache_hit = await load_once(app, f"topic\n{cache_key}", load)
+            app[TOPIC_CACHE].put(cache_key, cache_hit, size=cache_hit[0].size)
+    else:
+        cache_hit = await load()
+
+    topic_data, next_cursor = cache_hit
+    response = send_encoded(request, topic_data)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+async def search_query(request: web.Request) -> web.Response:
+    app = request.app
+    query = request.match_info["query"]
+    cursor = request.query.get("cursor", "0")
+    if not cursor.isdigit():
+        return send_json(f"Invalid search cursor: {cursor}", 400)
+    offset = int(cursor)
+    projection = get_paper_projection(request.query.get("view"), request.query.get("fields"))
+    if projection is None:
+        return send_json("Invalid paper view or fields", 400)
+    view, projection = projection
+    normalized_query = normalize_query(query)
+    # a query without any word characters can't match anything, don't send it to the backend
+    if not normalized_query:
+        return send_json(f"Empty search result with query: {query}", 404)
+
+    search_cache = app[SEARCH_CACHE]
+    await sync_generation(app, search_cache)
+    # the ranking is shared by every view, pages are cached per named view
+    page_key = f"{normalized_query}\n{offset}\n{view}"
+    cacheable = view in PAPER_VIEWS
+    cache_hit = search_cache.get(page_key) if cacheable else None
+    if cache_hit is None:
+        # later pages are sliced from the cached ranking instead of running the search again
+        ranked_ids = search_cache.get(normalized_query)
+        if ranked_ids is None:
+            with app[METRICS].time_stage("search"):
+                ranked_ids = await load_once(app, f"search\n{normalized_query}", lambda: app[SEARCH_BACKEND](normalized_query, SEARCH_MAX_RESULTS))
+            search_cache.put(normalized_query, ranked_ids)
+        if not ranked_ids:
+            return send_json(f"Empty search result with query: {query}", 404)
+
+        async def load():
+            page_ids = ranked_ids[offset:offset+SEARCH_PAGE_SIZE]
+            ranks = {paper_id: i for i, paper_id in enumerate(page_ids)}
+            with app[METRICS].time_stage("mongo"):
+                papers = sorted(await app[PAPERS_DB].find({"_id": {"$in": page_ids}}, projection).to_list(), key=lambda paper: ranks[paper["_id"]])
+            next_cursor = offset + SEARCH_PAGE_SIZE if offset + SEARCH_PAGE_SIZE < len(ranked_ids) else None
+            with app[METRICS].time_stage("encode"):
+                return (encode_papers(papers), next_cursor)
+
+        cache_hit = await load_once(app, f"search page\n{page_key}", load)
+        if cacheable:
+            search_cache.put(page_key, cache_hit, size=cache_hit[0].size)
+
+    search_data, next_cursor = cache_hit
+    response = send_encoded(request, search_data)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response
+
+async def paper_query(request: web.Request) -> web.Response:
+    id = request.match_info["id"]
+    if not ObjectId.is_valid(id):
+        return send_json(f"Invalid paper ID: {id}", 400)
+    with request.app[METRICS].time_stage("mongo"):
+        paper = await request.app[PAPERS_DB].find_one({"_id": ObjectId(id)}, PAPER_VIEWS["full"])
+    if paper is None:
+        return send_json(f"Paper not found: {id}", 404)
+    return send_encoded(request, encode_papers([paper]))
+
+async def signup(request: web.Request) -> web.Response:
+    credentials = await get_json(request)
+    credentials["password"] = hashlib.sha256(credentials["password"].encode("utf-8")).hexdigest()
+    user = await request.app[USERS_DB].find_one({"email": credentials["email"]})
+
+    if not user:
+        credentials["bookmarks"] = []
+        await request.app[USERS_DB].insert_one(credentials)
+        return send_json("Signup successful", 201)
+    return send_json("Signup unsuccessful, user already exists", 409)
+
+async def login(request: web.Request) -> web.Response:
+    credentials = await get_json(request)
+    encrypted_password = hashlib.sha256(credentials["password"].encode("utf-8")).hexdigest()
+    user = await request.app[USERS_DB].find_one({"email": credentials["email"]})
+
+    if user and encrypted_password == user["password"]:
+        # create double submit protection cookies to prevent CSRF attacks
+        response = send_json("Login successful")
+        set_access_cookies(request.app, response, create_access_token(request.app, user["email"]))
+        return response
+    return send_json("Login unsuccessful, user not found", 401)
+
+async def logout(request: web.Request) -> web.Response:
+    response = send_json("Logout successful")
+    unset_jwt_cookies(request.app, response)
+    return response
+
+@jwt_required
+async def user(request: web.Request, claims: Dict[str, Any]) -> web.Response:
+    app = request.app
+    credentials = claims["sub"]
+
+    # get email
+    if request.method == "GET":
+        return web.json_response(credentials)
+
+    elif request.method == "PUT":
+        user = await app[USERS_DB].find_one({"email": credentials})
+        new_credentials = await get_json(request)
+
+        # update email
+        if "email" in new_credentials:
+            if new_credentials["email"] == user["email"]:
+                return send_json("Email update unsuccessful", 409)
+            await app[USERS_DB].update_one({"email": credentials}, {"$set": {"email": new_credentials["email"]}})
+            response = send_json("Email update successful")
+            set_access_cookies(app, response, create_access_token(app, new_credentials["email"]))
+            return response
+
+        # update password
+        elif "password" in new_credentials:
+            encrypted_password = hashlib.sha256(new_credentials["password"].encode("utf-8")).hexdigest()
+            if encrypted_password == user["password"]:
+                return send_json("Password update unsuccessful", 409)
+            await app[USERS_DB].update_one({"email": credentials}, {"$set": {"password": encrypted_password}})
+            return send_json("Password update successful")
+
+        else:
+            return send_json("PUT request JSON must contain an \'email\' or \'password\' key", 409)
+
+    # delete account
+    else:
+        await app[USERS_DB].delete_one({"email": credentials})
+        response = send_json("Account deletion successful")
+        unset_jwt_cookies(app, response)
+        return response
+
+@jwt_required
+async def bookmarks(request: web.Request, claims: Dict[str, Any]) -> web.Response:
+    app = request.app
+    credentials = claims["sub"]
+
+    # get all bookmarked papers
+    if request.method == "GET":
+        projection = get_paper_projection(request.query.get("view"), request.query.get("fields"))
+        if projection is None:
+            return send_json("Invalid paper view or fields", 400)
+        with app[METRICS].time_stage("mongo"):
+            response = await (await app[USERS_DB].aggregate(get_bookmarks_pipeline(credentials, app[PAPERS_DB].name, projection[1]))).to_list()
+        with app[METRICS].time_stage("encode"):
+            bookmarks_data = encode_papers(response[0]["papers"] if response else [])
+        return send_encoded(request, bookmarks_data)
+
+    uids = parse_bookmark_uids(await get_json(request))
+    if uids is None:
+        return send_json("Bookmark request JSON must contain a valid \'uid\' or \'uids\' list", 400)
+
+    # add papers to the bookmarks list
+    if request.method == "POST":
+        await app[USERS_DB].update_one({"email": credentials}, {"$addToSet": {"bookmarks": {"$each": uids}}})
+        return send_json("Bookmark addition successful", 201)
+
+    # delete papers from the bookmarks list
+    else:
+        await app[USERS_DB].update_one({"email": credentials}, {"$pullAll": {"bookmarks": uids}})
+        return send_json("Bookmark deletion successful")
+
+def build_app(papers_db: Any, users_db: Any, jwt_key: str, search_backend: str = "atlas", cache_backend: str = "memory") -> web.Application:
+    app = web.Application()
+    app[PAPERS_DB] = papers_db
+    app[USERS_DB] = users_db
+    app[SEARCH_BACKEND] = get_async_search_backend(search_backend, papers_db)
+    # room for every topic in each named view, entries are dropped as soon as the aggregator publishes new papers
+    app[TOPIC_CACHE] = create_cache("topic", len(topics) * len(PAPER_VIEWS), TOPIC_CACHE_TTL, TOPIC_CACHE_MAX_BYTES, cache_backend)
+    # ranked ids per normalized query and the encoded pages served from them
+    app[SEARCH_CACHE] = create_cache("search", SEARCH_CACHE_CAPACITY, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_BYTES, cache_backend)
+    app[IN_FLIGHT] = {}
+    # request latency, stage timings and cache counters, scraped from /metrics
+    app[METRICS] = AsyncAppMetrics()
+    app[METRICS].init_app(app)
+    app[METRICS].watch_cache("topic", app[TOPIC_CACHE])
+    app[METRICS].watch_cache("search", app[SEARCH_CACHE])
+    app[JWT_APP] = Flask(__name__)
+    flask_jwt_extended.JWTManager(app[JWT_APP])
+    configure_jwt(app[JWT_APP], jwt_key)
+
+    app.router.add_get("/api/health", health)
+    app.router.add_get("/api/topic/{id}", topic_query)
+    app.router.add_get("/api/search/{query}", search_query)
+    app.router.add_get("/api/paper/{id}", paper_query)
+    app.router.add_post("/api/signup", signup)
+    app.router.add_post("/api/login", login)
+    app.router.add_post("/api/logout", logout)
+    for method in ["GET", "PUT", "DELETE"]:
+        app.router.add_route(method, "/api/user", user)
+    for method in ["GET", "POST", "DELETE"]:
+        app.router.add_route(method, "/api/bookmarks", bookmarks)
+    return app
+
+def create_app() -> web.Application:
+    username, password, jwt_key = get_env_var(get_jwt_key=True)
+    papers_db = get_async_db_connection(username, password, "papers")
+    users_db = get_async_db_connection(username, password, "users")
+    return build_app(papers_db, users_db, jwt_key, os.getenv("SEARCH_BACKEND", "atlas"), os.getenv("CACHE_BACKEND", "memory"))
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=int(os.getenv("PORT", ASYNC_PORT)))
@@ -0,0 +1,55 @@
+import xml.etree.ElementTree as ET
+from typing import Optional, Iterable, Iterator, List, Dict, Any
+
+ATOM_NAMESPACE = "{http://www.w3.org/2005/Atom}"
+CHUNK_SIZE = 64 * 1024
+
+def get_local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def get_text(element: ET.Element) -> Optional[str]:
+    return element.text.strip() if element.text else None
+
+def element_to_entry(element: ET.Element) -> Dict[str, Any]:
+    # same keys and shapes that xmltodict produces for an entry, except author and category are always lists
+    entry = {"author": [], "category": []}
+    for child in element:
+        name = get_local_name(child.tag)
+        if name == "author":
+            entry["author"].append({get_local_name(field.tag): get_text(field) for field in child})
+        elif name == "category":
+            entry["category"].append({f"@{key}": value for key, value in child.attrib.items()})
+        elif name != "link":
+            entry[name] = get_text(child)
+    return entry
+
+class AtomEntryParser:
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root = None
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        self.parser.feed(chunk)
+        return self.read_entries()
+
+    def close(self) -> List[Dict[str, Any]]:
+        self.parser.close()
+        return self.read_entries()
+
+    def read_entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        for event, element in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = element
+            elif element.tag == f"{ATOM_NAMESPACE}entry":
+                entries.append(element_to_entry(element))
+                # drop each parsed entry from the tree so memory stays bounded by one entry
+                self.root.remove(element)
+        return entries
+
+def iter_atom_entries(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    parser = AtomEntryParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
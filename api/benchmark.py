@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import threading
+import tempfile
+import functools
+import mongomock
+import pymongo
+import xmltodict
+from aiohttp import web
+from collections import defaultdict
+from xml.sax.saxutils import escape
+from typing import Callable, Optional, List, Dict, Any
+import aggregator
+from utils import topics
+from seen_store import SeenStore
+from harvester import WatermarkStore
+from classifier import ClassificationStage
+from near_duplicates import NearDuplicateIndex
+
+MOCKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "mocks")
+
+class MockUpstreams:
+    # local stand-ins for the arXiv and Semantic Scholar APIs with generated feeds of a configurable size and latency
+    def __init__(self, papers_per_topic: int, latency: float, overlap: float):
+        self.papers_per_topic = papers_per_topic
+        self.latency = latency
+        self.overlap = overlap
+        self.request_counts = defaultdict(int)
+        with open(f"{MOCKS_DIR}/arxiv_api_mock.xml", "r") as file:
+            self.abstracts = [entry["summary"] for entry in xmltodict.parse(file.read())["feed"]["entry"]]
+        with open(f"{MOCKS_DIR}/semantic_scholar_api_mock.json", "r") as file:
+            self.abstracts += [paper["abstract"] for paper in json.load(file)]
+        self.words = sorted({word.strip(".,()").lower() for abstract in self.abstracts for word in abstract.split() if len(word) > 3})
+        self.loop = None
+        self.runner = None
+        self.port = None
+
+    def get_title(self, id: str, i: int) -> str:
+        random_state = random.Random(f"{id}{i}")
+        return " ".join(random_state.choice(self.words) for _ in range(8)).capitalize()
+
+    def get_arxiv_feed(self, id: str, start: int, max_results: int) -> str:
+        entries = []
+        for i in range(start, min(start + max_results, self.papers_per_topic)):
+            published = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1684000000 - i * 60))
+            entries.append(f"""  <entry>
+    <id>http://arxiv.org/abs/{id}.{i:05d}v1</id>
+    <published>{published}</published>
+    <title>{escape(self.get_title(id, i))}</title>
+    <summary>{escape(self.abstracts[i % len(self.abstracts)])}</summary>
+    <author><name>Author {i}</name></author>
+    <author><name>Author {i + 1}</name></author>
+    <category term="cs.{id}" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>""")
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">\n' + "\n".join(entries) + "\n</feed>"
+
+    def get_semantic_scholar_data(self, id: str, limit: int) -> Dict[str, Any]:
+        data = []
+        for i in range(min(limit, self.papers_per_topic)):
+            # a share of the papers are also published on arXiv to exercise near-duplicate merging
+            title = self.get_title(id, i) if i < self.overlap * self.papers_per_topic else self.get_title(f"s2{id}", i)
+            data.append({
+                "paperId": f"{id}{i:036d}",
+                "url": f"https://www.semanticscholar.org/paper/{id}{i:036d}",
+                "title": title,
+                "abstract": self.abstracts[i % len(self.abstracts)],
+                "publicationDate": time.strftime("%Y-%m-%d", time.gmtime(1684000000 - i * 86400)),
+                "authors": [{"name": f"Author {i}"}, {"name": f"Author {i + 1}"}]
+            })
+        return {"data": data}
+
+    async def handle_arxiv(self, request: web.Request) -> web.Response:
+        self.request_counts["arXiv"] += 1
+        await asyncio.sleep(self.latency)
+        id = request.query["search_query"].split(".", 1)[1]
+        feed = self.get_arxiv_feed(id, int(request.query.get("start", 0)), int(request.query["max_results"]))
+        return web.Response(text=feed, content_type="application/atom+xml")
+
+    async def handle_semantic_scholar(self, request: web.Request) -> web.Response:
+        self.request_counts["Semantic Scholar"] += 1
+        await asyncio.sleep(self.latency)
+        id = request.query["benchmark_topic"]
+        return web.json_response(self.get_semantic_scholar_data(id, int(request.query["limit"])))
+
+    def start(self) -> None:
+        started = threading.Event()
+
+        async def serve() -> None:
+            app = web.Application()
+            app.router.add_get("/api/query", self.handle_arxiv)
+            app.router.add_get("/graph/v1/paper/search", self.handle_semantic_scholar)
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, "127.0.0.1", 0)
+            await site.start()
+            self.port = self.runner.addresses[0][1]
+            started.set()
+
+        # serve from a separate thread so upstream latency doesn't share the pipeline's event loop
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(serve(), self.loop)
+        started.wait()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+class PassthroughClassificationStage(ClassificationStage):
+    # papers keep the topic they were fetched for when no trained model is available
+    def __init__(self):
+        super().__init__(lambda: None)
+
+    def submit(self, papers: List[Dict[str, Any]]) -> None:
+        pass
+
+def timed(function: Callable, timings: Dict[str, float], stage: str) -> Callable:
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+    return wrapper
+
+def get_topics(num_topics: int) -> Dict[str, str]:
+    benchmark_topics = {}
+    for i in range(num_topics):
+        id = list(topics)[i] if i < len(topics) else f"X{i}"
+        benchmark_topics[id] = f"{topics.get(id, id)}&benchmark_topic={id}"
+    return benchmark_topics
+
+def run_pipeline(benchmark_topics: Dict[str, str], papers_db: pymongo.collection.Collection, use_model: bool, search_index_path: str) -> Dict[str, Any]:
+    timings = defaultdict(float)
+    aggregator.seen_arxiv_papers = SeenStore()
+    aggregator.seen_semantic_scholar_papers = SeenStore()
+    aggregator.arxiv_watermarks = WatermarkStore()
+    aggregator.seen_paper_keys = []
+    aggregator.parse_arxiv_entry = timed(original_parse_arxiv_entry, timings, "parse")
+    aggregator.parse_semantic_scholar = timed(original_parse_semantic_scholar, timings, "parse")
+    # the production publish path, with its stages timed and the search index kept out of the data directory
+    counts = []
+    def publish_db_data(*args, **kwargs) -> Optional[Dict[str, int]]:
+        counts.append(original_publish_db_data(*args, **kwargs))
+        return counts[-1]
+    aggregator.deduplicate_papers = timed(original_deduplicate_papers, timings, "deduplicate")
+    aggregator.publish_db_data = timed(publish_db_data, timings, "publish")
+    aggregator.build_search_index = timed(functools.partial(original_build_search_index, path=search_index_path), timings, "search index")
+
+    if use_model:
+        def load_predictor():
+            return timed(aggregator.load_predictor(), timings, "classify (busy)")
+        classifier = ClassificationStage(load_predictor)
+        classifier.predictor.result()
+    else:
+        classifier = PassthroughClassificationStage()
+
+    start = time.perf_counter()
+    papers = asyncio.run(aggregator.fetch_topics(benchmark_topics, classifier))
+    timings["fetch + parse + classify"] = time.perf_counter() - start
+    classifier.close()
+
+    start = time.perf_counter()
+    published = aggregator.publish_papers(papers, papers_db, NearDuplicateIndex())
+    timings["deduplicate + publish"] = time.perf_counter() - start
+    timings["total"] = timings["fetch + parse + classify"] + timings["deduplicate + publish"]
+    return {"timings": timings, "papers": len(papers), "published": published, "counts": counts[-1] if counts else None}
+
+original_parse_arxiv_entry = aggregator.parse_arxiv_entry
+original_parse_semantic_scholar = aggregator.parse_semantic_scholar
+original_deduplicate_papers = aggregator.deduplicate_papers
+original_publish_db_data = aggregator.publish_db_data
+original_build_search_index = aggregator.build_search_index
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Benchmark the aggregator pipeline against local mock upstreams")
+    parser.add_argument("--topics", type=int, default=len(topics), help="number of topics, ids past the 38 real ones are synthetic")
+    parser.add_argument("--papers", type=int, default=aggregator.MAX_PAPERS_REQUEST, help="papers per topic and source")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds of latency added to every upstream response")
+    parser.add_argument("--overlap", type=float, default=0.2, help="share of Semantic Scholar papers also returned by arXiv")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--model", action="store_true", help="classify with the trained model instead of keeping fetched topics")
+    parser.add_argument("--mongodb-uri", help="publish to this MongoDB deployment instead of mongomock")
+    parser.add_argument("--search-backend", choices=["atlas", "bm25"], default=os.getenv("SEARCH_BACKEND", "atlas"),
+                        help="the aggregator only builds the search index for bm25")
+    args = parser.parse_args(argv)
+    os.environ["SEARCH_BACKEND"] = args.search_backend
+
+    upstreams = MockUpstreams(args.papers, args.latency, args.overlap)
+    upstreams.start()
+    aggregator.ARXIV_API_URL = f"http://127.0.0.1:{upstreams.port}/api/query?"
+    aggregator.SEMANTIC_SCHOLAR_API_URL = f"http://127.0.0.1:{upstreams.port}/graph/v1/paper/search?query="
+    aggregator.MAX_PAPERS_REQUEST = args.papers
+    client = pymongo.MongoClient(args.mongodb_uri) if args.mongodb_uri else mongomock.MongoClient()
+    papers_db = client["benchmark"]["papers"]
+    papers_db.delete_many({})
+
+    benchmark_topics = get_topics(args.topics)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(args.runs):
+            upstreams.request_counts.clear()
+            result = run_pipeline(benchmark_topics, papers_db, args.model, os.path.join(directory, "search_index.bin"))
+            result["requests"] = dict(upstreams.request_counts)
+            results.append(result)
+            timings = result["timings"]
+            print(f"Run {run + 1}: {result['papers']} papers from {args.topics} topics, publish counts: {result['counts']}")
+            for stage, seconds in timings.items():
+                print(f"  {stage:<28}{seconds:>9.3f}s")
+            print(f"  {'throughput':<28}{result['papers'] / timings['total']:>9.1f} papers/s")
+            print(f"  {'requests':<28}{result['requests']}")
+    # ru_maxrss is reported in kilobytes on Linux
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+    upstreams.stop()
+    papers_db.drop()
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import re
+import math
+import mmap
+import json
+import time
+import heapq
+import struct
+import logging
+import threading
+import pymongo
+from array import array
+from collections import defaultdict
+from bson.objectid import ObjectId
+from typing import Optional, Iterable, List, Tuple
+
+# resolved from this file, so the aggregator and servers started from other directories share one index
+SEARCH_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "search_index.bin")
+INDEX_MAGIC = b"BM25IDX1"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RELOAD_CHECK_INTERVAL = 5
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+def write_index(path: str, documents: Iterable[Tuple[ObjectId, str]]) -> int:
+    doc_ids = bytearray()
+    doc_lengths = array("I")
+    postings = defaultdict(list)
+    for i, (doc_id, text) in enumerate(documents):
+        tokens = tokenize(text)
+        doc_ids += doc_id.binary
+        doc_lengths.append(len(tokens))
+        counts = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        for token, count in counts.items():
+            postings[token].append((i, count))
+
+    # postings of every term are laid out back to back in two flat arrays, the header maps a term to its slice
+    terms = {}
+    posting_docs = array("I")
+    posting_freqs = array("I")
+    for term in sorted(postings):
+        terms[term] = [len(posting_docs), len(postings[term])]
+        for doc, count in postings[term]:
+            posting_docs.append(doc)
+            posting_freqs.append(count)
+    num_docs = len(doc_lengths)
+    header = json.dumps({
+        "num_docs": num_docs,
+        "avg_length": sum(doc_lengths) / num_docs if num_docs else 0.0,
+        "num_postings": len(posting_docs),
+        "terms": terms
+    }).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(INDEX_MAGIC + struct.pack("<I", len(header)) + header)
+        file.write(doc_lengths.tobytes())
+        file.write(posting_docs.tobytes())
+        file.write(posting_freqs.tobytes())
+        file.write(doc_ids)
+    # readers keep their mapping of the old file until they reload
+    os.replace(f"{path}.tmp", path)
+    return num_docs
+
+def build_search_index(papers_db: pymongo.collection.Collection, path: str = SEARCH_INDEX_FILE) -> Optional[int]:
+    try:
+        documents = papers_db.find({}, {"title": 1, "abstract": 1})
+        num_docs = write_index(path, ((paper["_id"], f"{paper.get('title', '')} {paper.get('abstract', '')}") for paper in documents))
+    except Exception as error:
+        logging.critical(f"Failed to build the search index. Error: {error}")
+        return None
+    logging.info(f"Built the search index over {num_docs} papers")
+    return num_docs
+
+class BM25Index:
+    # read-only view over an index file, the mapping is shared by every process that opens it
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"Invalid search index file: {path}")
+        header_length = struct.unpack_from("<I", self.buffer, len(INDEX_MAGIC))[0]
+        offset = len(INDEX_MAGIC) + 4
+        header = json.loads(bytes(self.buffer[offset:offset+header_length]))
+        offset += header_length
+
+        self.num_docs = header["num_docs"]
+        self.avg_length = header["avg_length"]
+        self.terms = header["terms"]
+        view = memoryview(self.buffer)
+        self.doc_lengths = view[offset:offset+4*self.num_docs].cast("I")
+        offset += 4 * self.num_docs
+        self.posting_docs = view[offset:offset+4*header["num_postings"]].cast("I")
+        offset += 4 * header["num_postings"]
+        self.posting_freqs = view[offset:offset+4*header["num_postings"]].cast("I")
+        offset += 4 * header["num_postings"]
+        self.doc_ids = view[offset:offset+12*self.num_docs]
+        # length normalization only depends on the document, so it is computed once per load
+        self.norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1)) for length in self.doc_lengths]
+
+    def search(self, query: str, limit: int) -> List[ObjectId]:
+        scores = {}
+        norms = self.norms
+        for term in set(tokenize(query)):
+            if term not in self.terms:
+                continue
+            start, count = self.terms[term]
+            weight = math.log(1 + (self.num_docs - count + 0.5) / (count + 0.5)) * (BM25_K1 + 1)
+            docs = self.posting_docs[start:start+count].tolist()
+            freqs = self.posting_freqs[start:start+count].tolist()
+            for doc, freq in zip(docs, freqs):
+                scores[doc] = scores.get(doc, 0.0) + weight * freq / (freq + norms[doc])
+        top = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        return [ObjectId(bytes(self.doc_ids[12*doc:12*doc+12])) for doc in top]
+
+    def close(self) -> None:
+        self.doc_lengths.release()
+        self.posting_docs.release()
+        self.posting_freqs.release()
+        self.doc_ids.release()
+        self.buffer.close()
+
+class BM25Search:
+    # picks up a rebuilt index file without restarting the server
+    def __init__(self, path: str = SEARCH_INDEX_FILE, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.checked = None
+
+    def reload(self, now: float) -> None:
+        if self.checked is not None and now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version != self.version:
+            # searches still holding the old index keep using it, its file stays mapped until garbage collected
+            self.index = BM25Index(self.path)
+            self.version = version
+
+    def __call__(self, query: str, limit: int) -> List[ObjectId]:
+        with self.lock:
+            self.reload(time.monotonic())
+            index = self.index
+        if index is None:
+            logging.critical(f"Search index {self.path} has not been built")
+            return []
+        return index.search(query, limit)
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, DefaultDict
+
+CLASSIFY_BATCH_SIZE = 1024
+CLASSIFY_FLUSH_INTERVAL = 2.0
+
+Predictor = Callable[[List[str]], List[List[str]]]
+
+class ClassificationStage:
+    def __init__(self, load_predictor: Callable[[], Predictor], batch_size: int = CLASSIFY_BATCH_SIZE, flush_interval: float = CLASSIFY_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.tasks = []
+        self.flush_timer = None
+        # inference runs on one worker thread off the event loop, the model loads while the first fetches are in flight
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.predictor = self.executor.submit(load_predictor)
+
+    def submit(self, papers: List[DefaultDict[str, list]]) -> None:
+        self.pending.extend(papers)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.pending and self.flush_timer is None:
+            # don't let a partial batch wait for slow topics
+            self.flush_timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self) -> None:
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            self.tasks.append(asyncio.ensure_future(self.classify(batch)))
+
+    def predict(self, abstracts: List[str]) -> List[List[str]]:
+        return self.predictor.result()(abstracts)
+
+    async def classify(self, batch: List[DefaultDict[str, list]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            predicted_labels = await loop.run_in_executor(self.executor, self.predict, [paper["abstract"] for paper in batch])
+        except Exception as error:
+            # papers keep the topic they were fetched for
+            logging.critical(f"Failed to classify a batch of {len(batch)} papers. Error: {error}")
+            return
+        # scatter the labels back to the papers they were predicted for
+        for paper, labels in zip(batch, predicted_labels):
+            paper["topics"] = labels
+
+    async def drain(self) -> None:
+        self.flush()
+        tasks, self.tasks = self.tasks, []
+        await asyncio.gather(*tasks)
+
+    def close(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
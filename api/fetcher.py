@@ -0,0 +1,211 @@
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from typing import Optional, Mapping, Dict, Any, AsyncIterator
+from http_cache import ResponseCache
+
+POOL_SIZE = 20
+KEEPALIVE_TIMEOUT = 60
+REQUEST_TIMEOUT = 120
+CHUNK_SIZE = 64 * 1024
+RETRY_BUDGET = 900
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+LATENCY_TOLERANCE = 3.0
+MAX_INTERVAL = 30.0
+
+# arXiv asks clients for a single connection and no more than one request every three seconds,
+# Semantic Scholar's unauthenticated tier allows roughly one request per second
+HOST_LIMITS = {
+    "export.arxiv.org": {"max_concurrency": 1, "min_interval": 3.0},
+    "api.semanticscholar.org": {"max_concurrency": 2, "min_interval": 1.0}
+}
+DEFAULT_HOST_LIMIT = {"max_concurrency": 4, "min_interval": 0.0}
+
+class HostLimiter:
+    def __init__(self, max_concurrency: int, min_interval: float):
+        # max_concurrency and min_interval are the most aggressive settings allowed for the host,
+        # the window shrinks and the interval grows while the host pushes back
+        self.max_concurrency = max_concurrency
+        self.base_interval = min_interval
+        self.min_interval = min_interval
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.lock = asyncio.Lock()
+        self.next_request = 0.0
+        self.last_decrease = 0.0
+        self.base_latency = None
+
+    async def __aenter__(self) -> "HostLimiter":
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < max(1, int(self.window)))
+            self.in_flight += 1
+        try:
+            # reserve the next request slot so concurrent callers are spaced by min_interval
+            async with self.lock:
+                now = time.monotonic()
+                delay = self.next_request - now
+                self.next_request = max(now, self.next_request) + self.min_interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            # a caller cancelled while waiting never reaches __aexit__, give its slot back
+            await self.__aexit__()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        self.base_latency = latency if self.base_latency is None else min(self.base_latency, latency)
+        if latency > LATENCY_TOLERANCE * self.base_latency:
+            # responses slowing down well past the fastest seen means the host is queueing our requests
+            self.decrease()
+            return
+        # additive increase, roughly one extra request in flight per window of successful responses
+        self.window = min(self.max_concurrency, self.window + 1 / self.window)
+        self.min_interval = max(self.base_interval, self.min_interval * 0.9)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        self.decrease()
+        self.min_interval = min(MAX_INTERVAL, max(self.min_interval * 2, RETRY_BASE_DELAY))
+        if retry_after is not None:
+            # hold every request to the host until the server says it is ready again
+            self.next_request = max(self.next_request, time.monotonic() + retry_after)
+
+    def decrease(self) -> None:
+        # multiplicative decrease, at most once per round trip so a burst of rejections counts once
+        now = time.monotonic()
+        if now - self.last_decrease < (self.base_latency or 0):
+            return
+        self.last_decrease = now
+        self.window = max(1.0, self.window / 2)
+
+def get_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff_delay(attempt: int) -> float:
+    # full jitter keeps retries for many topics from arriving at the host together
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+class AsyncFetcher:
+    def __init__(self, host_limits: Optional[Dict[str, Dict[str, float]]] = None, pool_size: int = POOL_SIZE, timeout: float = REQUEST_TIMEOUT,
+                 cache: Optional[ResponseCache] = None, retry_budget: float = RETRY_BUDGET):
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.cache = cache if cache is None or cache.mode != "off" else None
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry_budget = retry_budget
+        self.deadline = None
+        self.limiters = {}
+        self.session = None
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        # one keep-alive connection pool shared by every request of the run
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.reset_retry_budget()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.session.close()
+        self.session = None
+
+    def reset_retry_budget(self) -> None:
+        # retries of every request share one budget so a struggling host can't stall the run
+        self.deadline = time.monotonic() + self.retry_budget
+
+    def get_limiter(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            limit = self.host_limits.get(host, DEFAULT_HOST_LIMIT)
+            self.limiters[host] = HostLimiter(int(limit["max_concurrency"]), limit["min_interval"])
+        return self.limiters[host]
+
+    async def get(self, url: str) -> bytes:
+        return b"".join([chunk async for chunk in self.stream(url)])
+
+    async def stream(self, url: str) -> AsyncIterator[bytes]:
+        if self.cache and self.cache.mode == "replay":
+            for chunk in self.cache.read(url):
+                yield chunk
+            return
+
+        headers = self.cache.get_conditional_headers(url) if self.cache else {}
+        limiter = self.get_limiter(url)
+        attempt = 0
+        streaming = False
+        while True:
+            retry_after = None
+            # the host slot is held until the body has been fully consumed
+            async with limiter:
+                start = time.monotonic()
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status in RETRY_STATUSES:
+                            retry_after = get_retry_after(response.headers)
+                            if response.status in THROTTLE_STATUSES:
+                                limiter.on_throttle(retry_after)
+                            error = aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                                message=response.reason or "", headers=response.headers)
+                        else:
+                            response.raise_for_status()
+                            limiter.on_success(time.monotonic() - start)
+                            streaming = True
+                            async for chunk in self.read_response(url, response):
+                                yield chunk
+                            return
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as connection_error:
+                    # a response that failed part way through can't be replayed to the caller
+                    if streaming:
+                        raise
+                    limiter.decrease()
+                    error = connection_error
+
+            delay = retry_after if retry_after is not None else get_backoff_delay(attempt)
+            if time.monotonic() + delay > self.deadline:
+                raise error
+            attempt += 1
+            logging.warning(f"Retrying {url} in {delay:.1f}s after attempt {attempt}. Error: {error}")
+            await asyncio.sleep(delay)
+
+    async def read_response(self, url: str, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        if response.status == 304:
+            for chunk in self.cache.read(url):
+                yield chunk
+            return
+
+        writer = self.cache.open_writer(url, response.headers) if self.cache else None
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                if writer:
+                    writer.write(chunk)
+                yield chunk
+            if writer:
+                writer.commit()
+        finally:
+            if writer:
+                writer.discard()
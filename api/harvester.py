@@ -0,0 +1,104 @@
+import os
+import json
+import threading
+from typing import Optional, Iterable, List, Dict, Any
+
+class WatermarkStore:
+    # per-category harvest state: the newest entry ingested and the next page offset of an unfinished crawl
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {}
+        self.reload()
+
+    def reload(self) -> None:
+        # drop unsaved updates
+        with self.lock:
+            self.state = {}
+            if self.path and os.path.exists(self.path):
+                with open(self.path, "r") as file:
+                    self.state = json.load(file)
+
+    def get(self, id: str) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.state.get(id, {}))
+
+    def update(self, id: str, **fields: Any) -> None:
+        with self.lock:
+            state = self.state.setdefault(id, {})
+            for key, value in fields.items():
+                if value is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            # write then rename so an interrupted save never leaves a truncated state file
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(self.state, file)
+            os.replace(f"{self.path}.tmp", self.path)
+
+def is_known_entry(entry: Dict[str, Any], watermark: Optional[Dict[str, str]]) -> bool:
+    # feeds are sorted by submittedDate descending, so the first entry at or below the watermark ends the harvest
+    if not watermark:
+        return False
+    return entry["id"] == watermark["id"] or entry["published"] < watermark["published"]
+
+class ArxivHarvest:
+    def __init__(self, id: str, watermarks: WatermarkStore, page_size: int, max_papers: int, resume: bool = False):
+        state = watermarks.get(id)
+        self.id = id
+        self.watermarks = watermarks
+        self.page_size = page_size
+        self.max_papers = max_papers
+        self.watermark = state.get("watermark")
+        self.start = state.get("next_start", 0) if resume else 0
+        self.page_entries = 0
+        self.newest = None
+        self.done = self.start >= max_papers
+        self.reached_watermark = False
+        # ids of already ingested entries still listed on the last page read
+        self.listed = []
+
+    def get_url(self, base_url: str) -> str:
+        param = "sortBy=submittedDate&sortOrder=descending"
+        return f"{base_url}search_query=cat:cs.{self.id}&{param}&start={self.start}&max_results={self.page_size}"
+
+    def take(self, entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        new_entries = []
+        for entry in entries:
+            if self.reached_watermark:
+                self.listed.append(entry["id"])
+                continue
+            if self.done:
+                break
+            self.page_entries += 1
+            if is_known_entry(entry, self.watermark):
+                self.done = True
+                self.reached_watermark = True
+                self.listed.append(entry["id"])
+                continue
+            if self.newest is None:
+                self.newest = {"published": entry["published"], "id": entry["id"]}
+            new_entries.append(entry)
+            if self.start + self.page_entries >= self.max_papers:
+                self.done = True
+        return new_entries
+
+    def end_page(self) -> None:
+        # a short page means the category has no older results
+        if self.page_entries < self.page_size:
+            self.done = True
+        self.start += self.page_entries
+        self.page_entries = 0
+        self.watermarks.update(self.id, next_start=None if self.done else self.start)
+
+    def finish(self) -> None:
+        if self.newest and (not self.watermark or self.newest["published"] >= self.watermark["published"]):
+            self.watermarks.update(self.id, watermark=self.newest)
+        self.watermarks.update(self.id, next_start=None)
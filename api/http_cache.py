@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import tempfile
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from typing import Optional, Iterator, Mapping, Tuple, Dict, Any
+
+CACHE_DIR = "data/http_cache"
+CHUNK_SIZE = 64 * 1024
+
+# off: no cache, revalidate: conditional requests with ETag/Last-Modified,
+# record: always fetch and store, replay: serve stored responses without any network access
+CACHE_MODES = ("off", "revalidate", "record", "replay")
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+class CacheWriter:
+    def __init__(self, cache: "ResponseCache", url: str, headers: Mapping[str, str]):
+        self.cache = cache
+        self.url = url
+        self.headers = headers
+        self.body_path, self.meta_path = cache.get_paths(url)
+        # a temp file per writer, so workers recording the same url never write into each other's body
+        descriptor, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self.file = os.fdopen(descriptor, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+
+    def commit(self) -> None:
+        # only complete bodies replace the stored response
+        self.file.close()
+        os.replace(self.temp_path, self.body_path)
+        meta = {"url": self.url, "etag": self.headers.get("ETag"), "last_modified": self.headers.get("Last-Modified")}
+        descriptor, temp_path = tempfile.mkstemp(dir=self.cache.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w") as file:
+            json.dump(meta, file)
+        os.replace(temp_path, self.meta_path)
+
+    def discard(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temp_path)
+
+class ResponseCache:
+    def __init__(self, directory: str = CACHE_DIR, mode: str = "revalidate"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid HTTP cache mode: {mode}")
+        self.directory = directory
+        self.mode = mode
+        # only modes that store responses need the directory, replay just reads what is there
+        if mode in ("revalidate", "record"):
+            os.makedirs(directory, exist_ok=True)
+
+    def get_paths(self, url: str) -> Tuple[str, str]:
+        name = hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+        return (os.path.join(self.directory, f"{name}.body"), os.path.join(self.directory, f"{name}.json"))
+
+    def load_meta(self, url: str) -> Optional[Dict[str, Any]]:
+        body_path, meta_path = self.get_paths(url)
+        if not os.path.exists(body_path) or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as file:
+            return json.load(file)
+
+    def get_conditional_headers(self, url: str) -> Dict[str, str]:
+        meta = self.load_meta(url) if self.mode == "revalidate" else None
+        headers = {}
+        if meta and meta["etag"]:
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta["last_modified"]:
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def read(self, url: str) -> Iterator[bytes]:
+        if self.load_meta(url) is None:
+            raise KeyError(f"No cached response for {url}")
+        with open(self.get_paths(url)[0], "rb") as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def open_writer(self, url: str, headers: Mapping[str, str]) -> CacheWriter:
+        return CacheWriter(self, url, headers)
+
+    def record(self, url: str, body: bytes, headers: Optional[Mapping[str, str]] = None) -> None:
+        # store a payload directly, e.g. the recorded API responses in tests/mocks
+        writer = self.open_writer(url, headers or {})
+        writer.write(body)
+        writer.commit()
@@ -0,0 +1,109 @@
+import sys
+import logging
+import argparse
+import datetime
+import pymongo
+from bson.objectid import ObjectId
+from typing import Callable, Iterator, Optional, List, Tuple, Dict, Any
+from utils import get_env_var, get_db_connection, check_db_connection, get_topic_feed_query, get_bookmarks_pipeline, TOPIC_FEED_INDEX, TOPIC_FEED_SORT
+
+# every index a route or the aggregator relies on, keyed by collection
+INDEXES = {
+    "users": [
+        {"keys": [("email", pymongo.ASCENDING)], "unique": True}
+    ],
+    "papers": [
+        # only keyed papers are unique, so documents written by upload_db_data never collide on a missing key
+        {"keys": [("key", pymongo.ASCENDING)], "unique": True, "partialFilterExpression": {"key": {"$exists": True}}},
+        {"keys": TOPIC_FEED_INDEX},
+        {"keys": [("last_seen", pymongo.ASCENDING)]}
+    ]
+}
+
+def delete_legacy_papers(papers_db: pymongo.collection.Collection) -> int:
+    # documents from before keyed publishing have neither a key nor a last_seen, they are never refreshed
+    return papers_db.delete_many({"last_seen": {"$exists": False}}).deleted_count
+
+def ensure_indexes(collections: Dict[str, pymongo.collection.Collection]) -> Optional[List[str]]:
+    # create_index is a no-op for an index that already exists with the same options
+    names = []
+    try:
+        if "papers" in collections:
+            delete_legacy_papers(collections["papers"])
+        for name, collection in collections.items():
+            for spec in INDEXES[name]:
+                options = {option: value for option, value in spec.items() if option != "keys"}
+                names.append(f"{name}.{collection.create_index(spec['keys'], **options)}")
+    except Exception as error:
+        logging.critical(f"Failed to create the MongoDB Atlas indexes. Error: {error}")
+        return None
+    return names
+
+def get_query_shapes(papers_db: pymongo.collection.Collection, users_db: pymongo.collection.Collection) -> List[Tuple[str, Callable[[], Dict[str, Any]]]]:
+    # the query each route and publish step sends, with placeholder values
+    paper_id = ObjectId()
+    cutoff = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        ("topic feed", lambda: papers_db.find(get_topic_feed_query("AI")).sort(TOPIC_FEED_SORT).limit(10).explain()),
+        ("topic feed page", lambda: papers_db.find(get_topic_feed_query("AI", f"2023-05-15_{paper_id}")).sort(TOPIC_FEED_SORT).limit(10).explain()),
+        ("search page", lambda: papers_db.find({"_id": {"$in": [paper_id]}}).explain()),
+        ("bookmarks", lambda: users_db.database.command("aggregate", users_db.name, pipeline=get_bookmarks_pipeline("user@example.com", papers_db.name, {"key": 0, "last_seen": 0}), explain=True)),
+        ("publish existing papers", lambda: papers_db.find({"key": {"$in": ["arxiv:2305.08854"]}}, {"_id": 0}).explain()),
+        ("publish legacy papers", lambda: papers_db.find({"last_seen": {"$exists": False}}).explain()),
+        ("publish expiry", lambda: papers_db.find({"last_seen": {"$lt": cutoff}}).explain())
+    ]
+
+def iter_stages(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in ["inputStage", "outerStage", "innerStage"]:
+        if child in plan:
+            yield from iter_stages(plan[child])
+    for child in plan.get("inputStages", []):
+        yield from iter_stages(child)
+
+def get_plan_summary(explanation: Dict[str, Any]) -> Tuple[bool, str]:
+    # an aggregation the query layer can't run whole explains the plan of its leading $cursor stage
+    planner = explanation["queryPlanner"] if "queryPlanner" in explanation else explanation["stages"][0]["$cursor"]["queryPlanner"]
+    # newer servers nest the plan under queryPlan
+    plan = planner["winningPlan"].get("queryPlan", planner["winningPlan"])
+    stages = list(iter_stages(plan))
+    indexes = [stage["indexName"] for stage in stages if "indexName" in stage]
+    # a $lookup that doesn't join through an index scans the foreign collection for every document
+    has_collection_scan = any(stage.get("stage") == "COLLSCAN" or (stage.get("stage") == "EQ_LOOKUP" and stage.get("strategy") != "IndexedLoopJoin") for stage in stages)
+    return (has_collection_scan, ", ".join(indexes) if indexes else "no index")
+
+def explain_queries(papers_db: pymongo.collection.Collection, users_db: pymongo.collection.Collection) -> List[Dict[str, Any]]:
+    report = []
+    for name, explain in get_query_shapes(papers_db, users_db):
+        try:
+            has_collection_scan, indexes = get_plan_summary(explain())
+        except Exception as error:
+            logging.critical(f"Failed to explain the {name} query. Error: {error}")
+            report.append({"query": name, "collection_scan": None, "indexes": None})
+            continue
+        report.append({"query": name, "collection_scan": has_collection_scan, "indexes": indexes})
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the indexes the API and aggregator rely on")
+    parser.add_argument("--explain", action="store_true", help="explain each route's query shape and flag collection scans")
+    args = parser.parse_args()
+
+    username, password = get_env_var()
+    papers_db = get_db_connection(username, password, "papers")
+    users_db = get_db_connection(username, password, "users")
+    if not check_db_connection(papers_db) or not check_db_connection(users_db):
+        sys.exit(1)
+
+    names = ensure_indexes({"papers": papers_db, "users": users_db})
+    if names is None:
+        sys.exit(1)
+    for name in names:
+        print(f"Ensured index {name}")
+    if args.explain:
+        report = explain_queries(papers_db, users_db)
+        for row in report:
+            status = "FAILED" if row["collection_scan"] is None else "COLLSCAN" if row["collection_scan"] else "OK"
+            print(f"{status:<9}{row['query']:<26}{row['indexes'] or ''}")
+        if any(row["collection_scan"] is not False for row in report):
+            sys.exit(1)
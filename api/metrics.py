@@ -0,0 +1,170 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from aiohttp import web
+from flask import Flask, Response, request, g
+from typing import Awaitable, Callable, Iterator, Sequence, Tuple, List, Any
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = [str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts with a final +Inf bucket, sum]
+        self.values = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        label_names = self.label_names + ("le",)
+        for labels, counts, total in values:
+            # buckets are stored per interval and exposed cumulatively
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(label_names, labels + (str(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+class CallbackMetric:
+    # values owned by another object, read at scrape time so the hot path pays nothing extra
+    def __init__(self, name: str, help: str, type: str, label_names: Sequence[str], collect: Callable[[], List[Tuple[Tuple[str, ...], float]]]):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.label_names = tuple(label_names)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{self.name}{format_labels(self.label_names, labels)} {value}" for labels, value in self.collect()]
+        return lines
+
+class AppMetrics:
+    def __init__(self):
+        self.request_duration = Histogram("api_request_duration_seconds", "Time to handle a request", ("route", "method", "status"), LATENCY_BUCKETS)
+        self.response_size = Histogram("api_response_size_bytes", "Size of response bodies as sent", ("route",), SIZE_BUCKETS)
+        self.stage_duration = Histogram("api_stage_duration_seconds", "Time spent in MongoDB, search and encoding within a request", ("route", "stage"), LATENCY_BUCKETS)
+        self.caches = {}
+        self.metrics = [
+            self.request_duration,
+            self.response_size,
+            self.stage_duration,
+            CallbackMetric("api_cache_requests_total", "Cache lookups by result", "counter", ("cache", "result"), self.collect_cache_requests),
+            CallbackMetric("api_cache_evictions_total", "Entries evicted to stay within the cache capacity or byte budget", "counter", ("cache",), lambda: self.collect_cache(lambda cache: cache.evictions)),
+            CallbackMetric("api_cache_entries", "Entries held by the cache", "gauge", ("cache",), lambda: self.collect_cache(len)),
+            CallbackMetric("api_cache_bytes", "Estimated bytes held by the cache", "gauge", ("cache",), lambda: self.collect_cache(lambda cache: cache.size))
+        ]
+
+    def watch_cache(self, name: str, cache: Any) -> None:
+        self.caches[name] = cache
+
+    def collect_cache_requests(self) -> List[Tuple[Tuple[str, ...], float]]:
+        values = []
+        for name, cache in self.caches.items():
+            values += [((name, "hit"), cache.hits), ((name, "miss"), cache.misses)]
+        return values
+
+    def collect_cache(self, get_value: Callable[[Any], float]) -> List[Tuple[Tuple[str, ...], float]]:
+        return [((name,), get_value(cache)) for name, cache in self.caches.items()]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def get_route(self) -> str:
+        # the rule rather than the path, so label cardinality stays bounded by the number of routes
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_duration.observe(time.perf_counter() - start, self.get_route(), stage)
+
+    def before_request(self) -> None:
+        g.metrics_start = time.perf_counter()
+
+    def after_request(self, response: Response) -> Response:
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        route = self.get_route()
+        self.request_duration.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+        if response.content_length is not None:
+            self.response_size.observe(response.content_length, route)
+        return response
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule("/metrics", "metrics", lambda: Response(self.render(), content_type=METRICS_CONTENT_TYPE))
+
+class AsyncAppMetrics(AppMetrics):
+    # the same metrics for the aiohttp server, the route of the running request is tracked per task
+    def __init__(self):
+        super().__init__()
+        self.route = contextvars.ContextVar("metrics_route", default="unmatched")
+
+    def get_route(self) -> str:
+        return self.route.get()
+
+    async def handle_request(self, request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) -> web.StreamResponse:
+        resource = request.match_info.route.resource
+        # the resource pattern rather than the path, so label cardinality stays bounded by the number of routes
+        route = resource.canonical if resource is not None else "unmatched"
+        token = self.route.set(route)
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            if response.content_length is not None:
+                self.response_size.observe(response.content_length, route)
+            return response
+        except web.HTTPException as error:
+            status = error.status
+            raise
+        finally:
+            self.request_duration.observe(time.perf_counter() - start, route, request.method, str(status))
+            self.route.reset(token)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+    def init_app(self, app: web.Application) -> None:
+        @web.middleware
+        async def middleware(request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]) -> web.StreamResponse:
+            return await self.handle_request(request, handler)
+
+        app.middlewares.append(middleware)
+        app.router.add_get("/metrics", self.handle_metrics)
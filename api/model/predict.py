@@ -1,6 +1,4 @@
 import pickle
-import concurrent.futures
-import pandas as pd
 import tensorflow as tf
 from keras import models, Sequential
 from keras.layers import StringLookup
@@ -16,15 +14,12 @@ def load_model() -> Tuple[Sequential, StringLookup]:
     return (model, lookup_classes)
 
 def predict_labels(model: Sequential, lookup_classes: StringLookup, abstracts: List[str]) -> List[List[str]]:
-    df = pd.DataFrame(abstracts, columns=["abstracts"])
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=Constants.NUM_PREPROCESSING_THREADS)
-    df["abstracts"] = list(executor.map(lambda text: normalize_text(text), df["abstracts"]))
-    executor.shutdown()
-
-    dataset = tf.data.Dataset.from_tensor_slices(df["abstracts"].values)
+    # normalization is pure Python, a thread pool per call only adds overhead under the GIL
+    normalized_abstracts = [normalize_text(text) for text in abstracts]
+    dataset = tf.data.Dataset.from_tensor_slices(normalized_abstracts)
     dataset = dataset.batch(Constants.BATCH_SIZE).prefetch(Constants.AUTO)
 
-    predicted_probailities = model.predict(dataset)
+    predicted_probailities = model.predict(dataset, verbose=0)
     predicted_probailities = (predicted_probailities >= Constants.PREDICTION_THRESHOLD).astype(int)
     predicted_labels = []
 
@@ -1,6 +1,7 @@
 import os
+import glob
+import threading
 import requests
-import xmltodict
 import logging
 import gzip
 import pandas as pd
@@ -10,68 +11,100 @@ from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 from typing import Optional, List, DefaultDict, Dict, Any
 from utils import topics
+from seen_store import SeenStore
+from atom import iter_atom_entries, CHUNK_SIZE
+from harvester import ArxivHarvest, WatermarkStore
 
 MAX_PAPERS_REQUEST = 5000
+PAGE_SIZE = 1000
 NUM_THREADS = 10
-seen_papers = set()
+ARXIV_API_URL = "http://export.arxiv.org/api/query?"
+SEEN_PAPERS_FILE = "data/scraper_seen_papers.db"
+HARVEST_STATE_FILE = "data/scraper_state.json"
+PAGES_DIR = "data/pages"
+seen_papers = SeenStore()
+harvest_state = WatermarkStore()
+page_lock = threading.Lock()
 
-def parse_arxiv(data: Dict[str, Any], id: str) -> List[DefaultDict[str, list]]:
-    result = []
-    for entry in data["feed"]["entry"]:
-        if entry["id"] in seen_papers:
+def parse_arxiv_entry(entry: Dict[str, Any], id: str) -> Optional[DefaultDict[str, list]]:
+    if entry["id"] in seen_papers:
+        return None
+
+    paper = defaultdict(list)
+    paper["abstract"] = entry["summary"]
+    paper_topics = []
+    
+    for paper_id in entry["category"]:
+        if type(paper_id) == str:
             continue
+        if paper_id["@term"][3:] in topics:
+            paper_topics.append(paper_id["@term"][3:])
+    
+    if not paper_topics:
+        paper_topics.append(id)
+    paper["topics"] = paper_topics
+    seen_papers.add(entry["id"])
+    return paper
 
-        paper = defaultdict(list)
-        paper["abstract"] = entry["summary"]
-        paper_topics = []
-        
-        for paper_id in entry["category"]:
-            if type(paper_id) == str:
-                continue
-            if paper_id["@term"][3:] in topics:
-                paper_topics.append(paper_id["@term"][3:])
-        
-        if not paper_topics:
-            paper_topics.append(id)
-        paper["topics"] = paper_topics
-        result.append(paper)
-        seen_papers.add(entry["id"])
-    return result
+def save_page(id: str, papers: List[DefaultDict[str, list]]) -> None:
+    df = pd.DataFrame({"abstracts": [paper["abstract"] for paper in papers], "topics": [paper["topics"] for paper in papers]})
+    path = f"{PAGES_DIR}/{id}.csv"
+    df.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
 
-def fetch_arxiv(id: str, session: requests.Session) -> Optional[List[DefaultDict[str, list]]]:
-    base_url = "http://export.arxiv.org/api/query?"
-    param = "sortBy=submittedDate&max_results"
-    url = f"{base_url}search_query=cat:cs.{id}&{param}={MAX_PAPERS_REQUEST}"
+def fetch_arxiv(id: str, session: requests.Session) -> bool:
+    if harvest_state.get(id).get("complete"):
+        return True
 
+    # resume an interrupted crawl from the last completed page
+    harvest = ArxivHarvest(id, harvest_state, PAGE_SIZE, MAX_PAPERS_REQUEST, resume=True)
     try:
-        response = session.get(url)
-        data = xmltodict.parse(response.text)
+        while not harvest.done:
+            # stream the page so a large response is never held as one document tree
+            response = session.get(harvest.get_url(ARXIV_API_URL), stream=True)
+            entries = harvest.take(iter_atom_entries(response.iter_content(CHUNK_SIZE)))
+
+            # a page's papers, seen ids and offset are persisted together
+            with page_lock:
+                papers = []
+                for entry in entries:
+                    paper = parse_arxiv_entry(entry, id)
+                    if paper:
+                        papers.append(paper)
+                save_page(id, papers)
+                seen_papers.commit()
+                harvest.end_page()
+                harvest_state.save()
+        harvest.finish()
+        harvest_state.update(id, complete=True)
+        harvest_state.save()
     except Exception as error:
         logging.critical(f"Failed to make a GET request to arXiv with topic ID: {id}. Error: {error}")
-        return None
+        return False
     else:
-        return parse_arxiv(data, id)
+        return True
 
 if __name__ == "__main__":
+    # keep the dedup index on disk so memory stays flat across 38 topics of 5000 papers,
+    # state left behind by an interrupted crawl is resumed rather than cleared
+    os.makedirs(PAGES_DIR, exist_ok=True)
+    seen_papers = SeenStore(SEEN_PAPERS_FILE)
+    harvest_state = WatermarkStore(HARVEST_STATE_FILE)
     session = requests.Session()
     executor = ThreadPoolExecutor(NUM_THREADS)
 
     futures = []
     for id, name in topics.items():
         futures.append(executor.submit(fetch_arxiv, id, session))
+    if not all([future.result() for future in futures]):
+        logging.critical("Failed to scrape every topic, rerun the scraper to resume")
+        sys.exit(1)
     session.close()
-    
-    all_abstracts = []
-    all_topics = []
-    for future in futures:
-        if future.result():
-            for paper in future.result():
-                all_abstracts.append(paper["abstract"])
-                all_topics.append(paper["topics"])
+    seen_papers.close()
 
-    df = pd.DataFrame({"abstracts": all_abstracts, "topics": all_topics})
-    if not os.path.exists("data"):
-        os.makedirs("data")
-    
+    df = pd.concat([pd.read_csv(path) for path in sorted(glob.glob(f"{PAGES_DIR}/*.csv"))], ignore_index=True)
     with gzip.open("data/training_data.csv", "wt", encoding="utf-8") as file:
-        df.to_csv(file, index=False)
\ No newline at end of file
+        df.to_csv(file, index=False)
+
+    # the crawl is complete, the next run starts from scratch
+    for path in glob.glob(f"{PAGES_DIR}/*.csv") + [SEEN_PAPERS_FILE, HARVEST_STATE_FILE]:
+        os.remove(path)
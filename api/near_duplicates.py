@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import pymongo
+from collections import defaultdict
+from typing import Optional, Iterable, List, Set, Tuple, DefaultDict, Dict, Any
+from utils import get_paper_key
+
+NUM_PERMUTATIONS = 32
+NUM_BANDS = 8
+SHINGLE_SIZE = 4
+TITLE_SIMILARITY_THRESHOLD = 0.8
+AUTHOR_SIMILARITY_THRESHOLD = 0.5
+SECONDS_PER_DAY = 86400
+SOURCE_PRIORITY = ["arXiv.org", "SemanticScholar.org"]
+
+# fixed seed so signatures stay comparable with those persisted by earlier runs
+random_state = random.Random(25)
+PERMUTATION_MASKS = [random_state.getrandbits(64) for _ in range(NUM_PERMUTATIONS)]
+
+def normalize_title(title: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", title.lower()).strip()
+
+def get_author_names(authors: Iterable[str]) -> Set[str]:
+    # compare surnames only, sources disagree on initials and first names
+    names = set()
+    for author in authors:
+        tokens = normalize_title(author).split()
+        if tokens:
+            names.add(tokens[-1])
+    return names
+
+def get_shingles(title: str) -> Set[str]:
+    if len(title) <= SHINGLE_SIZE:
+        return {title}
+    return {title[i:i+SHINGLE_SIZE] for i in range(len(title) - SHINGLE_SIZE + 1)}
+
+def hash_value(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+def get_signature(shingles: Set[str]) -> List[int]:
+    # xor with a random mask stands in for each hash permutation
+    hashes = [hash_value(shingle) for shingle in shingles]
+    return [min(map(mask.__xor__, hashes)) for mask in PERMUTATION_MASKS]
+
+def get_bands(signature: List[int]) -> List[int]:
+    # papers sharing any band are candidate duplicates, so only a handful of pairs are ever compared
+    rows = NUM_PERMUTATIONS // NUM_BANDS
+    bands = []
+    for i in range(NUM_BANDS):
+        band = f"{i}:" + ",".join(str(value) for value in signature[i*rows:(i+1)*rows])
+        bands.append(hash_value(band) - (1 << 63))
+    return bands
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def is_near_duplicate(title: str, authors: Set[str], other_title: str, other_authors: Set[str]) -> bool:
+    if jaccard(get_shingles(title), get_shingles(other_title)) < TITLE_SIMILARITY_THRESHOLD:
+        return False
+    return not authors or not other_authors or jaccard(authors, other_authors) >= AUTHOR_SIMILARITY_THRESHOLD
+
+def merge_papers(primary: Dict[str, Any], duplicate: Dict[str, Any]) -> None:
+    # source stays the primary origin, sources lists every origin the paper was found at
+    sources = list(primary.get("sources") or [primary["source"]])
+    for source in duplicate.get("sources") or [duplicate["source"]]:
+        if source not in sources:
+            sources.append(source)
+    primary["sources"] = sources
+    primary["topics"] = list(primary["topics"]) + [topic for topic in duplicate["topics"] if topic not in primary["topics"]]
+    if not primary["authors"]:
+        primary["authors"] = duplicate["authors"]
+
+class NearDuplicateIndex:
+    def __init__(self, path: str = ":memory:", max_age_days: Optional[float] = None):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS papers (key TEXT PRIMARY KEY, title TEXT NOT NULL, authors TEXT NOT NULL, added_at REAL NOT NULL, source TEXT NOT NULL DEFAULT '')")
+        # indexes written before sources were stored keep their entries, an unknown source matches any paper
+        if "source" not in [column[1] for column in self.connection.execute("PRAGMA table_info(papers)")]:
+            self.connection.execute("ALTER TABLE papers ADD COLUMN source TEXT NOT NULL DEFAULT ''")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, key TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS bands_band ON bands (band)")
+        self.connection.commit()
+        if max_age_days is not None:
+            self.expire(max_age_days)
+
+    def find(self, title: str, authors: Set[str], bands: List[int], source: str) -> Optional[str]:
+        # only papers from another source are duplicates, similar titles within one source are distinct papers such as a series
+        with self.lock:
+            placeholders = ",".join("?" * len(bands))
+            candidates = self.connection.execute(
+                f"SELECT DISTINCT papers.key, papers.title, papers.authors FROM bands JOIN papers ON bands.key = papers.key "
+                f"WHERE bands.band IN ({placeholders}) AND papers.source != ?",
+                bands + [source]
+            ).fetchall()
+        for key, other_title, other_authors in candidates:
+            if is_near_duplicate(title, authors, other_title, set(other_authors.split())):
+                return key
+        return None
+
+    def add(self, key: str, title: str, authors: Set[str], bands: List[int], source: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO papers (key, title, authors, added_at, source) VALUES (?, ?, ?, ?, ?)",
+                (key, title, " ".join(sorted(authors)), time.time(), source)
+            )
+            self.connection.executemany("INSERT INTO bands VALUES (?, ?)", [(band, key) for band in bands])
+
+    def expire(self, max_age_days: float) -> None:
+        cutoff = time.time() - max_age_days * SECONDS_PER_DAY
+        with self.lock:
+            self.connection.execute("DELETE FROM bands WHERE key IN (SELECT key FROM papers WHERE added_at < ?)", (cutoff,))
+            self.connection.execute("DELETE FROM papers WHERE added_at < ?", (cutoff,))
+            self.connection.commit()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def rollback(self) -> None:
+        with self.lock:
+            self.connection.rollback()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+def deduplicate_papers(papers: List[DefaultDict[str, list]], index: NearDuplicateIndex) -> Tuple[List[DefaultDict[str, list]], Dict[str, List[DefaultDict[str, list]]]]:
+    # keep arXiv records as the primary copy of a paper found by both sources
+    papers = sorted(papers, key=lambda paper: SOURCE_PRIORITY.index(paper["source"]) if paper["source"] in SOURCE_PRIORITY else len(SOURCE_PRIORITY))
+    unique_papers = {}
+    published_duplicates = defaultdict(list)
+    for paper in papers:
+        title = normalize_title(paper["title"])
+        authors = get_author_names(paper["authors"])
+        bands = get_bands(get_signature(get_shingles(title)))
+        key = index.find(title, authors, bands, paper["source"])
+        if key is None:
+            key = get_paper_key(paper)
+            index.add(key, title, authors, bands, paper["source"])
+            unique_papers[key] = paper
+        elif key in unique_papers:
+            merge_papers(unique_papers[key], paper)
+        else:
+            published_duplicates[key].append(paper)
+    return (list(unique_papers.values()), published_duplicates)
+
+def merge_published_duplicates(papers_db: pymongo.collection.Collection, published_duplicates: Dict[str, List[DefaultDict[str, list]]]) -> List[Dict[str, Any]]:
+    # fold duplicates of papers published by earlier runs into the stored record
+    if not published_duplicates:
+        return []
+    merged = []
+    remaining = dict(published_duplicates)
+    for document in papers_db.find({"key": {"$in": list(published_duplicates)}}, {"_id": 0, "key": 0, "last_seen": 0}):
+        for duplicate in remaining.pop(get_paper_key(document), []):
+            merge_papers(document, duplicate)
+        merged.append(document)
+
+    # the stored record has expired since it was indexed, publish the duplicates as a new paper
+    for duplicates in remaining.values():
+        for duplicate in duplicates[1:]:
+            merge_papers(duplicates[0], duplicate)
+        merged.append(duplicates[0])
+    return merged
@@ -0,0 +1,148 @@
+import os
+import re
+import sys
+import hmac
+import time
+import random
+import logging
+import cProfile
+import datetime
+import threading
+from collections import defaultdict
+from flask import Flask, Response, request, g
+from typing import Optional, Union
+
+# resolved from this file, so profiles land in api/data whichever directory the server is started from
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles")
+PROFILE_HEADER = "X-Profile"
+PROFILE_MODES = ("cprofile", "sampling")
+SAMPLING_INTERVAL = 0.005
+MAX_PROFILES = 200
+
+class DeterministicProfile:
+    # every call made while handling the request, saved in pstats format
+    extension = "pstats"
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+
+    def save(self, path: str) -> None:
+        self.profiler.dump_stats(path)
+
+class SamplingProfile:
+    # stacks of the request thread sampled from a side thread, saved as collapsed stacks for flamegraph tools
+    extension = "folded"
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+class RequestProfiler:
+    # profiles requests that carry the admin token, plus a random sample of all requests
+    def __init__(self, directory: str = PROFILE_DIR, token: Optional[str] = None, sample_rate: float = 0.0, mode: str = "cprofile", max_profiles: int = MAX_PROFILES):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Invalid profile mode: {mode}")
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.max_profiles = max_profiles
+        # one profiled request at a time, which also keeps the overhead bounded under load
+        self.lock = threading.Lock()
+
+    def should_profile(self) -> bool:
+        header = request.headers.get(PROFILE_HEADER)
+        if self.token and header is not None and hmac.compare_digest(header.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> Union[DeterministicProfile, SamplingProfile]:
+        return DeterministicProfile() if self.mode == "cprofile" else SamplingProfile()
+
+    def get_profile_name(self, duration: float, status: int, extension: str) -> str:
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        route = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_")
+        return f"{timestamp}_{request.method}_{route}_{status}_{duration * 1000:.0f}ms.{extension}"
+
+    def prune(self) -> None:
+        extensions = (f".{DeterministicProfile.extension}", f".{SamplingProfile.extension}")
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(extensions))
+        # names start with a timestamp, so the oldest profiles sort first
+        for name in names[:max(0, len(names) - self.max_profiles)]:
+            os.remove(os.path.join(self.directory, name))
+
+    def before_request(self) -> None:
+        if not self.should_profile() or not self.lock.acquire(blocking=False):
+            return
+        try:
+            g.profile = self.start()
+        except Exception as error:
+            logging.critical(f"Failed to start the request profiler. Error: {error}")
+            self.lock.release()
+            return
+        g.profile_start = time.perf_counter()
+
+    def after_request(self, response: Response) -> Response:
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        try:
+            profile.stop()
+            name = self.get_profile_name(time.perf_counter() - g.pop("profile_start"), response.status_code, profile.extension)
+            os.makedirs(self.directory, exist_ok=True)
+            profile.save(os.path.join(self.directory, name))
+            self.prune()
+            response.headers["X-Profile-Id"] = name
+        except Exception as error:
+            logging.critical(f"Failed to save the request profile. Error: {error}")
+        finally:
+            self.lock.release()
+        return response
+
+    def teardown_request(self, error: Optional[BaseException]) -> None:
+        # a request that raised never reaches after_request
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.stop()
+            self.lock.release()
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+def get_request_profiler() -> Optional[RequestProfiler]:
+    # off unless an admin token or a sample rate is configured
+    token = os.getenv("PROFILE_TOKEN") or None
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if token is None and sample_rate <= 0:
+        return None
+    return RequestProfiler(os.getenv("PROFILE_DIR", PROFILE_DIR), token, sample_rate, os.getenv("PROFILE_MODE", "cprofile"))
@@ -0,0 +1,37 @@
+import gzip
+import hashlib
+import orjson
+from flask import Response, request
+from typing import Iterable, Dict, Any
+
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
+class EncodedResponse:
+    # a response body encoded once, along with its compressed form and validators
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.gzip_body = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_SIZE else None
+        self.size = len(body) + len(self.gzip_body or b"")
+
+def encode_json(data: Any) -> EncodedResponse:
+    # ObjectIds fall through to str in orjson's default hook
+    return EncodedResponse(orjson.dumps(data, default=str))
+
+def encode_papers(papers: Iterable[Dict[str, Any]]) -> EncodedResponse:
+    return encode_json({str(paper["_id"]): paper for paper in papers})
+
+def send_encoded(encoded: EncodedResponse, status: int = 200) -> Response:
+    use_gzip = encoded.gzip_body is not None and "gzip" in request.accept_encodings
+    # each content coding is a different representation, so it gets its own strong validator
+    etag = f"{encoded.etag}-gzip" if use_gzip else encoded.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(encoded.gzip_body if use_gzip else encoded.body, status=status, mimetype="application/json")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import threading
+from typing import Optional, Iterable, List, Dict, Any
+
+SECONDS_PER_HOUR = 3600
+MIN_REFRESH_INTERVAL = 15 * 60
+MAX_REFRESH_INTERVAL = 24 * SECONDS_PER_HOUR
+TARGET_PAPERS_PER_REFRESH = 10
+RATE_SMOOTHING = 0.3
+REQUEST_BUDGET_PER_HOUR = 240
+# worst case of a refresh: a full arXiv harvest of 4 pages plus one Semantic Scholar request
+REQUESTS_PER_REFRESH = 5
+
+class ScheduleStore:
+    # per-topic refresh state, kept in a small json file next to the harvest state
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as file:
+                self.state = json.load(file)
+
+    def get(self, id: str) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.state.get(id, {}))
+
+    def update(self, id: str, **fields: Any) -> None:
+        with self.lock:
+            self.state.setdefault(id, {}).update(fields)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(self.state, file)
+            os.replace(f"{self.path}.tmp", self.path)
+
+class RefreshScheduler:
+    # per-topic refresh cadence from the observed rate of new papers, under a global upstream request budget
+    def __init__(self, topic_ids: Iterable[str], state: ScheduleStore, request_budget: float = REQUEST_BUDGET_PER_HOUR,
+                 requests_per_refresh: int = REQUESTS_PER_REFRESH):
+        self.topic_ids = list(topic_ids)
+        self.state = state
+        self.request_budget = request_budget
+        self.requests_per_refresh = requests_per_refresh
+        self.tokens = float(request_budget)
+        self.last_refill = time.time()
+
+    def refill(self, now: float) -> None:
+        # token bucket holding at most an hour of requests
+        self.tokens = min(self.request_budget, self.tokens + max(0.0, now - self.last_refill) * self.request_budget / SECONDS_PER_HOUR)
+        self.last_refill = max(self.last_refill, now)
+
+    def get_interval(self, rate: Optional[float]) -> float:
+        if not rate:
+            return MAX_REFRESH_INTERVAL
+        # refresh about when the next TARGET_PAPERS_PER_REFRESH papers are expected
+        return min(MAX_REFRESH_INTERVAL, max(MIN_REFRESH_INTERVAL, TARGET_PAPERS_PER_REFRESH / rate * SECONDS_PER_HOUR))
+
+    def get_due_topics(self, now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        self.refill(now)
+        due = [id for id in self.topic_ids if self.state.get(id).get("next_refresh", 0) <= now]
+        # the most overdue topics go first when the budget can't cover every due topic
+        due.sort(key=lambda id: self.state.get(id).get("next_refresh", 0))
+        # each refresh is charged its worst case, so a deep harvest can't overrun the budget
+        due = due[:int(self.tokens // self.requests_per_refresh)]
+        self.tokens -= len(due) * self.requests_per_refresh
+        return due
+
+    def record(self, arrivals: Dict[str, int], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        for id, count in arrivals.items():
+            state = self.state.get(id)
+            rate = state.get("rate")
+            # the first refresh only sets a baseline, the rate is measured from the second
+            interval = MIN_REFRESH_INTERVAL
+            if "last_refresh" in state:
+                # papers per hour since the previous refresh, smoothed so one quiet day doesn't demote a busy topic
+                observed = count / max(now - state["last_refresh"], MIN_REFRESH_INTERVAL) * SECONDS_PER_HOUR
+                rate = observed if rate is None else RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * rate
+                interval = self.get_interval(rate)
+            self.state.update(id, rate=rate, last_refresh=now, next_refresh=now + interval)
+
+    def defer(self, topic_ids: Iterable[str], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        for id in topic_ids:
+            self.state.update(id, next_refresh=now + MIN_REFRESH_INTERVAL)
+
+    def get_sleep_time(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        next_refresh = min(self.state.get(id).get("next_refresh", 0) for id in self.topic_ids)
+        # wait for the next due topic, or for enough budget to refresh one
+        budget_wait = max(0.0, self.requests_per_refresh - self.tokens) * SECONDS_PER_HOUR / self.request_budget
+        return max(next_refresh - now, budget_wait, 1.0)
@@ -0,0 +1,53 @@
+import re
+import asyncio
+import functools
+import pymongo
+from bson.objectid import ObjectId
+from typing import Awaitable, Callable, List, Dict, Any
+from api.bm25 import BM25Search
+
+SEARCH_BACKENDS = ("atlas", "bm25")
+
+ATLAS_SEARCH_INDEX = "papers_index"
+SEARCH_FIELDS = ["title", "abstract"]
+
+def normalize_query(query: str) -> str:
+    # the text operator ignores case and term order, so these variants share one cached result
+    tokens = re.findall(r"\w+", query.lower())
+    return " ".join(sorted(set(tokens)))
+
+def get_atlas_search_pipeline(query: str, limit: int) -> List[Dict[str, Any]]:
+    return [{
+        "$search": {
+            "index": ATLAS_SEARCH_INDEX,
+            "text": {
+                "query": query,
+                "path": SEARCH_FIELDS
+            }
+        }
+    }, {"$limit": limit}, {"$project": {"_id": 1}}]
+
+def atlas_search(papers_db: pymongo.collection.Collection, query: str, limit: int) -> List[ObjectId]:
+    response = papers_db.aggregate(get_atlas_search_pipeline(query, limit))
+    return [paper["_id"] for paper in response]
+
+async def async_atlas_search(papers_db: pymongo.asynchronous.collection.AsyncCollection, query: str, limit: int) -> List[ObjectId]:
+    response = await papers_db.aggregate(get_atlas_search_pipeline(query, limit))
+    return [paper["_id"] async for paper in response]
+
+def get_search_backend(name: str, papers_db: pymongo.collection.Collection) -> Callable[[str, int], List[ObjectId]]:
+    # atlas needs an Atlas Search index, bm25 searches the index file written by the aggregator in-process
+    if name not in SEARCH_BACKENDS:
+        raise ValueError(f"Invalid search backend: {name}")
+    if name == "bm25":
+        return BM25Search()
+    return functools.partial(atlas_search, papers_db)
+
+def get_async_search_backend(name: str, papers_db: pymongo.asynchronous.collection.AsyncCollection) -> Callable[[str, int], Awaitable[List[ObjectId]]]:
+    if name not in SEARCH_BACKENDS:
+        raise ValueError(f"Invalid search backend: {name}")
+    if name == "bm25":
+        # scoring touches the memory-mapped index, which can fault pages in from disk, so it runs off the event loop
+        bm25_search = BM25Search()
+        return lambda query, limit: asyncio.get_running_loop().run_in_executor(None, bm25_search, query, limit)
+    return functools.partial(async_atlas_search, papers_db)
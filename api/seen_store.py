@@ -0,0 +1,93 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+SECONDS_PER_DAY = 86400
+
+class SeenStore:
+    def __init__(self, path: str = ":memory:", max_age_days: Optional[float] = None):
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # ids are stored as 64-bit hashes in the rowid b-tree, so lookups stay on disk rather than in memory
+        self.connection.execute("CREATE TABLE IF NOT EXISTS seen (hash INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+        self.connection.commit()
+        if max_age_days is not None:
+            self.expire(max_age_days)
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            cursor = self.connection.execute("SELECT 1 FROM seen WHERE hash = ?", (self.hash_key(key),))
+            return cursor.fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def add(self, key: str) -> None:
+        # additions stay uncommitted until commit() so a failed run doesn't mark its papers as ingested
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO seen VALUES (?, ?)", (self.hash_key(key), time.time()))
+
+    def expire(self, max_age_days: float) -> int:
+        cutoff = time.time() - max_age_days * SECONDS_PER_DAY
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM seen WHERE seen_at < ?", (cutoff,))
+            self.connection.commit()
+            return cursor.rowcount
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM seen")
+            self.connection.commit()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def rollback(self) -> None:
+        with self.lock:
+            self.connection.rollback()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+class LayeredSeenStore(SeenStore):
+    # a worker's view of a shared store: lookups also read the committed store on disk,
+    # additions stay in memory and are handed back to the process that owns the store
+    def __init__(self, base_path: str):
+        super().__init__()
+        self.base = None
+        if os.path.exists(base_path):
+            self.base = sqlite3.connect(f"file:{base_path}?mode=ro", uri=True, check_same_thread=False)
+        self.added = []
+
+    def __contains__(self, key: str) -> bool:
+        if super().__contains__(key):
+            return True
+        if self.base is None:
+            return False
+        with self.lock:
+            cursor = self.base.execute("SELECT 1 FROM seen WHERE hash = ?", (self.hash_key(key),))
+            return cursor.fetchone() is not None
+
+    def add(self, key: str) -> None:
+        if not super().__contains__(key):
+            self.added.append(key)
+        super().add(key)
+
+    def close(self) -> None:
+        super().close()
+        if self.base is not None:
+            self.base.close()
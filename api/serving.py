@@ -0,0 +1,68 @@
+import os
+import datetime
+from flask import Flask
+from bson.objectid import ObjectId
+from typing import Optional, Tuple, List, Dict, Any
+from api.utils import LRUCache
+from api.shared_cache import SharedCache
+
+TOPIC_PAGE_SIZE = 10
+TOPIC_CACHE_TTL = 3600
+TOPIC_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_RESULTS = 100
+SEARCH_CACHE_CAPACITY = 1024
+SEARCH_CACHE_TTL = 600
+SEARCH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_BACKENDS = ("memory", "shared")
+# resolved from this file, so both servers share the cache wherever they are started from
+SHARED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache")
+PAPER_FIELDS = ("title", "date", "abstract", "url", "source", "sources", "authors", "topics")
+# list views only need what a paper card shows, the full view drops the aggregator's bookkeeping fields
+PAPER_VIEWS = {
+    "summary": {"title": 1, "date": 1, "url": 1, "source": 1, "topics": 1},
+    "full": {"key": 0, "last_seen": 0}
+}
+DEFAULT_PAPER_VIEW = "full"
+JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(days=1)
+JWT_REFRESH_WINDOW = datetime.timedelta(minutes=10)
+
+def configure_jwt(app: Flask, jwt_key: str) -> None:
+    # JWT cookie-based authentication, the async server reads the same settings so a session works against either
+    app.config["JWT_SECRET_KEY"] = jwt_key
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = JWT_ACCESS_TOKEN_EXPIRES
+    app.config["JWT_TOKEN_LOCATION"] = "cookies"
+    app.config["JWT_COOKIE_SECURE"] = True
+    app.config["JWT_COOKIE_CSRF_PROTECT"] = True
+
+def create_cache(name: str, capacity: int, ttl: Optional[float], max_bytes: Optional[int], backend: str = "memory") -> LRUCache:
+    # memory keeps a copy per process, shared keeps one copy in a local file for every worker on the host
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Invalid cache backend: {backend}")
+    if backend == "shared":
+        return SharedCache(os.path.join(SHARED_CACHE_DIR, f"{name}.db"), capacity, ttl=ttl, max_bytes=max_bytes)
+    return LRUCache(capacity, ttl=ttl, max_bytes=max_bytes)
+
+def get_paper_projection(view: Optional[str], fields: Optional[str]) -> Optional[Tuple[str, Dict[str, int]]]:
+    # returns the name the response is cached under and the projection sent to MongoDB, or None if either is invalid
+    if fields is not None:
+        names = sorted(set(fields.split(",")))
+        if not all(name in PAPER_FIELDS for name in names):
+            return None
+        projection = {name: 1 for name in names}
+        # date is always kept, topic feed cursors are built from it
+        projection["date"] = 1
+        return (",".join(names), projection)
+    view = view or DEFAULT_PAPER_VIEW
+    if view not in PAPER_VIEWS:
+        return None
+    return (view, PAPER_VIEWS[view])
+
+def parse_bookmark_uids(body: Any) -> Optional[List[str]]:
+    # accepts a single "uid" or a batch of "uids"
+    if not isinstance(body, dict):
+        return None
+    uids = body.get("uids", [body["uid"]] if "uid" in body else None)
+    if not isinstance(uids, list) or not uids or not all(isinstance(uid, str) and ObjectId.is_valid(uid) for uid in uids):
+        return None
+    return uids
@@ -0,0 +1,108 @@
+import os
+import time
+import pickle
+import sqlite3
+from typing import Optional, Any
+from api.utils import LRUCache
+
+BUSY_TIMEOUT = 30
+# recency is written back at most once per interval, so hot entries don't turn every read into a write
+LRU_TOUCH_INTERVAL = 1
+
+class SharedCache(LRUCache):
+    # LRUCache semantics over an SQLite file, every worker process on the host reads and fills the same entries
+    def __init__(self, path: str, capacity: int, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        super().__init__(capacity, ttl=ttl, max_bytes=max_bytes)
+        self.path = path
+        self.connection = None
+        self.pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        # a connection inherited from the parent of a forked worker isn't safe to use, each process opens its own
+        if self.pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entries (id TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.pid = os.getpid()
+        return self.connection
+
+    def get(self, id: str) -> Optional[Any]:
+        # wall clock time, since expiry times are compared across processes
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT value, expires, last_used FROM entries WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires, last_used = row
+            if expires is not None and expires <= now:
+                connection.execute("DELETE FROM entries WHERE id = ? AND expires <= ?", (id, now))
+                self.misses += 1
+                return None
+            if now - last_used >= LRU_TOUCH_INTERVAL:
+                connection.execute("UPDATE entries SET last_used = ? WHERE id = ?", (now, id))
+            self.hits += 1
+        return pickle.loads(value)
+
+    def put(self, id: str, papers: Any, size: Optional[int] = None) -> None:
+        # entries are charged their pickled size, which is what the file actually holds
+        value = pickle.dumps(papers, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self.max_bytes is not None and len(value) > self.max_bytes:
+                    connection.execute("DELETE FROM entries WHERE id = ?", (id,))
+                else:
+                    connection.execute("INSERT OR REPLACE INTO entries (id, value, expires, size, last_used) VALUES (?, ?, ?, ?, ?)", (id, value, expires, len(value), now))
+                count, self.size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                if count > self.capacity or (self.max_bytes is not None and self.size > self.max_bytes):
+                    evicted = []
+                    for evicted_id, evicted_size in connection.execute("SELECT id, size FROM entries WHERE id != ? ORDER BY last_used", (id,)).fetchall():
+                        if count <= self.capacity and (self.max_bytes is None or self.size <= self.max_bytes):
+                            break
+                        evicted.append((evicted_id,))
+                        count -= 1
+                        self.size -= evicted_size
+                    connection.executemany("DELETE FROM entries WHERE id = ?", evicted)
+                    self.evictions += len(evicted)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connect().execute("DELETE FROM entries")
+            self.size = 0
+
+    def set_generation(self, generation: Optional[str]) -> None:
+        # the generation is stored with the entries, so only the first worker to see a publish clears them
+        if generation is None:
+            return
+        with self.lock:
+            connection = self.connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+                if row is None or row[0] != generation:
+                    connection.execute("DELETE FROM entries")
+                    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (generation,))
+                    self.size = 0
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self.generation = generation
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
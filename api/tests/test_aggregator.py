@@ -1,10 +1,22 @@
 import json
+import asyncio
+import threading
 import requests
 import xmltodict
+import mongomock
 import pytest_mock
+from collections import defaultdict
 import sys
 sys.path.append("..")
-from aggregator import fetch_arxiv, parse_arxiv, fetch_semantic_scholar, parse_semantic_scholar
+import aggregator
+from aggregator import (fetch_arxiv, parse_arxiv, fetch_semantic_scholar, parse_semantic_scholar,
+    fetch_arxiv_async, fetch_semantic_scholar_async, get_semantic_scholar_url, fetch_topics, publish_papers, renew_lease, work_jobs)
+from classifier import ClassificationStage
+from seen_store import SeenStore
+from harvester import WatermarkStore
+from near_duplicates import NearDuplicateIndex
+from work_queue import WorkQueue
+from utils import get_paper_key
 
 PAPER_FIELDS = ["title", "date", "abstract", "url", "source", "authors", "topics"]
 VALID_TOPIC_ID = "AI"
@@ -29,8 +41,9 @@ def test_fetch_arxiv(mocker: pytest_mock.MockerFixture):
 
     session = requests.Session()
     mocker.patch.object(session, "get")
-    session.get.return_value.text = xml_data
+    session.get.return_value.iter_content.return_value = [xml_data.encode("utf-8")]
     assert fetch_arxiv(session, VALID_TOPIC_ID) == parse_arxiv(xmltodict.parse(xml_data), VALID_TOPIC_ID)
+    assert session.get.call_args[1] == {"stream": True}
 
     session.get.side_effect = Exception("Mocked exception")
     assert fetch_arxiv(session, VALID_TOPIC_ID) == None
@@ -58,4 +71,144 @@ def test_fetch_semantic_scholar(mocker: pytest_mock.MockFixture):
     assert fetch_semantic_scholar(session, VALID_TOPIC_ID, VALID_TOPIC_NAME) == parse_semantic_scholar(json_data, VALID_TOPIC_ID)
 
     session.get.side_effect = Exception("Mocked exception")
-    assert fetch_semantic_scholar(session, VALID_TOPIC_ID, VALID_TOPIC_NAME) == None
\ No newline at end of file
+    assert fetch_semantic_scholar(session, VALID_TOPIC_ID, VALID_TOPIC_NAME) == None
+
+def test_fetch_arxiv_async(mocker: pytest_mock.MockerFixture):
+    with open("mocks/arxiv_api_mock.xml", "rb") as file:
+        xml_data = file.read()
+
+    async def stream(url: str):
+        for i in range(0, len(xml_data), 1024):
+            yield xml_data[i:i+1024]
+
+    fetcher = mocker.MagicMock()
+    fetcher.stream = mocker.MagicMock(side_effect=stream)
+    assert asyncio.run(fetch_arxiv_async(fetcher, VALID_TOPIC_ID)) == parse_arxiv(xmltodict.parse(xml_data), VALID_TOPIC_ID)
+    assert "start=0" in fetcher.stream.call_args[0][0]
+
+    fetcher.stream.side_effect = Exception("Mocked exception")
+    assert asyncio.run(fetch_arxiv_async(fetcher, VALID_TOPIC_ID)) == None
+
+def test_fetch_arxiv_async_watermark(mocker: pytest_mock.MockerFixture):
+    with open("mocks/arxiv_api_mock.xml", "rb") as file:
+        xml_data = file.read()
+    entries = xmltodict.parse(xml_data)["feed"]["entry"]
+
+    async def stream(url: str):
+        yield xml_data
+
+    watermarks = WatermarkStore()
+    watermarks.update(VALID_TOPIC_ID, watermark={"id": entries[1]["id"], "published": entries[1]["published"]})
+    mocker.patch("aggregator.seen_arxiv_papers", SeenStore())
+    mocker.patch("aggregator.arxiv_watermarks", watermarks)
+    mocker.patch("aggregator.seen_paper_keys", [])
+    fetcher = mocker.MagicMock()
+    fetcher.stream = mocker.MagicMock(side_effect=stream)
+
+    papers = asyncio.run(fetch_arxiv_async(fetcher, VALID_TOPIC_ID))
+    assert [paper["url"] for paper in papers] == [entries[0]["id"]]
+    # papers ingested by earlier runs are still listed, so publishing keeps them
+    assert aggregator.seen_paper_keys == [get_paper_key({"url": entry["id"]}) for entry in entries[1:]]
+    assert fetcher.stream.call_count == 1
+    assert watermarks.get(VALID_TOPIC_ID)["watermark"]["id"] == entries[0]["id"]
+
+def test_fetch_semantic_scholar_async(mocker: pytest_mock.MockerFixture):
+    with open("mocks/semantic_scholar_api_mock.json") as file:
+        json_data = json.load(file)
+
+    fetcher = mocker.MagicMock()
+    fetcher.get = mocker.AsyncMock(return_value=json.dumps({"data": json_data}).encode("utf-8"))
+    assert asyncio.run(fetch_semantic_scholar_async(fetcher, VALID_TOPIC_ID, VALID_TOPIC_NAME)) == parse_semantic_scholar(json_data, VALID_TOPIC_ID)
+    fetcher.get.assert_called_once_with(get_semantic_scholar_url(VALID_TOPIC_NAME))
+
+    fetcher.get.side_effect = Exception("Mocked exception")
+    assert asyncio.run(fetch_semantic_scholar_async(fetcher, VALID_TOPIC_ID, VALID_TOPIC_NAME)) == None
+
+def test_fetch_topics(mocker: pytest_mock.MockerFixture):
+    arxiv_paper = {"title": "arxiv", "abstract": "arxiv abstract", "topics": ["AI"]}
+    semantic_scholar_paper = {"title": "semantic scholar", "abstract": "semantic scholar abstract", "topics": ["AI"]}
+    mocker.patch("aggregator.fetch_arxiv_async", mocker.AsyncMock(return_value=[arxiv_paper]))
+    mocker.patch("aggregator.fetch_semantic_scholar_async", mocker.AsyncMock(return_value=([semantic_scholar_paper], [semantic_scholar_paper["abstract"]])))
+    predict = mocker.MagicMock(return_value=[["LG", "CV"]])
+
+    classifier = ClassificationStage(lambda: predict)
+    arrivals = defaultdict(int)
+    papers = asyncio.run(fetch_topics({VALID_TOPIC_ID: VALID_TOPIC_NAME}, classifier, arrivals=arrivals))
+    classifier.close()
+    assert len(papers) == 2
+    assert arrivals == {VALID_TOPIC_ID: 2}
+    assert arxiv_paper["topics"] == ["AI"]
+    assert semantic_scholar_paper["topics"] == ["LG", "CV"]
+    predict.assert_called_once_with([semantic_scholar_paper["abstract"]])
+
+def test_publish_papers_without_new_papers(mocker: pytest_mock.MockerFixture):
+    build_search_index = mocker.patch("aggregator.build_search_index")
+    mocker.patch.dict("os.environ", {"SEARCH_BACKEND": "atlas"})
+    mocker.patch("aggregator.seen_arxiv_papers", SeenStore())
+    mocker.patch("aggregator.seen_paper_keys", [])
+    critical = mocker.patch("logging.critical")
+    papers_db = mongomock.MongoClient()["research"]["papers"]
+    aggregator.seen_arxiv_papers.add("http://arxiv.org/abs/2305.08854v1")
+
+    # a quiet refresh commits its progress like any other
+    assert publish_papers([], papers_db, NearDuplicateIndex())
+    assert "http://arxiv.org/abs/2305.08854v1" in aggregator.seen_arxiv_papers
+    critical.assert_not_called()
+    # the index file is only read by the bm25 search backend
+    build_search_index.assert_not_called()
+    mocker.patch.dict("os.environ", {"SEARCH_BACKEND": "bm25"})
+    assert publish_papers([], papers_db, NearDuplicateIndex())
+    build_search_index.assert_called_once_with(papers_db)
+
+def test_renew_lease(mocker: pytest_mock.MockerFixture):
+    mocker.patch("aggregator.JOB_LEASE_SECONDS", 0.03)
+    threads = []
+    queue = mocker.MagicMock()
+    queue.renew.side_effect = lambda id, owner: threads.append(threading.get_ident())
+
+    async def run():
+        renewal = asyncio.ensure_future(renew_lease(queue, {"id": 1}, "owner"))
+        await asyncio.sleep(0.05)
+        renewal.cancel()
+
+    asyncio.run(run())
+    queue.renew.assert_called_with(1, "owner")
+    # the sqlite write runs off the event loop thread
+    assert threading.get_ident() not in threads
+
+def test_work_jobs(mocker: pytest_mock.MockerFixture, tmp_path):
+    arxiv_paper = {"title": "arxiv", "abstract": "arxiv abstract", "topics": ["AI"]}
+    watermark = {"id": "http://arxiv.org/abs/2305.08854v1", "published": "2023-05-15T17:00:00Z"}
+
+    async def fetch_arxiv(fetcher, id):
+        aggregator.seen_arxiv_papers.add(watermark["id"])
+        aggregator.arxiv_watermarks.update(id, watermark=watermark, next_start=None)
+        return [arxiv_paper]
+
+    mocker.patch("aggregator.seen_arxiv_papers", SeenStore())
+    mocker.patch("aggregator.seen_semantic_scholar_papers", SeenStore())
+    mocker.patch("aggregator.arxiv_watermarks", WatermarkStore())
+    mocker.patch("aggregator.SEEN_ARXIV_PAPERS_FILE", str(tmp_path / "seen_arxiv_papers.db"))
+    mocker.patch("aggregator.SEEN_SEMANTIC_SCHOLAR_PAPERS_FILE", str(tmp_path / "seen_semantic_scholar_papers.db"))
+    mocker.patch("aggregator.fetch_arxiv_async", fetch_arxiv)
+    mocker.patch("aggregator.fetch_semantic_scholar_async", mocker.AsyncMock(return_value=None))
+
+    queue = WorkQueue(str(tmp_path / "work_queue.db"))
+    queue.enqueue("run", [{"id": VALID_TOPIC_ID, "name": VALID_TOPIC_NAME, "watermark": {"next_start": 25}}])
+    threads = []
+    claim = queue.claim
+    mocker.patch.object(queue, "claim", side_effect=lambda owner: threads.append(threading.get_ident()) or claim(owner))
+    classifier = ClassificationStage(lambda: None)
+    asyncio.run(work_jobs(queue, classifier, None, "run"))
+    classifier.close()
+    # claims wait on the database lock off the event loop thread
+    assert threads and threading.get_ident() not in threads
+    assert queue.get_results("run") == [{
+        "id": VALID_TOPIC_ID,
+        "papers": [arxiv_paper],
+        "seen_arxiv_papers": [watermark["id"]],
+        "seen_semantic_scholar_papers": [],
+        "seen_paper_keys": [],
+        "watermark": {"watermark": watermark}
+    }]
+    queue.close()
@@ -3,7 +3,9 @@ import pytest_mock
 import sys
 sys.path.append("..")
 from typing import Dict, Any
-from app import app, users_db, papers_db, lru_cache, ObjectId
+from app import app, users_db, papers_db, lru_cache, search_cache, ObjectId
+from responses import encode_papers
+from serving import PAPER_VIEWS
 from tests.mocks.db_mocks import db_papers_response, parsed_db_papers_response
 
 SERVER = app.test_client()
@@ -29,6 +31,12 @@ def extract_csrf_token_helper(headers: str) -> str:
             return cookie[start_csrf_cookie:end_csrf_cookie]
     return ""
 
+def test_health(mocker: pytest_mock.MockFixture):
+    mocker.patch("app.check_db_connection", return_value=True)
+    assert SERVER.get("/api/health").status_code == 200
+    mocker.patch("app.check_db_connection", return_value=False)
+    assert SERVER.get("/api/health").status_code == 503
+
 def test_topic_query_invalid_topic_id():
     invalid_topic_id = "test"
     response = SERVER.get(f"/api/topic/{invalid_topic_id}")
@@ -37,36 +45,121 @@ def test_topic_query_invalid_topic_id():
 def test_topic_query_cache_miss(mocker: pytest_mock.MockFixture):
     mocker.patch.object(lru_cache, "get", return_value=None)
     query_cursor = mocker.MagicMock()
-    query_cursor.limit.return_value = db_papers_response
+    query_cursor.sort.return_value.limit.return_value = db_papers_response
     mocker.patch.object(papers_db, "find", return_value=query_cursor)
     valid_topic_id = "AI"
 
     response = SERVER.get(f"api/topic/{valid_topic_id}")
     assert response.status_code == 200
     assert response.json == parsed_db_papers_response
-    lru_cache.get.assert_called_once_with(valid_topic_id)
-    papers_db.find.assert_called_once_with({"topics": [valid_topic_id]})
+    assert "X-Next-Cursor" not in response.headers
+    lru_cache.get.assert_called_once_with(f"{valid_topic_id}\nfull")
+    papers_db.find.assert_called_once_with({"topics": valid_topic_id}, PAPER_VIEWS["full"])
 
 def test_topic_query_cache_hit(mocker: pytest_mock.MockFixture):
-    mocker.patch.object(lru_cache, "get", return_value=parsed_db_papers_response)
+    mocker.patch.object(lru_cache, "get", return_value=(encode_papers(db_papers_response), None))
     mocker.patch.object(papers_db, "find")
     valid_topic_id = "AI"
 
     response = SERVER.get(f"api/topic/{valid_topic_id}")
     assert response.status_code == 200
-    lru_cache.get.assert_called_once_with(valid_topic_id)
+    assert response.json == parsed_db_papers_response
+    lru_cache.get.assert_called_once_with(f"{valid_topic_id}\nfull")
     papers_db.find.assert_not_called()
 
+def test_topic_query_keyset_pagination(mocker: pytest_mock.MockFixture):
+    mocker.patch.object(lru_cache, "get")
+    papers = [{"_id": ObjectId(), "date": "2023-05-15", "topics": ["AI"]} for _ in range(10)]
+    query_cursor = mocker.MagicMock()
+    query_cursor.sort.return_value.limit.return_value = papers
+    mocker.patch.object(papers_db, "find", return_value=query_cursor)
+
+    next_cursor = f"2023-05-15_{papers[-1]['_id']}"
+    response = SERVER.get(f"api/topic/AI?cursor={next_cursor}")
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"] == next_cursor
+    lru_cache.get.assert_not_called()
+    papers_db.find.assert_called_once_with({"topics": "AI", "$or": [
+        {"date": {"$lt": "2023-05-15"}},
+        {"date": "2023-05-15", "_id": {"$lt": papers[-1]["_id"]}}
+    ]}, PAPER_VIEWS["full"])
+    assert SERVER.get("api/topic/AI?cursor=2023-05-15_invalid").status_code == 400
+
 def test_search_query_empty_response(mocker: pytest_mock.MockFixture):
+    search_cache.clear()
     mocker.patch.object(papers_db, "aggregate", return_value=[])
     response = SERVER.get("/api/search/test")
     assert response.status_code == 404
 
+    # punctuation alone normalizes to nothing and never reaches the search backend
+    papers_db.aggregate.reset_mock()
+    assert SERVER.get("/api/search/-.-").status_code == 404
+    papers_db.aggregate.assert_not_called()
+
 def test_search_query_with_response(mocker: pytest_mock.MockerFixture):
-    mocker.patch.object(papers_db, "aggregate", return_value=db_papers_response)
+    search_cache.clear()
+    mocker.patch.object(papers_db, "aggregate", return_value=[{"_id": paper["_id"]} for paper in db_papers_response])
+    mocker.patch.object(papers_db, "find", return_value=list(reversed(db_papers_response)))
     response = SERVER.get("/api/search/AI")
     assert response.status_code == 200
     assert response.json == parsed_db_papers_response
+    assert list(response.json) == [paper["_id"] for paper in db_papers_response]
+    assert "X-Next-Cursor" not in response.headers
+
+    # a normalized variant of the query is served from the cache
+    response = SERVER.get("/api/search/ ai ")
+    assert response.status_code == 200
+    papers_db.aggregate.assert_called_once()
+    papers_db.find.assert_called_once()
+
+def test_search_query_pagination(mocker: pytest_mock.MockerFixture):
+    search_cache.clear()
+    ranked_ids = [ObjectId() for _ in range(15)]
+    mocker.patch.object(papers_db, "aggregate", return_value=[{"_id": paper_id} for paper_id in ranked_ids])
+    mocker.patch.object(papers_db, "find", side_effect=lambda query, projection: [{"_id": paper_id} for paper_id in query["_id"]["$in"]])
+    response = SERVER.get("/api/search/neural networks")
+    assert len(response.json) == 10
+    assert response.headers["X-Next-Cursor"] == "10"
+
+    response = SERVER.get("/api/search/networks neural?cursor=10")
+    assert list(response.json) == [str(paper_id) for paper_id in ranked_ids[10:]]
+    assert "X-Next-Cursor" not in response.headers
+    papers_db.aggregate.assert_called_once()
+    assert SERVER.get("/api/search/neural?cursor=next").status_code == 400
+
+def test_paper_views(mocker: pytest_mock.MockerFixture):
+    lru_cache.clear()
+    query_cursor = mocker.MagicMock()
+    query_cursor.sort.return_value.limit.return_value = db_papers_response
+    mocker.patch.object(papers_db, "find", return_value=query_cursor)
+
+    response = SERVER.get("api/topic/AI?view=summary")
+    assert response.status_code == 200
+    papers_db.find.assert_called_once_with({"topics": "AI"}, PAPER_VIEWS["summary"])
+    # each view is cached separately
+    SERVER.get("api/topic/AI?view=summary")
+    SERVER.get("api/topic/AI?fields=title,url")
+    assert papers_db.find.call_count == 2
+    assert papers_db.find.call_args[0][1] == {"title": 1, "url": 1, "date": 1}
+    # ad-hoc fields projections aren't cached, so they can't evict the named views
+    SERVER.get("api/topic/AI?fields=title,url")
+    assert papers_db.find.call_count == 3
+    assert lru_cache.get("AI\ntitle,url") is None
+
+    assert SERVER.get("api/topic/AI?view=compact").status_code == 400
+    assert SERVER.get("api/topic/AI?fields=title,password").status_code == 400
+    assert SERVER.get("api/search/AI?view=compact").status_code == 400
+
+def test_paper_query(mocker: pytest_mock.MockerFixture):
+    mocker.patch.object(papers_db, "find_one", return_value=db_papers_response[0])
+    response = SERVER.get(f"api/paper/{db_papers_response[0]['_id']}")
+    assert response.status_code == 200
+    assert response.json == {db_papers_response[0]["_id"]: parsed_db_papers_response[db_papers_response[0]["_id"]]}
+    papers_db.find_one.assert_called_once_with({"_id": ObjectId(db_papers_response[0]["_id"])}, PAPER_VIEWS["full"])
+
+    mocker.patch.object(papers_db, "find_one", return_value=None)
+    assert SERVER.get(f"api/paper/{ObjectId()}").status_code == 404
+    assert SERVER.get("api/paper/invalid").status_code == 400
 
 def test_signup_exisiting_credentials(mocker: pytest_mock.MockFixture):
     mocker.patch.object(users_db, "find_one", return_value=VALID_USERS_DB_ENTRY)
@@ -187,12 +280,24 @@ def test_bookmarks_no_access_tokens():
 
 def test_bookmarks_get(mocker: pytest_mock.MockerFixture):
     login_helper(mocker, VALID_USERS_DB_ENTRY)
-    mocker.patch.object(users_db, "find_one", return_value=VALID_USERS_DB_ENTRY)
-    mocker.patch.object(papers_db, "find", return_value=db_papers_response)
+    mocker.patch.object(users_db, "find_one")
+    mocker.patch.object(users_db, "aggregate", return_value=[{"papers": db_papers_response}])
+    mocker.patch.object(papers_db, "find")
     response = SERVER.get("/api/bookmarks")
     assert response.status_code == 200
     assert response.json == parsed_db_papers_response
-    papers_db.find.assert_called_once_with({"_id": {"$in": [ObjectId(paper_id) for paper_id in VALID_USERS_DB_ENTRY["bookmarks"]]}})
+    # the user and their papers are read with one aggregation
+    pipeline = users_db.aggregate.call_args[0][0]
+    assert pipeline[0] == {"$match": {"email": VALID_USERS_DB_ENTRY["email"]}}
+    assert pipeline[2]["$lookup"]["foreignField"] == "_id"
+    assert pipeline[2]["$lookup"]["pipeline"] == [{"$project": PAPER_VIEWS["full"]}]
+    users_db.find_one.assert_not_called()
+    papers_db.find.assert_not_called()
+
+    mocker.patch.object(users_db, "aggregate", return_value=[])
+    response = SERVER.get("/api/bookmarks")
+    assert response.status_code == 200
+    assert response.json == {}
 
 def test_bookmarks_put(mocker: pytest_mock.MockerFixture):
     login_response = login_helper(mocker, VALID_USERS_DB_ENTRY)
@@ -201,7 +306,21 @@ def test_bookmarks_put(mocker: pytest_mock.MockerFixture):
     mocker.patch.object(users_db, "update_one")
     response = SERVER.post("/api/bookmarks", json=json, headers=headers)
     assert response.status_code == 201
-    users_db.update_one.assert_called_once_with({"email": VALID_USERS_DB_ENTRY["email"]}, {"$addToSet": {"bookmarks": json["uid"]}})
+    users_db.update_one.assert_called_once_with({"email": VALID_USERS_DB_ENTRY["email"]}, {"$addToSet": {"bookmarks": {"$each": [json["uid"]]}}})
+
+def test_bookmarks_put_batch(mocker: pytest_mock.MockerFixture):
+    login_response = login_helper(mocker, VALID_USERS_DB_ENTRY)
+    headers = {"Content-Type": "application/json", "X-CSRF-TOKEN": extract_csrf_token_helper(login_response.headers)}
+    json = {"uids": VALID_USERS_DB_ENTRY["bookmarks"]}
+    mocker.patch.object(users_db, "update_one")
+    response = SERVER.post("/api/bookmarks", json=json, headers=headers)
+    assert response.status_code == 201
+    users_db.update_one.assert_called_once_with({"email": VALID_USERS_DB_ENTRY["email"]}, {"$addToSet": {"bookmarks": {"$each": json["uids"]}}})
+
+    for invalid_json in [{"uids": []}, {"uids": ["invalid"]}, {"uids": "645cfd573007dd700aa1fe80"}, {}]:
+        response = SERVER.post("/api/bookmarks", json=invalid_json, headers=headers)
+        assert response.status_code == 400
+    users_db.update_one.assert_called_once()
 
 def test_bookmarks_delete(mocker: pytest_mock.MockerFixture):
     login_response = login_helper(mocker, VALID_USERS_DB_ENTRY)
@@ -210,4 +329,4 @@ def test_bookmarks_delete(mocker: pytest_mock.MockerFixture):
     mocker.patch.object(users_db, "update_one")
     response = SERVER.delete("/api/bookmarks", json=json, headers=headers)
     assert response.status_code == 200
-    users_db.update_one.assert_called_once_with({"email": VALID_USERS_DB_ENTRY["email"]}, {"$pull": {"bookmarks": json["uid"]}})
\ No newline at end of file
+    users_db.update_one.assert_called_once_with({"email": VALID_USERS_DB_ENTRY["email"]}, {"$pullAll": {"bookmarks": [json["uid"]]}})
\ No newline at end of file
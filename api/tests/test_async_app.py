@@ -0,0 +1,155 @@
+import sys
+sys.path.append("..")
+import asyncio
+import hashlib
+import pytest_mock
+from unittest.mock import AsyncMock, MagicMock
+from aiohttp.test_utils import TestClient, TestServer
+from bson.objectid import ObjectId
+from async_app import build_app, TOPIC_CACHE, SEARCH_CACHE
+from api.shared_cache import SharedCache
+from tests.mocks.db_mocks import db_papers_response, parsed_db_papers_response
+
+JWT_KEY = "test-key-of-at-least-thirty-two-bytes"
+CREDENTIALS = {"email": "text@example.com", "password": "test123"}
+VALID_USERS_DB_ENTRY = {
+    "email": CREDENTIALS["email"],
+    "password": hashlib.sha256(CREDENTIALS["password"].encode("utf-8")).hexdigest(),
+    "bookmarks": ["645cfd573007dd700aa1fe7d", "645cfd573007dd700aa1fe80"]
+}
+
+def create_mock_dbs():
+    papers_db = MagicMock()
+    papers_db.name = "papers"
+    papers_db.database.__getitem__.return_value.find_one = AsyncMock(return_value=None)
+    users_db = MagicMock()
+    users_db.find_one = AsyncMock(return_value=VALID_USERS_DB_ENTRY)
+    users_db.update_one = AsyncMock()
+    return (papers_db, users_db)
+
+def run_client(papers_db, users_db, test):
+    async def run():
+        async with TestClient(TestServer(build_app(papers_db, users_db, JWT_KEY))) as client:
+            await test(client)
+    asyncio.run(run())
+
+def test_health():
+    papers_db, users_db = create_mock_dbs()
+    users_db.name = "users"
+    papers_db.database.list_collection_names = AsyncMock(return_value=["papers", "users"])
+    users_db.database.list_collection_names = AsyncMock(return_value=["papers", "users"])
+
+    async def test(client):
+        response = await client.get("/api/health")
+        assert response.status == 200
+        assert await response.json() == {"data": "Healthy"}
+        users_db.database.list_collection_names.side_effect = Exception("Mocked exception")
+        assert (await client.get("/api/health")).status == 503
+
+    run_client(papers_db, users_db, test)
+
+def test_topic_query_coalesces_cache_misses():
+    papers_db, users_db = create_mock_dbs()
+    async def to_list():
+        await asyncio.sleep(0.05)
+        return db_papers_response
+    papers_db.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(side_effect=to_list)
+
+    async def test(client):
+        responses = await asyncio.gather(*[client.get("/api/topic/AI") for _ in range(5)])
+        assert all(response.status == 200 for response in responses)
+        assert await responses[0].json() == parsed_db_papers_response
+        # later requests are served from the cache
+        response = await client.get("/api/topic/AI", headers={"If-None-Match": responses[0].headers["ETag"]})
+        assert response.status == 304
+        assert (await client.get("/api/topic/test")).status == 404
+        assert (await client.get("/api/topic/AI?cursor=2023-05-15_invalid")).status == 400
+
+    run_client(papers_db, users_db, test)
+    papers_db.find.assert_called_once_with({"topics": "AI"}, {"key": 0, "last_seen": 0})
+
+def test_search_query_pagination():
+    papers_db, users_db = create_mock_dbs()
+    ranked_ids = [ObjectId() for _ in range(15)]
+    search_cursor = MagicMock()
+    search_cursor.__aiter__.return_value = [{"_id": paper_id} for paper_id in ranked_ids]
+    papers_db.aggregate = AsyncMock(return_value=search_cursor)
+    def find(query, projection):
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(return_value=[{"_id": paper_id} for paper_id in reversed(query["_id"]["$in"])])
+        return cursor
+    papers_db.find.side_effect = find
+
+    async def test(client):
+        response = await client.get("/api/search/neural networks")
+        assert list(await response.json()) == [str(paper_id) for paper_id in ranked_ids[:10]]
+        assert response.headers["X-Next-Cursor"] == "10"
+        response = await client.get("/api/search/networks neural?cursor=10")
+        assert list(await response.json()) == [str(paper_id) for paper_id in ranked_ids[10:]]
+        assert "X-Next-Cursor" not in response.headers
+        assert (await client.get("/api/search/neural?cursor=next")).status == 400
+        assert (await client.get("/api/search/-.-")).status == 404
+        # the summary view reuses the cached ranking
+        response = await client.get("/api/search/neural networks?view=summary")
+        assert response.status == 200
+        assert papers_db.find.call_args[0][1] == {"title": 1, "date": 1, "url": 1, "source": 1, "topics": 1}
+
+    run_client(papers_db, users_db, test)
+    papers_db.aggregate.assert_called_once()
+
+def test_bookmarks_with_jwt_cookies():
+    papers_db, users_db = create_mock_dbs()
+    bookmarks_cursor = MagicMock()
+    bookmarks_cursor.to_list = AsyncMock(return_value=[{"papers": db_papers_response}])
+    users_db.aggregate = AsyncMock(return_value=bookmarks_cursor)
+
+    async def test(client):
+        assert (await client.get("/api/bookmarks")).status == 401
+        response = await client.post("/api/login", json=CREDENTIALS)
+        assert response.status == 200
+        cookies = {name: response.cookies[name].value for name in ["access_token_cookie", "csrf_access_token"]}
+        assert response.cookies["access_token_cookie"]["httponly"]
+
+        response = await client.get("/api/bookmarks", cookies=cookies)
+        assert response.status == 200
+        assert await response.json() == parsed_db_papers_response
+        assert (await client.get("/api/user", cookies=cookies)).status == 200
+
+        uids = ["645cfd573007dd700aa1fe7d"]
+        assert (await client.post("/api/bookmarks", json={"uids": uids}, cookies=cookies)).status == 401
+        response = await client.post("/api/bookmarks", json={"uids": uids}, cookies=cookies, headers={"X-CSRF-TOKEN": cookies["csrf_access_token"]})
+        assert response.status == 201
+        response = await client.post("/api/bookmarks", json={"uid": "invalid"}, cookies=cookies, headers={"X-CSRF-TOKEN": cookies["csrf_access_token"]})
+        assert response.status == 400
+
+    run_client(papers_db, users_db, test)
+    users_db.update_one.assert_called_once_with({"email": CREDENTIALS["email"]}, {"$addToSet": {"bookmarks": {"$each": ["645cfd573007dd700aa1fe7d"]}}})
+
+def test_metrics():
+    papers_db, users_db = create_mock_dbs()
+    papers_db.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=db_papers_response)
+
+    async def test(client):
+        for _ in range(2):
+            assert (await client.get("/api/topic/AI")).status == 200
+        assert (await client.get("/api/topic/XX")).status == 404
+        response = await client.get("/metrics")
+        assert response.status == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        lines = (await response.text()).splitlines()
+        assert 'api_request_duration_seconds_count{route="/api/topic/{id}",method="GET",status="200"} 2' in lines
+        assert 'api_request_duration_seconds_count{route="/api/topic/{id}",method="GET",status="404"} 1' in lines
+        assert 'api_stage_duration_seconds_count{route="/api/topic/{id}",stage="mongo"} 1' in lines
+        assert 'api_response_size_bytes_count{route="/api/topic/{id}"} 3' in lines
+        assert 'api_cache_requests_total{cache="topic",result="hit"} 1' in lines
+        assert 'api_cache_requests_total{cache="topic",result="miss"} 1' in lines
+
+    run_client(papers_db, users_db, test)
+
+def test_shared_cache_backend(mocker: pytest_mock.MockerFixture, tmp_path):
+    mocker.patch("api.serving.SHARED_CACHE_DIR", str(tmp_path))
+    papers_db, users_db = create_mock_dbs()
+    app = build_app(papers_db, users_db, JWT_KEY, cache_backend="shared")
+    assert isinstance(app[TOPIC_CACHE], SharedCache)
+    assert isinstance(app[SEARCH_CACHE], SharedCache)
+    assert app[TOPIC_CACHE].path == str(tmp_path / "topic.db")
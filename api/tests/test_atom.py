@@ -0,0 +1,31 @@
+import xmltodict
+import sys
+sys.path.append("..")
+from atom import AtomEntryParser, iter_atom_entries
+
+def test_iter_atom_entries():
+    with open("mocks/arxiv_api_mock.xml", "rb") as file:
+        xml_data = file.read()
+    expected = xmltodict.parse(xml_data)["feed"]["entry"]
+
+    # feed the document in small chunks to split elements across reads
+    entries = list(iter_atom_entries(xml_data[i:i+100] for i in range(0, len(xml_data), 100)))
+    assert len(entries) == len(expected)
+    for entry, expected_entry in zip(entries, expected):
+        for field in ["id", "published", "title", "summary"]:
+            assert entry[field] == expected_entry[field]
+        expected_authors = expected_entry["author"]
+        if not isinstance(expected_authors, list):
+            expected_authors = [expected_authors]
+        assert [author["name"] for author in entry["author"]] == [author["name"] for author in expected_authors]
+        assert [category["@term"] for category in entry["category"]] == [category["@term"] for category in expected_entry["category"]]
+
+def test_atom_entry_parser_releases_entries():
+    with open("mocks/arxiv_api_mock.xml", "rb") as file:
+        xml_data = file.read()
+
+    parser = AtomEntryParser()
+    entries = parser.feed(xml_data)
+    entries += parser.close()
+    assert len(entries) == 2
+    assert not parser.root.findall("{http://www.w3.org/2005/Atom}entry")
@@ -0,0 +1,24 @@
+import os
+import pytest_mock
+import sys
+sys.path.append("..")
+import aggregator
+from benchmark import main
+
+def test_benchmark_smoke(mocker: pytest_mock.MockerFixture):
+    # the benchmark rebinds aggregator globals, patching them restores the originals for later tests
+    for name in ["ARXIV_API_URL", "SEMANTIC_SCHOLAR_API_URL", "MAX_PAPERS_REQUEST", "parse_arxiv_entry", "parse_semantic_scholar",
+                 "deduplicate_papers", "publish_db_data", "build_search_index", "seen_arxiv_papers", "seen_semantic_scholar_papers",
+                 "arxiv_watermarks", "seen_paper_keys"]:
+        mocker.patch(f"aggregator.{name}", getattr(aggregator, name))
+
+    mocker.patch.dict(os.environ)
+
+    results = main(["--topics", "1", "--papers", "2", "--runs", "1", "--latency", "0", "--search-backend", "bm25"])
+    assert len(results) == 1
+    assert results[0]["published"]
+    assert results[0]["papers"] == 4
+    assert results[0]["counts"]["inserted"] > 0
+    assert results[0]["requests"] == {"arXiv": 1, "Semantic Scholar": 1}
+    assert results[0]["timings"]["total"] > 0
+    assert results[0]["timings"]["search index"] > 0
@@ -0,0 +1,41 @@
+import os
+import time
+import sys
+sys.path.append("..")
+from bson.objectid import ObjectId
+from bm25 import write_index, BM25Index, BM25Search, tokenize, SEARCH_INDEX_FILE
+
+DOCUMENTS = [
+    (ObjectId("645cfd573007dd700aa1fe7d"), "Handwriting recognition using artificial intelligence neural networks"),
+    (ObjectId("645cfd573007dd700aa1fe80"), "IoT-driven artificial intelligence technique for fertilizer recommendation"),
+    (ObjectId("645cfd573007dd700aa1fe81"), "Graph neural networks for recommendation, neural message passing")
+]
+
+def test_tokenize():
+    assert tokenize("IoT-Driven AI, 2023") == ["iot", "driven", "ai", "2023"]
+
+def test_bm25_index_search(tmp_path):
+    path = str(tmp_path / "search_index.bin")
+    assert write_index(path, DOCUMENTS) == 3
+    index = BM25Index(path)
+    assert index.num_docs == 3
+    assert index.search("neural networks", 10) == [DOCUMENTS[2][0], DOCUMENTS[0][0]]
+    assert index.search("Recommendation fertilizer", 1) == [DOCUMENTS[1][0]]
+    assert index.search("quantum", 10) == []
+    index.close()
+
+def test_bm25_search_reload(tmp_path):
+    path = str(tmp_path / "search_index.bin")
+    search = BM25Search(path, check_interval=0)
+    assert search("neural", 10) == []
+
+    write_index(path, DOCUMENTS[:1])
+    assert search("neural", 10) == [DOCUMENTS[0][0]]
+    # a rebuilt file is picked up on the next check
+    write_index(path, DOCUMENTS)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+    assert search("graph", 10) == [DOCUMENTS[2][0]]
+
+def test_search_index_file_is_shared():
+    # the aggregator runs from api/ and the async server from the repo root, both resolve the same file
+    assert SEARCH_INDEX_FILE == os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "search_index.bin")
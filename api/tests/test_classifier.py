@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import sys
+sys.path.append("..")
+from typing import Iterable, List, Dict, Any
+from classifier import ClassificationStage, Predictor
+
+def make_papers(abstracts: Iterable[str]) -> List[Dict[str, Any]]:
+    return [{"abstract": abstract, "topics": ["AI"]} for abstract in abstracts]
+
+def test_classification_stage_batches():
+    batches = []
+
+    def load_predictor() -> Predictor:
+        def predict(abstracts: List[str]) -> List[List[str]]:
+            batches.append(abstracts)
+            return [[abstract.upper()] for abstract in abstracts]
+        return predict
+
+    async def run() -> List[Dict[str, Any]]:
+        classifier = ClassificationStage(load_predictor, batch_size=3, flush_interval=60)
+        first, second = make_papers(["a", "b"]), make_papers(["c", "d", "e"])
+        classifier.submit(first)
+        classifier.submit(second)
+        await classifier.drain()
+        classifier.close()
+        return first + second
+
+    papers = asyncio.run(run())
+    assert batches == [["a", "b", "c"], ["d", "e"]]
+    assert [paper["topics"] for paper in papers] == [["A"], ["B"], ["C"], ["D"], ["E"]]
+
+def test_classification_stage_flush_interval():
+    classified = threading.Event()
+
+    def load_predictor() -> Predictor:
+        def predict(abstracts: List[str]) -> List[List[str]]:
+            classified.set()
+            return [["LG"] for _ in abstracts]
+        return predict
+
+    async def run() -> List[Dict[str, Any]]:
+        classifier = ClassificationStage(load_predictor, batch_size=100, flush_interval=0.01)
+        papers = make_papers(["a"])
+        classifier.submit(papers)
+        # the partial batch is classified before drain is called
+        await asyncio.sleep(0.2)
+        assert classified.is_set()
+        await classifier.drain()
+        classifier.close()
+        return papers
+
+    assert asyncio.run(run())[0]["topics"] == ["LG"]
+
+def test_classification_stage_failure():
+    def load_predictor() -> Predictor:
+        raise Exception("Mocked exception")
+
+    async def run() -> List[Dict[str, Any]]:
+        classifier = ClassificationStage(load_predictor)
+        papers = make_papers(["a"])
+        classifier.submit(papers)
+        await classifier.drain()
+        classifier.close()
+        return papers
+
+    assert asyncio.run(run())[0]["topics"] == ["AI"]
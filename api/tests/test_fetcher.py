@@ -0,0 +1,117 @@
+import time
+import asyncio
+import aiohttp
+import pytest
+from aiohttp import web
+import sys
+sys.path.append("..")
+from fetcher import AsyncFetcher, HostLimiter, get_retry_after, HOST_LIMITS, DEFAULT_HOST_LIMIT
+
+def test_host_limiter_min_interval():
+    async def run() -> float:
+        limiter = HostLimiter(max_concurrency=5, min_interval=0.05)
+        start = time.monotonic()
+        for _ in range(3):
+            async with limiter:
+                pass
+        return time.monotonic() - start
+    assert asyncio.run(run()) >= 0.1
+
+def test_host_limiter_max_concurrency():
+    in_flight = 0
+    peak = 0
+
+    async def request(limiter: HostLimiter) -> None:
+        nonlocal in_flight, peak
+        async with limiter:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    async def run() -> None:
+        limiter = HostLimiter(max_concurrency=2, min_interval=0)
+        await asyncio.gather(*[request(limiter) for _ in range(6)])
+    asyncio.run(run())
+    assert peak == 2
+
+def test_host_limiter_cancelled_while_spaced():
+    async def run() -> None:
+        limiter = HostLimiter(max_concurrency=1, min_interval=10)
+        async with limiter:
+            pass
+        # the second request waits out the interval and is cancelled before it is sent
+        waiting = asyncio.ensure_future(limiter.__aenter__())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert limiter.in_flight == 0
+    asyncio.run(run())
+
+def test_async_fetcher_get_limiter():
+    async def run() -> None:
+        fetcher = AsyncFetcher()
+        arxiv_limiter = fetcher.get_limiter("http://export.arxiv.org/api/query?search_query=cat:cs.AI")
+        assert arxiv_limiter is fetcher.get_limiter("http://export.arxiv.org/api/query?search_query=cat:cs.DB")
+        assert arxiv_limiter.min_interval == HOST_LIMITS["export.arxiv.org"]["min_interval"]
+        assert fetcher.get_limiter("http://localhost:8000/").min_interval == DEFAULT_HOST_LIMIT["min_interval"]
+    asyncio.run(run())
+
+def test_host_limiter_aimd():
+    async def run() -> None:
+        limiter = HostLimiter(max_concurrency=8, min_interval=0)
+        limiter.on_throttle(retry_after=0)
+        assert limiter.window == 4
+        assert limiter.min_interval > 0
+        # a burst of rejections within one round trip only halves the window once
+        limiter.base_latency = 10
+        limiter.on_throttle()
+        assert limiter.window == 4
+
+        limiter.base_latency = None
+        for _ in range(100):
+            limiter.on_success(0.01)
+        assert limiter.window == 8
+        assert limiter.min_interval < 0.01
+        limiter.last_decrease = 0
+        limiter.on_success(1.0)
+        assert limiter.window == 4
+    asyncio.run(run())
+
+def test_get_retry_after():
+    assert get_retry_after({"Retry-After": "5"}) == 5.0
+    assert get_retry_after({"Retry-After": "Mon, 15 May 2023 00:00:00 GMT"}) == 0.0
+    assert get_retry_after({"Retry-After": "soon"}) is None
+    assert get_retry_after({}) is None
+
+def test_async_fetcher_retries_throttled_requests():
+    statuses = [429, 503, 200]
+
+    async def handler(request: web.Request) -> web.Response:
+        status = statuses.pop(0)
+        if status != 200:
+            return web.Response(status=status, headers={"Retry-After": "0"})
+        return web.Response(body=b"data")
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+        try:
+            async with AsyncFetcher() as fetcher:
+                assert await fetcher.get(url) == b"data"
+                assert fetcher.get_limiter(url).window < DEFAULT_HOST_LIMIT["max_concurrency"]
+
+            # throttled responses past the retry budget are raised to the caller
+            statuses.extend([429, 200])
+            async with AsyncFetcher(retry_budget=0) as fetcher:
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await fetcher.get(url)
+        finally:
+            await runner.cleanup()
+    asyncio.run(run())
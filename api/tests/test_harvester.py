@@ -0,0 +1,64 @@
+import sys
+sys.path.append("..")
+from harvester import ArxivHarvest, WatermarkStore, is_known_entry
+
+TOPIC_ID = "AI"
+ENTRIES = [
+    {"id": "http://arxiv.org/abs/3", "published": "2023-05-15T17:00:00Z"},
+    {"id": "http://arxiv.org/abs/2", "published": "2023-05-14T17:00:00Z"},
+    {"id": "http://arxiv.org/abs/1", "published": "2023-05-13T17:00:00Z"}
+]
+
+def test_is_known_entry():
+    watermark = {"id": ENTRIES[1]["id"], "published": ENTRIES[1]["published"]}
+    assert not is_known_entry(ENTRIES[0], None)
+    assert not is_known_entry(ENTRIES[0], watermark)
+    assert is_known_entry(ENTRIES[1], watermark)
+    assert is_known_entry(ENTRIES[2], watermark)
+
+def test_arxiv_harvest_stops_at_watermark():
+    watermarks = WatermarkStore()
+    watermarks.update(TOPIC_ID, watermark={"id": ENTRIES[1]["id"], "published": ENTRIES[1]["published"]})
+    harvest = ArxivHarvest(TOPIC_ID, watermarks, page_size=3, max_papers=100)
+    assert "start=0&max_results=3" in harvest.get_url("http://export.arxiv.org/api/query?")
+    assert harvest.take(ENTRIES) == ENTRIES[:1]
+    assert harvest.done
+    # already ingested entries on the page are still listed upstream
+    assert harvest.listed == [ENTRIES[1]["id"], ENTRIES[2]["id"]]
+
+    harvest.end_page()
+    harvest.finish()
+    assert watermarks.get(TOPIC_ID) == {"watermark": {"id": ENTRIES[0]["id"], "published": ENTRIES[0]["published"]}}
+
+def test_arxiv_harvest_pages():
+    watermarks = WatermarkStore()
+    harvest = ArxivHarvest(TOPIC_ID, watermarks, page_size=2, max_papers=100)
+    assert harvest.take(ENTRIES[:2]) == ENTRIES[:2]
+    harvest.end_page()
+    assert not harvest.done
+    assert "start=2&max_results=2" in harvest.get_url("http://export.arxiv.org/api/query?")
+    assert watermarks.get(TOPIC_ID)["next_start"] == 2
+
+    # a short page ends the harvest
+    assert harvest.take(ENTRIES[2:]) == ENTRIES[2:]
+    harvest.end_page()
+    assert harvest.done
+    assert "next_start" not in watermarks.get(TOPIC_ID)
+
+def test_arxiv_harvest_max_papers():
+    harvest = ArxivHarvest(TOPIC_ID, WatermarkStore(), page_size=3, max_papers=2)
+    assert harvest.take(ENTRIES) == ENTRIES[:2]
+    assert harvest.done
+    assert harvest.listed == []
+
+def test_arxiv_harvest_resume(tmp_path):
+    path = str(tmp_path / "state.json")
+    watermarks = WatermarkStore(path)
+    harvest = ArxivHarvest(TOPIC_ID, watermarks, page_size=2, max_papers=100, resume=True)
+    harvest.take(ENTRIES[:2])
+    harvest.end_page()
+    watermarks.save()
+
+    harvest = ArxivHarvest(TOPIC_ID, WatermarkStore(path), page_size=2, max_papers=100, resume=True)
+    assert harvest.start == 2
+    assert ArxivHarvest(TOPIC_ID, WatermarkStore(path), page_size=2, max_papers=100).start == 0
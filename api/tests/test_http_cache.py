@@ -0,0 +1,78 @@
+import os
+import asyncio
+import pytest
+from aiohttp import web
+import sys
+sys.path.append("..")
+from http_cache import ResponseCache, normalize_url
+from fetcher import AsyncFetcher
+
+BODY = b"<feed></feed>"
+ETAG = '"v1"'
+
+def test_normalize_url():
+    url = "HTTP://Export.arXiv.org/api/query?sortBy=submittedDate&search_query=cat:cs.AI#top"
+    assert normalize_url(url) == "http://export.arxiv.org/api/query?search_query=cat%3Acs.AI&sortBy=submittedDate"
+    assert normalize_url("http://export.arxiv.org/api/query?b=2&a=1") == normalize_url("http://export.arxiv.org/api/query?a=1&b=2")
+
+def test_response_cache_record(tmp_path):
+    cache = ResponseCache(str(tmp_path), mode="revalidate")
+    url = "http://export.arxiv.org/api/query?search_query=cat:cs.AI"
+    assert cache.get_conditional_headers(url) == {}
+    with pytest.raises(KeyError):
+        list(cache.read(url))
+
+    cache.record(url, BODY, {"ETag": ETAG, "Last-Modified": "Mon, 15 May 2023 00:00:00 GMT"})
+    assert b"".join(cache.read(url)) == BODY
+    assert cache.get_conditional_headers(url) == {"If-None-Match": ETAG, "If-Modified-Since": "Mon, 15 May 2023 00:00:00 GMT"}
+    assert ResponseCache(str(tmp_path), mode="record").get_conditional_headers(url) == {}
+
+    with pytest.raises(ValueError):
+        ResponseCache(str(tmp_path), mode="invalid")
+
+def test_response_cache_concurrent_writers(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    url = "http://export.arxiv.org/api/query?search_query=cat:cs.AI"
+    first = cache.open_writer(url, {})
+    second = cache.open_writer(url, {})
+    first.write(b"first")
+    second.write(b"second")
+    # each writer only ever publishes its own complete body
+    second.commit()
+    first.discard()
+    assert b"".join(cache.read(url)) == b"second"
+    assert [name for name in os.listdir(tmp_path / "cache") if name.endswith(".tmp")] == []
+
+    ResponseCache(str(tmp_path / "off"), mode="off")
+    assert not os.path.exists(tmp_path / "off")
+
+def test_async_fetcher_revalidate_and_replay(tmp_path):
+    request_headers = []
+
+    async def handler(request: web.Request) -> web.Response:
+        request_headers.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304)
+        return web.Response(body=BODY, headers={"ETag": ETAG})
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/api/query", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}/api/query?search_query=cat:cs.AI"
+        try:
+            async with AsyncFetcher(cache=ResponseCache(str(tmp_path))) as fetcher:
+                assert await fetcher.get(url) == BODY
+                assert await fetcher.get(url) == BODY
+            assert len(request_headers) == 2
+            assert request_headers[1]["If-None-Match"] == ETAG
+        finally:
+            await runner.cleanup()
+
+        # the server is gone, replay must not touch the network
+        async with AsyncFetcher(cache=ResponseCache(str(tmp_path), mode="replay")) as fetcher:
+            assert await fetcher.get(url) == BODY
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import sys
+sys.path.append("..")
+import mongomock
+from unittest.mock import MagicMock
+from indexes import INDEXES, ensure_indexes, get_plan_summary, explain_queries
+from utils import publish_db_data
+
+def test_ensure_indexes():
+    papers_db = MagicMock()
+    users_db = MagicMock()
+    papers_db.create_index.return_value = "index"
+    users_db.create_index.return_value = "email_1"
+
+    names = ensure_indexes({"papers": papers_db, "users": users_db})
+    assert "users.email_1" in names
+    assert len(names) == len(INDEXES["papers"]) + len(INDEXES["users"])
+    users_db.create_index.assert_called_once_with([("email", 1)], unique=True)
+    papers_db.create_index.assert_any_call([("key", 1)], unique=True, partialFilterExpression={"key": {"$exists": True}})
+    papers_db.create_index.assert_any_call([("topics", 1), ("date", -1), ("_id", -1)])
+
+def test_ensure_indexes_over_legacy_documents():
+    papers_db = mongomock.MongoClient()["research"]["papers"]
+    papers_db.insert_many([
+        {"title": "legacy 1", "url": "http://arxiv.org/abs/1", "topics": ["AI"]},
+        {"title": "legacy 2", "url": "http://arxiv.org/abs/2", "topics": ["DB"]}
+    ])
+    # keyless documents would collide on the unique key index, they are removed before it is built
+    assert "papers.key_1" in ensure_indexes({"papers": papers_db})
+    assert papers_db.count_documents({}) == 0
+    paper = {"title": "new", "url": "http://arxiv.org/abs/3", "topics": ["AI"]}
+    assert publish_db_data(papers_db, [paper])["inserted"] == 1
+
+    failing_db = MagicMock()
+    failing_db.delete_many.side_effect = Exception("unauthorized")
+    assert ensure_indexes({"papers": failing_db}) == None
+
+def test_get_plan_summary():
+    index_scan = {"queryPlanner": {"winningPlan": {
+        "stage": "LIMIT",
+        "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "topics_1_date_-1__id_-1"}}
+    }}}
+    assert get_plan_summary(index_scan) == (False, "topics_1_date_-1__id_-1")
+
+    collection_scan = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}}
+    assert get_plan_summary(collection_scan) == (True, "no index")
+
+    or_plan = {"queryPlanner": {"winningPlan": {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN", "indexName": "last_seen_1"},
+        {"stage": "COLLSCAN"}
+    ]}}}}
+    assert get_plan_summary(or_plan) == (True, "last_seen_1")
+
+    lookup_plan = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "EQ_LOOKUP", "strategy": "IndexedLoopJoin", "indexName": "_id_",
+        "inputStage": {"stage": "IXSCAN", "indexName": "email_1"}}}}}
+    assert get_plan_summary(lookup_plan) == (False, "_id_, email_1")
+    lookup_plan["queryPlanner"]["winningPlan"]["queryPlan"]["strategy"] = "NestedLoopJoin"
+    assert get_plan_summary(lookup_plan)[0]
+
+    # servers that run $lookup outside the query layer explain the leading $cursor stage
+    cursor_plan = {"stages": [{"$cursor": index_scan}, {"$lookup": {"from": "papers"}}]}
+    assert get_plan_summary(cursor_plan) == (False, "topics_1_date_-1__id_-1")
+
+def test_explain_queries():
+    index_scan = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "_id_"}}}}
+    papers_db = MagicMock()
+    users_db = MagicMock()
+    papers_db.find.return_value.explain.return_value = index_scan
+    papers_db.find.return_value.sort.return_value.limit.return_value.explain.return_value = index_scan
+    users_db.database.command.side_effect = Exception("unauthorized")
+
+    report = explain_queries(papers_db, users_db)
+    assert {row["query"] for row in report if row["collection_scan"] is None} == {"bookmarks"}
+    assert all(row["collection_scan"] is False for row in report if row["query"] != "bookmarks")
+
+    # the bookmarks route's $lookup aggregation is explained, not separate finds
+    users_db.database.command.side_effect = None
+    users_db.database.command.return_value = index_scan
+    assert all(row["collection_scan"] is False for row in explain_queries(papers_db, users_db))
+    assert users_db.database.command.call_args[0] == ("aggregate", users_db.name)
+    assert users_db.database.command.call_args[1]["explain"]
+    assert "$lookup" in users_db.database.command.call_args[1]["pipeline"][-1]
@@ -0,0 +1,50 @@
+import sys
+sys.path.append("..")
+from flask import Flask
+from metrics import Histogram, AppMetrics, format_labels
+from utils import LRUCache
+
+def test_format_labels():
+    assert format_labels([], []) == ""
+    assert format_labels(["route", "stage"], ["/api/topic", 'a "b"\n']) == '{route="/api/topic",stage="a \\"b\\"\\n"}'
+
+def test_histogram():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), (0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value, "/a")
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 2.65' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+
+def test_app_metrics():
+    app = Flask(__name__)
+    metrics = AppMetrics()
+    metrics.init_app(app)
+    cache = LRUCache(1)
+    metrics.watch_cache("topic", cache)
+
+    @app.route("/api/topic/<string:id>")
+    def topic(id: str):
+        with metrics.time_stage("mongo"):
+            papers = cache.get(id)
+        if papers is None:
+            cache.put(id, id, size=len(id))
+        return id
+
+    client = app.test_client()
+    for id in ["AI", "AI", "DB"]:
+        client.get(f"/api/topic/{id}")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'api_request_duration_seconds_count{route="/api/topic/<string:id>",method="GET",status="200"} 3' in lines
+    assert 'api_stage_duration_seconds_count{route="/api/topic/<string:id>",stage="mongo"} 3' in lines
+    assert 'api_response_size_bytes_count{route="/api/topic/<string:id>"} 3' in lines
+    assert 'api_cache_requests_total{cache="topic",result="hit"} 1' in lines
+    assert 'api_cache_requests_total{cache="topic",result="miss"} 2' in lines
+    assert 'api_cache_evictions_total{cache="topic"} 1' in lines
+    assert 'api_cache_entries{cache="topic"} 1' in lines
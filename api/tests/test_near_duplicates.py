@@ -0,0 +1,91 @@
+import sqlite3
+import pytest_mock
+import sys
+sys.path.append("..")
+from near_duplicates import (NearDuplicateIndex, deduplicate_papers, merge_published_duplicates, normalize_title,
+    get_author_names, is_near_duplicate)
+
+ARXIV_PAPER = {
+    "title": "Laughing Matters: Introducing Laughing-Face Generation using Diffusion \nModels",
+    "url": "http://arxiv.org/abs/2305.08854v1",
+    "source": "arXiv.org",
+    "authors": ["Antoni Bigata Casademunt", "Rodrigo Mira", "Nikita Drobyshev"],
+    "topics": ["CV", "AI"]
+}
+SEMANTIC_SCHOLAR_PAPER = {
+    "title": "Laughing matters: introducing laughing-face generation using diffusion models.",
+    "url": "https://www.semanticscholar.org/paper/377fd63aa67e9ac1cab465ec6e7f1e2d3260c5ad",
+    "source": "SemanticScholar.org",
+    "authors": ["A. B. Casademunt", "R. Mira", "N. Drobyshev"],
+    "topics": ["LG"]
+}
+OTHER_PAPER = {
+    "title": "Developing and Evaluating an Artificial Intelligence Model for Malicious URL Detection",
+    "url": "https://www.semanticscholar.org/paper/04dec21662614458207509ba7389f75838180c5f",
+    "source": "SemanticScholar.org",
+    "authors": ["Sara Aqab"],
+    "topics": ["CR"]
+}
+
+def test_is_near_duplicate():
+    assert normalize_title(ARXIV_PAPER["title"]) == normalize_title(SEMANTIC_SCHOLAR_PAPER["title"])
+    assert get_author_names(ARXIV_PAPER["authors"]) == get_author_names(SEMANTIC_SCHOLAR_PAPER["authors"])
+    title = normalize_title(ARXIV_PAPER["title"])
+    authors = get_author_names(ARXIV_PAPER["authors"])
+    assert is_near_duplicate(title, authors, title.replace("diffusion", "diffusions"), authors)
+    assert not is_near_duplicate(title, authors, title, {"aqab"})
+    assert not is_near_duplicate(title, authors, normalize_title(OTHER_PAPER["title"]), authors)
+
+def test_deduplicate_papers():
+    papers, published_duplicates = deduplicate_papers([dict(SEMANTIC_SCHOLAR_PAPER), dict(OTHER_PAPER), dict(ARXIV_PAPER)], NearDuplicateIndex())
+    assert len(papers) == 2
+    assert not published_duplicates
+    merged = papers[0]
+    assert merged["url"] == ARXIV_PAPER["url"]
+    assert merged["source"] == "arXiv.org"
+    assert merged["sources"] == ["arXiv.org", "SemanticScholar.org"]
+    assert merged["topics"] == ["CV", "AI", "LG"]
+
+def test_deduplicate_papers_within_one_source():
+    # a series from the same authors is several papers, not copies of one
+    first = {**ARXIV_PAPER, "title": ARXIV_PAPER["title"] + " Part I"}
+    second = {**ARXIV_PAPER, "title": ARXIV_PAPER["title"] + " Part II", "url": "http://arxiv.org/abs/2305.08855v1"}
+    assert is_near_duplicate(normalize_title(first["title"]), set(), normalize_title(second["title"]), set())
+    index = NearDuplicateIndex()
+    papers, published_duplicates = deduplicate_papers([first], index)
+    papers, published_duplicates = deduplicate_papers([second], index)
+    assert papers == [second]
+    assert not published_duplicates
+    papers, _ = deduplicate_papers([dict(first), dict(second)], NearDuplicateIndex())
+    assert len(papers) == 2
+
+def test_near_duplicate_index_without_sources(tmp_path):
+    path = str(tmp_path / "near_duplicates.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE papers (key TEXT PRIMARY KEY, title TEXT NOT NULL, authors TEXT NOT NULL, added_at REAL NOT NULL)")
+    connection.commit()
+    connection.close()
+    index = NearDuplicateIndex(path)
+    index.add("arxiv:1", "title", set(), [1], "arXiv.org")
+    assert index.find("title", set(), [1], "SemanticScholar.org") == "arxiv:1"
+    assert index.find("title", set(), [1], "arXiv.org") == None
+    index.close()
+
+def test_merge_published_duplicates(mocker: pytest_mock.MockerFixture):
+    index = NearDuplicateIndex()
+    deduplicate_papers([dict(ARXIV_PAPER)], index)
+    papers, published_duplicates = deduplicate_papers([dict(SEMANTIC_SCHOLAR_PAPER), dict(OTHER_PAPER)], index)
+    assert papers == [OTHER_PAPER]
+    assert list(published_duplicates) == ["arxiv:2305.08854"]
+
+    papers_db = mocker.MagicMock()
+    papers_db.find.return_value = [dict(ARXIV_PAPER)]
+    merged = merge_published_duplicates(papers_db, published_duplicates)
+    assert len(merged) == 1
+    assert merged[0]["source"] == "arXiv.org"
+    assert merged[0]["sources"] == ["arXiv.org", "SemanticScholar.org"]
+    assert merged[0]["topics"] == ["CV", "AI", "LG"]
+
+    # the published record has expired, the duplicate becomes a new paper
+    papers_db.find.return_value = []
+    assert merge_published_duplicates(papers_db, published_duplicates)[0]["url"] == SEMANTIC_SCHOLAR_PAPER["url"]
@@ -0,0 +1,39 @@
+import os
+import time
+import pstats
+import sys
+sys.path.append("..")
+from flask import Flask
+from profiling import RequestProfiler, PROFILE_HEADER
+
+def create_app(profiler: RequestProfiler) -> Flask:
+    app = Flask(__name__)
+    profiler.init_app(app)
+
+    @app.route("/api/search/<string:query>")
+    def slow_search(query: str):
+        time.sleep(0.05)
+        return query
+    return app
+
+def test_profile_with_token(tmp_path):
+    client = create_app(RequestProfiler(str(tmp_path), token="secret")).test_client()
+    assert "X-Profile-Id" not in client.get("/api/search/neural").headers
+    assert "X-Profile-Id" not in client.get("/api/search/neural", headers={PROFILE_HEADER: "wrong"}).headers
+
+    response = client.get("/api/search/neural", headers={PROFILE_HEADER: "secret"})
+    name = response.headers["X-Profile-Id"]
+    assert name.endswith(".pstats") and "_GET_api_search_string_query_200_" in name
+    assert os.listdir(tmp_path) == [name]
+    stats = pstats.Stats(str(tmp_path / name))
+    assert any(function[2] == "slow_search" for function in stats.stats)
+
+def test_sampling_profile(tmp_path):
+    client = create_app(RequestProfiler(str(tmp_path), sample_rate=1.0, mode="sampling", max_profiles=2)).test_client()
+    names = [client.get("/api/search/neural").headers["X-Profile-Id"] for _ in range(3)]
+    # only the newest profiles are kept
+    assert sorted(os.listdir(tmp_path)) == names[1:]
+    with open(tmp_path / names[-1]) as file:
+        stacks = [line.rsplit(" ", 1) for line in file.read().splitlines()]
+    assert any(stack.endswith("test_profiling.py:slow_search") for stack, _ in stacks)
+    assert all(int(count) > 0 for _, count in stacks)
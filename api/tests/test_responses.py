@@ -0,0 +1,39 @@
+import gzip
+from flask import Flask
+from bson.objectid import ObjectId
+import sys
+sys.path.append("..")
+from responses import encode_papers, send_encoded, GZIP_MIN_SIZE
+
+APP = Flask(__name__)
+PAPERS = [
+    {"_id": ObjectId("645cfd573007dd700aa1fe7d"), "title": "first", "abstract": "a" * GZIP_MIN_SIZE, "topics": ["AI"]},
+    {"_id": ObjectId("645cfd573007dd700aa1fe80"), "title": "second", "abstract": "b", "topics": ["AI"]}
+]
+
+def test_encode_papers():
+    encoded = encode_papers(PAPERS)
+    assert encoded.body.startswith(b'{"645cfd573007dd700aa1fe7d":{"_id":"645cfd573007dd700aa1fe7d"')
+    assert gzip.decompress(encoded.gzip_body) == encoded.body
+    assert encoded.size == len(encoded.body) + len(encoded.gzip_body)
+    assert encoded.etag == encode_papers(PAPERS).etag
+    assert encode_papers(PAPERS[1:]).gzip_body is None
+
+def test_send_encoded():
+    encoded = encode_papers(PAPERS)
+    with APP.test_request_context():
+        response = send_encoded(encoded)
+        assert response.status_code == 200
+        assert response.get_data() == encoded.body
+        assert response.headers["ETag"] == f'"{encoded.etag}"'
+
+    with APP.test_request_context(headers={"Accept-Encoding": "gzip, deflate"}):
+        response = send_encoded(encoded)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.get_data() == encoded.gzip_body
+        assert response.headers["ETag"] == f'"{encoded.etag}-gzip"'
+
+    with APP.test_request_context(headers={"If-None-Match": f'"{encoded.etag}"'}):
+        response = send_encoded(encoded)
+        assert response.status_code == 304
+        assert response.get_data() == b""
@@ -0,0 +1,30 @@
+import sys
+sys.path.append("..")
+from scheduler import RefreshScheduler, ScheduleStore, MIN_REFRESH_INTERVAL, MAX_REFRESH_INTERVAL, REQUESTS_PER_REFRESH, SECONDS_PER_HOUR
+
+TOPIC_IDS = ["LG", "CV", "GT"]
+
+def test_refresh_scheduler_adapts_to_arrival_rate():
+    scheduler = RefreshScheduler(TOPIC_IDS, ScheduleStore())
+    assert scheduler.get_due_topics(now=0) == TOPIC_IDS
+    scheduler.record({id: 25 for id in TOPIC_IDS}, now=0)
+    assert scheduler.get_due_topics(now=0) == []
+    assert scheduler.get_due_topics(now=MIN_REFRESH_INTERVAL) == TOPIC_IDS
+
+    # a busy category is refreshed often, a category without new papers waits the longest interval
+    scheduler.record({"LG": 40, "CV": 5, "GT": 0}, now=SECONDS_PER_HOUR)
+    assert scheduler.state.get("LG")["next_refresh"] == SECONDS_PER_HOUR + MIN_REFRESH_INTERVAL
+    assert scheduler.state.get("CV")["next_refresh"] == 3 * SECONDS_PER_HOUR
+    assert scheduler.state.get("GT")["next_refresh"] == SECONDS_PER_HOUR + MAX_REFRESH_INTERVAL
+
+    scheduler.defer(["CV"], now=SECONDS_PER_HOUR)
+    assert scheduler.state.get("CV")["next_refresh"] == SECONDS_PER_HOUR + MIN_REFRESH_INTERVAL
+
+def test_refresh_scheduler_request_budget():
+    scheduler = RefreshScheduler(TOPIC_IDS, ScheduleStore(), request_budget=2 * REQUESTS_PER_REFRESH)
+    scheduler.last_refill = 0
+    assert scheduler.get_due_topics(now=0) == TOPIC_IDS[:2]
+    assert scheduler.get_due_topics(now=0) == []
+    scheduler.record({"LG": 25, "CV": 25}, now=0)
+    assert scheduler.get_sleep_time(now=0) == SECONDS_PER_HOUR / 2
+    assert scheduler.get_due_topics(now=SECONDS_PER_HOUR / 2) == TOPIC_IDS[2:]
@@ -0,0 +1,8 @@
+import sys
+sys.path.append("..")
+from search import normalize_query
+
+def test_normalize_query():
+    assert normalize_query("Neural  Networks") == "networks neural"
+    assert normalize_query("networks, NEURAL networks!") == "networks neural"
+    assert normalize_query("") == ""
@@ -0,0 +1,59 @@
+import time
+import sys
+sys.path.append("..")
+from seen_store import SeenStore, LayeredSeenStore, SECONDS_PER_DAY
+
+PAPER_ID = "http://arxiv.org/abs/2305.08854v1"
+
+def test_seen_store_contains():
+    seen_store = SeenStore()
+    assert PAPER_ID not in seen_store
+    seen_store.add(PAPER_ID)
+    seen_store.add(PAPER_ID)
+    assert PAPER_ID in seen_store
+    assert "http://arxiv.org/abs/2305.08854v2" not in seen_store
+    assert len(seen_store) == 1
+
+def test_seen_store_persistence(tmp_path):
+    path = str(tmp_path / "seen.db")
+    seen_store = SeenStore(path)
+    seen_store.add(PAPER_ID)
+    seen_store.close()
+    assert PAPER_ID not in SeenStore(path)
+
+    seen_store = SeenStore(path)
+    seen_store.add(PAPER_ID)
+    seen_store.commit()
+    seen_store.close()
+    assert PAPER_ID in SeenStore(path)
+
+def test_seen_store_expire(tmp_path):
+    path = str(tmp_path / "seen.db")
+    seen_store = SeenStore(path)
+    seen_store.add(PAPER_ID)
+    seen_store.connection.execute("UPDATE seen SET seen_at = ?", (time.time() - 10 * SECONDS_PER_DAY,))
+    seen_store.add("http://arxiv.org/abs/2305.08855v1")
+    seen_store.commit()
+    seen_store.close()
+
+    seen_store = SeenStore(path, max_age_days=7)
+    assert PAPER_ID not in seen_store
+    assert "http://arxiv.org/abs/2305.08855v1" in seen_store
+
+def test_layered_seen_store(tmp_path):
+    path = str(tmp_path / "seen.db")
+    seen_store = SeenStore(path)
+    seen_store.add(PAPER_ID)
+    seen_store.commit()
+
+    # a worker sees committed ids but its own additions never reach the shared file
+    layered_store = LayeredSeenStore(path)
+    assert PAPER_ID in layered_store
+    layered_store.add("http://arxiv.org/abs/2305.08854v2")
+    layered_store.add("http://arxiv.org/abs/2305.08854v2")
+    assert "http://arxiv.org/abs/2305.08854v2" in layered_store
+    assert layered_store.added == ["http://arxiv.org/abs/2305.08854v2"]
+    assert "http://arxiv.org/abs/2305.08854v2" not in seen_store
+    layered_store.close()
+    seen_store.close()
+    assert LayeredSeenStore(str(tmp_path / "missing.db")).base is None
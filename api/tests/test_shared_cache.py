@@ -0,0 +1,72 @@
+import time
+import pytest_mock
+import sys
+sys.path.append("..")
+from bson.objectid import ObjectId
+from shared_cache import SharedCache
+from responses import encode_papers
+
+def test_shared_cache(tmp_path):
+    path = str(tmp_path / "topic.db")
+    cache = SharedCache(path, 3)
+    for id in ["AI", "DB", "DS"]:
+        cache.put(id, [{"topics": [id]}])
+    # another worker reads and evicts the same entries
+    other_cache = SharedCache(path, 3)
+    assert other_cache.get("AI") == [{"topics": ["AI"]}]
+    other_cache.put("LG", [{"topics": ["LG"]}])
+    assert cache.get("LG") == [{"topics": ["LG"]}]
+    assert len(cache) == 3
+    assert other_cache.evictions == 1
+
+    ranked_ids = [ObjectId(), ObjectId()]
+    cache.put("ranking", ranked_ids)
+    assert other_cache.get("ranking") == ranked_ids
+    encoded = encode_papers([{"_id": ranked_ids[0], "title": "a" * 2000}])
+    cache.put("page", (encoded, "cursor"))
+    cached_encoded, cursor = other_cache.get("page")
+    assert (cached_encoded.body, cached_encoded.gzip_body, cached_encoded.etag, cursor) == (encoded.body, encoded.gzip_body, encoded.etag, "cursor")
+
+def test_shared_cache_lru_order(tmp_path, mocker: pytest_mock.MockFixture):
+    cache = SharedCache(str(tmp_path / "topic.db"), 2)
+    now = time.time()
+    mocker.patch("time.time", return_value=now)
+    cache.put("AI", 1)
+    cache.put("DB", 2)
+    mocker.patch("time.time", return_value=now + 10)
+    assert cache.get("AI") == 1
+    cache.put("LG", 3)
+    assert cache.get("DB") is None
+    assert cache.get("AI") == 1
+
+def test_shared_cache_ttl_and_max_bytes(tmp_path, mocker: pytest_mock.MockFixture):
+    cache = SharedCache(str(tmp_path / "topic.db"), 38, ttl=60)
+    cache.put("AI", {"topics": ["AI"]})
+    assert cache.get("AI") == {"topics": ["AI"]}
+    mocker.patch("time.time", return_value=time.time() + 61)
+    assert cache.get("AI") is None
+    mocker.stopall()
+
+    cache = SharedCache(str(tmp_path / "search.db"), 38, max_bytes=200)
+    cache.put("AI", "a" * 90)
+    cache.put("DB", "b" * 90)
+    assert cache.get("AI") is None
+    assert cache.get("DB") is not None
+    # an entry larger than the whole cache is never stored
+    cache.put("LG", "c" * 300)
+    assert cache.get("LG") is None
+    assert cache.get("DB") is not None
+
+def test_shared_cache_generation(tmp_path):
+    path = str(tmp_path / "topic.db")
+    cache = SharedCache(path, 38)
+    other_cache = SharedCache(path, 38)
+    cache.set_generation("1")
+    cache.put("AI", 1)
+    # a worker catching up to the generation another worker already stored keeps the entries
+    other_cache.set_generation("1")
+    assert other_cache.get("AI") == 1
+    other_cache.set_generation("2")
+    assert cache.get("AI") is None
+    cache.set_generation(None)
+    assert other_cache.generation == "2"
@@ -1,8 +1,11 @@
+import time
 import pymongo
+import mongomock
 import pytest_mock
 import sys
 sys.path.append("..")
-from utils import get_env_var, get_db_connection, upload_db_data, LRUCache, topics
+from utils import (get_env_var, get_db_connection, check_db_connection, upload_db_data, publish_db_data, get_paper_key, get_generation,
+    get_topic_feed_query, LRUCache, topics, PAPERS_GENERATION_ID)
 
 def test_get_env_var_with_jwt_key(mocker: pytest_mock.MockFixture):
     mocker.patch.dict("os.environ", {
@@ -26,14 +29,28 @@ def test_get_env_var_without_jwt_key(mocker: pytest_mock.MockFixture):
 
 def test_get_db_connection():
     username, password = get_env_var()
-    assert get_db_connection(username, password, "example_collection") == None
-    assert get_db_connection("username", "password", "example_collection") == None
+    assert check_db_connection(get_db_connection(username, password, "example_collection")) == False
+    assert check_db_connection(get_db_connection("username", "password", "example_collection")) == False
 
     papers_db = get_db_connection(username, password, "papers")
     users_db = get_db_connection(username, password, "users")
-    assert papers_db != None and users_db != None
+    assert check_db_connection(papers_db) and check_db_connection(users_db)
     assert type(papers_db) == pymongo.collection.Collection and type(users_db) == pymongo.collection.Collection
 
+def test_get_db_client(mocker: pytest_mock.MockFixture):
+    mocker.patch.dict("os.environ", {"MONGODB_URI": "mongodb://localhost:1", "MONGODB_SERVER_SELECTION_TIMEOUT_MS": "100"})
+    # collections share one client, which doesn't connect until first used
+    papers_db = get_db_connection("username", "password", "papers")
+    users_db = get_db_connection("username", "password", "users")
+    assert papers_db.database.client is users_db.database.client
+    assert papers_db.database.name == "research"
+    assert papers_db.database.client.options.pool_options.max_pool_size == 100
+    assert check_db_connection(papers_db) == False
+
+    # a forked worker gets its own client
+    mocker.patch("os.getpid", return_value=-1)
+    assert get_db_connection("username", "password", "papers").database.client is not papers_db.database.client
+
 def test_upload_db_data_(mocker: pytest_mock.MockFixture):
     username, password = get_env_var()
     papers_db = get_db_connection(username, password, "papers")
@@ -48,6 +65,70 @@ def test_upload_db_data_(mocker: pytest_mock.MockFixture):
     papers_db.delete_many.assert_called_once_with({})
     papers_db.insert_many.assert_called_once_with([paper])
 
+def test_get_paper_key():
+    assert get_paper_key({"url": "http://arxiv.org/abs/2305.08854v1"}) == "arxiv:2305.08854"
+    assert get_paper_key({"url": "http://arxiv.org/abs/2305.08854v2"}) == "arxiv:2305.08854"
+    assert get_paper_key({"url": "https://www.semanticscholar.org/paper/04dec21662614458207509ba7389f75838180c5f"}) == "s2:04dec21662614458207509ba7389f75838180c5f"
+    assert get_paper_key({"url": "https://example.com/paper"}) == "url:https://example.com/paper"
+
+def test_publish_db_data(mocker: pytest_mock.MockFixture):
+    unchanged_paper = {"title": "unchanged", "url": "http://arxiv.org/abs/1", "topics": ["AI"]}
+    updated_paper = {"title": "updated", "url": "http://arxiv.org/abs/2", "topics": ["AI", "LG"]}
+    new_paper = {"title": "new", "url": "http://arxiv.org/abs/3", "topics": ["DB"]}
+    papers_db = mocker.MagicMock()
+    papers_db.find.return_value = [
+        {**unchanged_paper, "key": "arxiv:1"},
+        {**updated_paper, "topics": ["AI"], "key": "arxiv:2"}
+    ]
+    papers_db.delete_many.return_value.deleted_count = 4
+
+    assert publish_db_data(None, [new_paper]) == None
+    # papers skipped upstream as already ingested have their last_seen refreshed with the unchanged ones
+    counts = publish_db_data(papers_db, [unchanged_paper, updated_paper, new_paper], seen_keys=["arxiv:4"])
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 2, "expired": 4}
+
+    operations = papers_db.bulk_write.call_args[0][0]
+    assert papers_db.bulk_write.call_args[1] == {"ordered": False}
+    assert len(operations) == 3
+    assert type(operations[0]) == pymongo.UpdateOne
+    assert operations[0]._doc["$set"]["topics"] == ["AI", "LG"]
+    assert "title" not in operations[0]._doc["$set"]
+    assert type(operations[1]) == pymongo.InsertOne
+    assert operations[1]._doc["key"] == "arxiv:3"
+    assert type(operations[2]) == pymongo.UpdateMany
+    assert operations[2]._filter == {"key": {"$in": ["arxiv:1", "arxiv:4"]}}
+
+    # every publish moves the generation marker readers cache against
+    meta_db = papers_db.database.__getitem__.return_value
+    assert meta_db.update_one.call_args[0][0] == {"_id": PAPERS_GENERATION_ID}
+    assert meta_db.update_one.call_args[1] == {"upsert": True}
+
+def test_publish_db_data_repeated():
+    papers_db = mongomock.MongoClient()["research"]["papers"]
+    paper = {"title": "new", "url": "http://arxiv.org/abs/3", "topics": ["AI"]}
+    assert publish_db_data(papers_db, [paper]) == {"inserted": 1, "updated": 0, "unchanged": 0, "expired": 0}
+    assert publish_db_data(papers_db, [paper]) == {"inserted": 0, "updated": 0, "unchanged": 1, "expired": 0}
+    # a refresh without new papers still succeeds
+    assert publish_db_data(papers_db, [], seen_keys=["arxiv:3"]) == {"inserted": 0, "updated": 0, "unchanged": 1, "expired": 0}
+    assert [document["key"] for document in papers_db.find()] == ["arxiv:3"]
+
+def test_get_topic_feed_query():
+    papers_db = mongomock.MongoClient()["research"]["papers"]
+    papers_db.insert_many([
+        {"date": "2023-05-15", "topics": ["AI"]},
+        {"date": "2023-05-14", "topics": ["AI", "LG"]},
+        {"date": "2023-05-13", "topics": ["LG"]}
+    ])
+    # papers listed under several topics appear in each of their feeds
+    assert get_topic_feed_query("AI") == {"topics": "AI"}
+    assert [paper["date"] for paper in papers_db.find(get_topic_feed_query("AI"))] == ["2023-05-15", "2023-05-14"]
+    assert papers_db.count_documents(get_topic_feed_query("LG")) == 2
+
+    first = papers_db.find_one({"date": "2023-05-15"})
+    query = get_topic_feed_query("AI", f"2023-05-15_{first['_id']}")
+    assert [paper["date"] for paper in papers_db.find(query)] == ["2023-05-14"]
+    assert get_topic_feed_query("AI", "2023-05-15_invalid") == None
+
 def test_lru_cache():
     lru_cache = LRUCache(3)
     lru_cache.put("AI", [{"_id": {"topics": ["AI"]}}])
@@ -61,6 +142,47 @@ def test_lru_cache():
     lru_cache.put("OS", [{"_id": {"topics": ["OS"]}}])
     assert lru_cache.get("DS") == None
     assert lru_cache.get("DB") == [{"_id1": {"topics": ["DB"]}, "_id2": {"topics": ["DB"]}}]
+    # replacing an entry isn't an eviction
+    assert (lru_cache.hits, lru_cache.misses, lru_cache.evictions) == (2, 2, 2)
+
+def test_lru_cache_ttl_and_max_bytes(mocker: pytest_mock.MockFixture):
+    lru_cache = LRUCache(38, ttl=60)
+    lru_cache.put("AI", {"_id": {"topics": ["AI"]}})
+    assert lru_cache.get("AI") == {"_id": {"topics": ["AI"]}}
+    mocker.patch("time.monotonic", return_value=time.monotonic() + 61)
+    assert lru_cache.get("AI") == None
+    mocker.stopall()
+
+    lru_cache = LRUCache(38, max_bytes=100)
+    lru_cache.put("AI", {"_id": {"title": "a" * 40}})
+    lru_cache.put("DB", {"_id": {"title": "b" * 40}})
+    assert lru_cache.get("AI") == None
+    assert lru_cache.get("DB") != None
+    # an entry larger than the whole cache is never stored
+    lru_cache.put("LG", {"_id": {"title": "c" * 200}})
+    assert lru_cache.get("LG") == None
+    assert lru_cache.get("DB") != None
+
+def test_lru_cache_generation(mocker: pytest_mock.MockFixture):
+    papers_db = mocker.MagicMock()
+    meta_db = papers_db.database.__getitem__.return_value
+    meta_db.find_one.return_value = {"_id": PAPERS_GENERATION_ID, "generation": "1"}
+    assert get_generation(papers_db) == "1"
+
+    lru_cache = LRUCache(38)
+    lru_cache.sync_generation(papers_db)
+    lru_cache.put("AI", {"_id": {"topics": ["AI"]}})
+    meta_db.find_one.return_value = {"_id": PAPERS_GENERATION_ID, "generation": "2"}
+    # the marker is only polled once per interval
+    lru_cache.sync_generation(papers_db)
+    assert lru_cache.get("AI") != None
+    lru_cache.sync_generation(papers_db, interval=0)
+    assert lru_cache.get("AI") == None
+
+    lru_cache.put("AI", {"_id": {"topics": ["AI"]}})
+    meta_db.find_one.side_effect = Exception("unreachable")
+    lru_cache.sync_generation(papers_db, interval=0)
+    assert lru_cache.get("AI") != None
 
 def test_topics_list():
     verify = ["AI", "AR", "CC", "CE", "CG", "CL", "CR", "CV", "CY", "DB", "DC", "DL",
@@ -0,0 +1,43 @@
+import time
+import sys
+sys.path.append("..")
+from work_queue import WorkQueue, MAX_JOB_ATTEMPTS
+
+RUN = "run"
+
+def test_work_queue_claim_and_complete(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue(RUN, [{"id": "AI"}, {"id": "LG"}])
+    first = queue.claim("worker-1")
+    second = queue.claim("worker-2")
+    assert first["payload"] == {"id": "AI"}
+    assert second["payload"] == {"id": "LG"}
+    assert queue.claim("worker-3") is None
+
+    # only the lease owner can complete a job
+    assert not queue.complete(first["id"], "worker-2", {"papers": []})
+    assert queue.complete(first["id"], "worker-1", {"papers": [1]})
+    assert not queue.is_finished(RUN)
+    queue.fail(second["id"], "worker-2", "error")
+    assert queue.claim("worker-3")["payload"] == {"id": "LG"}
+    queue.close()
+
+    # a second connection sees the same queue, as another process or host would
+    other = WorkQueue(str(tmp_path / "queue.db"))
+    assert other.get_results(RUN) == [{"papers": [1]}]
+    other.delete_run(RUN)
+    assert other.is_finished(RUN)
+    other.close()
+
+def test_work_queue_expired_lease(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue(RUN, [{"id": "AI"}])
+    for attempt in range(MAX_JOB_ATTEMPTS):
+        # a worker that dies holding the lease loses the job once the lease expires
+        job = queue.claim(f"worker-{attempt}", lease_seconds=0)
+        assert job is not None
+        time.sleep(0.01)
+    assert queue.claim("worker") is None
+    assert queue.is_finished(RUN)
+    assert queue.get_failures(RUN) == [{"payload": {"id": "AI"}, "error": "lease expired"}]
+    queue.close()
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Optional, List, Dict, Any
+
+JOB_LEASE_SECONDS = 300
+MAX_JOB_ATTEMPTS = 3
+BUSY_TIMEOUT = 30
+
+class WorkQueue:
+    # durable job queue shared by the processes of one or more hosts, a job is owned by whoever holds its lease
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        # wal needs shared memory that network filesystems don't provide, so hosts sharing the file
+        # use the rollback journal and serialise every claim with BEGIN IMMEDIATE
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, run TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+            "owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run)")
+
+    def enqueue(self, run: str, payloads: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany("INSERT INTO jobs (run, payload, status) VALUES (?, ?, 'pending')", [(run, json.dumps(payload)) for payload in payloads])
+            self.connection.execute("COMMIT")
+
+    def expire_leases(self, now: float) -> None:
+        # the owner of an expired lease is presumed dead, its job is retried or given up
+        self.connection.execute("UPDATE jobs SET status = 'failed', error = 'lease expired' WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, MAX_JOB_ATTEMPTS))
+        self.connection.execute("UPDATE jobs SET status = 'pending', owner = NULL WHERE status = 'leased' AND lease_expires < ?", (now,))
+
+    def claim(self, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            # the write lock is taken up front so two workers can't claim the same job
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.expire_leases(now)
+                row = self.connection.execute("SELECT id, run, payload FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                        (owner, now + lease_seconds, row[0])
+                    )
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "run": row[1], "payload": json.loads(row[2])}
+
+    def renew(self, id: int, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + lease_seconds, id, owner)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, id: int, owner: str, result: Any) -> bool:
+        # a worker whose lease was taken over doesn't overwrite the new owner's result
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'done', result = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (json.dumps(result), id, owner)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, id: int, owner: str, error: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL, error = ? "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                (MAX_JOB_ATTEMPTS, error, id, owner)
+            )
+
+    def is_finished(self, run: str) -> bool:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.expire_leases(time.time())
+                row = self.connection.execute("SELECT COUNT(*) FROM jobs WHERE run = ? AND status IN ('pending', 'leased')", (run,)).fetchone()
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return row[0] == 0
+
+    def get_results(self, run: str) -> List[Any]:
+        with self.lock:
+            rows = self.connection.execute("SELECT result FROM jobs WHERE run = ? AND status = 'done' ORDER BY id", (run,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_failures(self, run: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute("SELECT payload, error FROM jobs WHERE run = ? AND status = 'failed' ORDER BY id", (run,)).fetchall()
+        return [{"payload": json.loads(row[0]), "error": row[1]} for row in rows]
+
+    def delete_run(self, run: str) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE run = ?", (run,))
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()